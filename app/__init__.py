@@ -21,6 +21,11 @@ def create_app(config_class=Config):
     
     app.config.from_object(config_class)
     
+    # Pool sizing only applies to URIs that use a QueuePool
+    from app.utils.sqlite_profile import pool_options
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {**pool_options(app.config),
+                                               **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
+    
     # Initialize Flask extensions
     db.init_app(app)
     migrate.init_app(app, db)
@@ -29,15 +34,69 @@ def create_app(config_class=Config):
     # Import models to ensure they are known to Flask-Migrate
     # This import is placed here to avoid circular dependencies
     with app.app_context():
-        from app.models import user, project, event
+        # Apply the SQLite performance profile and log the effective pragmas
+        from app.utils.sqlite_profile import configure_sqlite
+        configure_sqlite(app, db.engine)
+        
+        from app.models import user, project, event, ingest, rollup, session, insights
+        
+        # Configure the ingest hot path caches
+        from app.services.event_processing import (tracking_id_cache, message_deduplicator, admission_control,
+                                                   EventProcessingService)
+        from app.services.identity import identity_resolver
+        tracking_id_cache.init_app(app)
+        message_deduplicator.init_app(app)
+        admission_control.init_app(app)
+        identity_resolver.init_app(app)
+        from app.services.sketches import IdentitySketchService
+        IdentitySketchService.init_app(app)
+        
+        # Incremental sessions, saved by a background thread
+        from app.services.sessions import sessionizer
+        sessionizer.init_app(app)
+        
+        # Anomaly baselines over the hourly rollups, checked by a background thread
+        from app.services.anomalies import anomaly_detector
+        anomaly_detector.init_app(app)
+        
+        # Sentiment of feedback properties, scored by a background thread
+        from app.services.sentiment import sentiment_analyzer, feedback_scorer
+        sentiment_analyzer.init_app(app)
+        feedback_scorer.init_app(app)
+        
+        # Replay unloaded ingest log segments (after the consumers above, so
+        # recovered events are sessionized and scored), then start the
+        # write-behind flusher when INGEST_WRITE_BEHIND is enabled
+        from app.services.ingest_log import ingest_log
+        from app.services.ingest_buffer import ingest_buffer
+        ingest_log.init_app(app, EventProcessingService.insert_events)
+        flush_func = ingest_log.flush_rows if ingest_log.enabled else EventProcessingService.store_events
+        ingest_buffer.init_app(app, flush_func)
+        
+        # Cache for analytics query results
+        from app.services.analytics import analytics_cache
+        analytics_cache.init_app(app)
+        
+        # Columnar segments of closed days for heavy scans
+        from app.services.segments import event_segments
+        event_segments.init_app(app)
+        
+        # Thread pool for the analytics page's concurrent queries
+        from app.services.query_executor import query_executor
+        query_executor.init_app(app)
     
         # Register blueprints
-        from app.routes import auth, dashboard, project, events, landing
+        from app.routes import auth, dashboard, project, events, landing, analytics_api
         app.register_blueprint(auth.bp)
         app.register_blueprint(dashboard.bp)
         app.register_blueprint(project.bp)
         app.register_blueprint(events.bp)
         app.register_blueprint(landing.bp)
+        app.register_blueprint(analytics_api.bp)
+    
+    # Register CLI commands (flask events import ...)
+    from app.cli import register_cli
+    register_cli(app)
     
     # Create a default route
     @app.route('/')
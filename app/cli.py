@@ -0,0 +1,162 @@
+import csv
+import click
+from app.models import db
+from app.models.project import Project
+from app.services.event_processing import EventProcessingService
+from app.services.backfill import BackfillImporter
+from app.services.rollups import RollupService
+from app.services.sketches import IdentitySketchService
+from app.services.project_stats import ProjectStatsService
+from app.services.segments import event_segments
+from app.services.sessions import sessionizer
+from app.services.anomalies import AnomalyDetector
+from app.services.sentiment import SentimentAnalyzer, feedback_scorer
+
+def register_cli(app):
+    """Register the custom `flask` CLI commands"""
+
+    @app.cli.group()
+    def events():
+        """Event data maintenance commands"""
+        pass
+
+    def find_project(project_ref):
+        """Look a project up by tracking ID or numeric id"""
+        project = Project.query.filter_by(tracking_id=project_ref).first()
+        if project is None and project_ref.isdigit():
+            project = Project.query.get(int(project_ref))
+        if project is None:
+            raise click.ClickException(f"Project not found: {project_ref}")
+        return project
+
+    def invalidate_analytics(project_id):
+        """Bump data versions so cached analytics of rebuilt projects are recomputed"""
+        project_ids = [project_id] if project_id else [row.id for row in Project.query.with_entities(Project.id)]
+        EventProcessingService.bump_data_versions(project_ids)
+        db.session.commit()
+
+    @events.command('import')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--project', 'project_ref', required=True, help='Project id or tracking ID to import into')
+    @click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default=None,
+                  help='Input format (default: guessed from the file name)')
+    @click.option('--chunk-size', default=5000, show_default=True, help='Events per transaction')
+    def import_events(path, project_ref, fmt, chunk_size):
+        """Backfill historical events from an NDJSON or CSV file (optionally gzipped)"""
+        project = find_project(project_ref)
+
+        def progress(imported, rejected):
+            click.echo(f"  {imported} events imported, {rejected} rejected")
+
+        importer = BackfillImporter(project, chunk_size=chunk_size, progress=progress)
+        with open(path, 'rb') as stream:
+            summary = importer.run(stream, fmt or BackfillImporter.detect_format(path))
+
+        for error in summary['errors']:
+            click.echo(f"  line {error['line']}: {error['message']}", err=True)
+        click.echo(f"Imported {summary['imported']} events into '{project.name}' ({summary['rejected']} rejected)")
+
+    @events.command('rebuild-rollups')
+    @click.option('--project', 'project_ref', default=None, help='Project id or tracking ID (default: all projects)')
+    @click.option('--since', type=click.DateTime(), default=None, help='First day to recompute (UTC)')
+    @click.option('--until', type=click.DateTime(), default=None, help='Day after the last one to recompute (UTC)')
+    def rebuild_rollups(project_ref, since, until):
+        """Recompute the hourly and daily event rollups from raw events"""
+        project_id = find_project(project_ref).id if project_ref else None
+        total = RollupService.rebuild(project_id, since, until)
+        invalidate_analytics(project_id)
+        click.echo(f"Rebuilt rollups from {total} events")
+
+    @events.command('rebuild-sketches')
+    @click.option('--project', 'project_ref', default=None, help='Project id or tracking ID (default: all projects)')
+    def rebuild_sketches(project_ref):
+        """Recompute the active-user HyperLogLog sketches from raw events"""
+        project_id = find_project(project_ref).id if project_ref else None
+        total = IdentitySketchService.rebuild(project_id)
+        invalidate_analytics(project_id)
+        click.echo(f"Rebuilt identity sketches from {total} events")
+
+    @events.command('recount-projects')
+    @click.option('--project', 'project_ref', default=None, help='Project id or tracking ID (default: all projects)')
+    def recount_projects(project_ref):
+        """Recompute the stored event and user totals of projects from raw events"""
+        project_id = find_project(project_ref).id if project_ref else None
+        total = ProjectStatsService.rebuild(project_id)
+        click.echo(f"Recounted {total} projects")
+
+    @events.command('compact-segments')
+    @click.option('--project', 'project_ref', default=None, help='Project id or tracking ID (default: all projects)')
+    @click.option('--since', type=click.DateTime(), default=None, help='First day to compact (UTC)')
+    @click.option('--until', type=click.DateTime(), default=None, help='Day after the last one to compact (UTC, at most today)')
+    @click.option('--force', is_flag=True, help='Rewrite segments that are still current')
+    def compact_segments(project_ref, since, until, force):
+        """Write columnar segments for closed days that have none or a stale one"""
+        projects = [find_project(project_ref)] if project_ref else Project.query.all()
+        for project in projects:
+            days, rows = event_segments.compact(project.id, since, until, force)
+            if days:
+                click.echo(f"  {project.name}: {days} days, {rows} events")
+        click.echo(f"Compacted segments of {len(projects)} projects")
+
+    @events.command('resessionize')
+    @click.option('--project', 'project_ref', default=None, help='Project id or tracking ID (default: all projects)')
+    @click.option('--since', type=click.DateTime(), default=None,
+                  help='Rebuild sessions from this time on (UTC, default: all events)')
+    def resessionize(project_ref, since):
+        """Recompute sessions from raw events, e.g. after a backfill"""
+        projects = [find_project(project_ref)] if project_ref else Project.query.all()
+        for project in projects:
+            sessions = sessionizer.rebuild(project.id, since)
+            click.echo(f"  {project.name}: {sessions} sessions")
+            invalidate_analytics(project.id)
+        click.echo(f"Resessionized {len(projects)} projects")
+
+    @events.command('detect-anomalies')
+    @click.option('--project', 'project_ref', default=None, help='Project id or tracking ID (default: all projects)')
+    @click.option('--rebuild', is_flag=True, help='Drop the baselines and detected anomalies and learn them again')
+    def detect_anomalies(project_ref, rebuild):
+        """Check the hours closed since the last run for anomalies"""
+        projects = [find_project(project_ref)] if project_ref else Project.query.all()
+        for project in projects:
+            if rebuild:
+                AnomalyDetector.reset(project.id)
+            found = AnomalyDetector.update(project.id)
+            click.echo(f"  {project.name}: {found} anomalies")
+        click.echo(f"Checked {len(projects)} projects for anomalies")
+
+    @events.command('score-sentiment')
+    def score_sentiment():
+        """Score the feedback of events stored since the last scoring pass"""
+        if not feedback_scorer.properties:
+            raise click.ClickException("SENTIMENT_PROPERTIES names no feedback properties")
+        scored = feedback_scorer.score_new()
+        click.echo(f"Scored {scored} feedback texts")
+
+    @events.command('rescore-sentiment')
+    @click.option('--project', 'project_ref', default=None, help='Project id or tracking ID (default: all projects)')
+    def rescore_sentiment(project_ref):
+        """Score already scored feedback again, e.g. after training a sentiment model"""
+        if not feedback_scorer.properties:
+            raise click.ClickException("SENTIMENT_PROPERTIES names no feedback properties")
+        projects = [find_project(project_ref)] if project_ref else Project.query.all()
+        for project in projects:
+            scored = feedback_scorer.rescore(project.id)
+            click.echo(f"  {project.name}: {scored} feedback texts")
+            invalidate_analytics(project.id)
+        click.echo(f"Rescored {len(projects)} projects")
+
+    @events.command('train-sentiment')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--output', required=True, type=click.Path(dir_okay=False),
+                  help='Where to write the model weights as JSON (then set SENTIMENT_MODEL_PATH to it)')
+    def train_sentiment(path, output):
+        """Train a sentiment classifier on a CSV file with text and label (positive, neutral, negative) columns"""
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = [row for row in csv.DictReader(f) if (row.get('text') or '').strip()]
+        try:
+            model = SentimentAnalyzer.train([row['text'] for row in rows],
+                                            [(row.get('label') or '').strip().lower() for row in rows])
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        SentimentAnalyzer.save_model(model, output)
+        click.echo(f"Trained on {len(rows)} texts, saved to {output}")
@@ -1,4 +1,5 @@
 import os
+import json
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -27,6 +28,20 @@ class Config:
     SQLALCHEMY_DATABASE_URI = f'sqlite:///{instance_db_path}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Connection pool options, passed to the engine by create_app only when its
+    # URI uses a QueuePool (file-based SQLite and server databases)
+    SQLALCHEMY_POOL_SIZE = int(os.environ.get('SQLALCHEMY_POOL_SIZE', 10))
+    SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get('SQLALCHEMY_MAX_OVERFLOW', 20))
+    SQLALCHEMY_POOL_TIMEOUT = int(os.environ.get('SQLALCHEMY_POOL_TIMEOUT', 30))  # Seconds to wait for a free connection
+    
+    # SQLite performance profile, applied to every new connection
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')  # Readers no longer block the writer
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')  # Durable with WAL except on power loss
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -64000))  # Negative means KiB, so 64 MB of page cache
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_TEMP_STORE = os.environ.get('SQLITE_TEMP_STORE', 'MEMORY')
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))  # Milliseconds to wait for a lock before "database is locked"
+    
     # Print the database path for debugging
     print(f"Instance directory: {instance_path}")
     print(f"Database URI: {SQLALCHEMY_DATABASE_URI}")
@@ -39,3 +54,79 @@ class Config:
     
     # File upload settings
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB max upload size
+    
+    # Event ingestion settings
+    EVENT_BATCH_MAX_SIZE = int(os.environ.get('EVENT_BATCH_MAX_SIZE', 500))  # Max events per /api/events/batch request
+    BACKFILL_CHUNK_SIZE = int(os.environ.get('BACKFILL_CHUNK_SIZE', 5000))  # Events per transaction when importing files
+    TRACKING_ID_CACHE_SIZE = int(os.environ.get('TRACKING_ID_CACHE_SIZE', 10000))
+    TRACKING_ID_CACHE_TTL = int(os.environ.get('TRACKING_ID_CACHE_TTL', 300))  # Seconds before a cached project id is re-checked
+    TRACKING_ID_CACHE_NEGATIVE_TTL = int(os.environ.get('TRACKING_ID_CACHE_NEGATIVE_TTL', 30))  # Seconds to remember unknown tracking IDs
+    DEDUP_FILTER_CAPACITY = int(os.environ.get('DEDUP_FILTER_CAPACITY', 1000000))  # Message IDs per Bloom filter generation
+    DEDUP_FILTER_ERROR_RATE = float(os.environ.get('DEDUP_FILTER_ERROR_RATE', 0.001))
+    IDENTITY_ALIAS_CACHE_SIZE = int(os.environ.get('IDENTITY_ALIAS_CACHE_SIZE', 100000))  # anonymous_id -> user_id aliases kept in memory
+    IDENTITY_ALIAS_CACHE_NEGATIVE_TTL = int(os.environ.get('IDENTITY_ALIAS_CACHE_NEGATIVE_TTL', 30))  # Seconds to remember anonymous ids without an alias
+    
+    # Per-project rate limiting and load shedding on the ingest endpoints
+    INGEST_RATE_LIMIT_ENABLED = os.environ.get('INGEST_RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    INGEST_RATE_LIMIT = float(os.environ.get('INGEST_RATE_LIMIT', 100))  # Sustained events per second per tracking ID
+    INGEST_RATE_BURST = int(os.environ.get('INGEST_RATE_BURST', 500))  # Events a tracking ID may send at once
+    # JSON object of per-project limits, e.g. {"<tracking_id>": {"rate": 500, "burst": 2000}}
+    INGEST_RATE_LIMIT_OVERRIDES = json.loads(os.environ.get('INGEST_RATE_LIMIT_OVERRIDES', '{}'))
+    INGEST_MAX_INFLIGHT_WRITES = int(os.environ.get('INGEST_MAX_INFLIGHT_WRITES', 32))  # Concurrent synchronous writes before shedding
+    INGEST_SHED_QUEUE_RATIO = float(os.environ.get('INGEST_SHED_QUEUE_RATIO', 0.9))  # Write-behind queue fill level that triggers shedding
+    
+    # Write-behind ingestion: queue events in memory and answer 202 before the commit
+    INGEST_WRITE_BEHIND = os.environ.get('INGEST_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+    INGEST_QUEUE_MAX_SIZE = int(os.environ.get('INGEST_QUEUE_MAX_SIZE', 10000))  # Events buffered before returning 503
+    INGEST_FLUSH_BATCH_SIZE = int(os.environ.get('INGEST_FLUSH_BATCH_SIZE', 500))
+    INGEST_FLUSH_INTERVAL = float(os.environ.get('INGEST_FLUSH_INTERVAL', 1.0))  # Seconds between flushes of a partial batch
+    INGEST_FLUSH_RETRIES = int(os.environ.get('INGEST_FLUSH_RETRIES', 3))
+    
+    # Write-ahead log for the write-behind buffer (only used with INGEST_WRITE_BEHIND)
+    INGEST_LOG_ENABLED = os.environ.get('INGEST_LOG_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    INGEST_LOG_DIR = os.environ.get('INGEST_LOG_DIR', os.path.join(instance_path, 'ingest_log'))
+    INGEST_LOG_SEGMENT_BYTES = int(os.environ.get('INGEST_LOG_SEGMENT_BYTES', 64 * 1024 * 1024))
+    INGEST_LOG_SYNC_INTERVAL = float(os.environ.get('INGEST_LOG_SYNC_INTERVAL', 0.005))  # Seconds to gather appends into one fsync
+    INGEST_LOG_REPLAY_BATCH_SIZE = int(os.environ.get('INGEST_LOG_REPLAY_BATCH_SIZE', 1000))
+    
+    # Background threads (session persistence, anomaly checks, sentiment scoring); never started by `flask` CLI commands
+    BACKGROUND_WORKERS_ENABLED = os.environ.get('BACKGROUND_WORKERS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    
+    # Server-side sessions, rebuilt from events as they are ingested
+    SESSIONIZE_ENABLED = os.environ.get('SESSIONIZE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    SESSION_TIMEOUT = int(os.environ.get('SESSION_TIMEOUT', 1800))  # Seconds of inactivity that end a session, as tracker.js sessionTimeout
+    SESSION_PERSIST_INTERVAL = float(os.environ.get('SESSION_PERSIST_INTERVAL', 30))  # Seconds between writes of session state to the database
+    
+    # Analytics settings
+    HLL_PRECISION = int(os.environ.get('HLL_PRECISION', 12))  # 2**p registers per identity sketch, about 1.6% error at 12; stored sketches fold to the lower of old and new
+    HLL_COMMITTED_CACHE_SIZE = int(os.environ.get('HLL_COMMITTED_CACHE_SIZE', 10000))  # Committed hour/day sketches kept to skip writes that change nothing
+    HLL_COMMITTED_CACHE_TTL = int(os.environ.get('HLL_COMMITTED_CACHE_TTL', 300))  # Seconds a committed sketch is trusted (bounds staleness after a rebuild)
+    ANALYTICS_CACHE_BACKEND = os.environ.get('ANALYTICS_CACHE_BACKEND', 'memory')  # 'memory', 'sqlite' (shared by all workers) or 'none'
+    ANALYTICS_CACHE_PATH = os.environ.get('ANALYTICS_CACHE_PATH', os.path.join(instance_path, 'analytics_cache.db'))
+    ANALYTICS_CACHE_SIZE = int(os.environ.get('ANALYTICS_CACHE_SIZE', 1000))  # Cached results kept before evicting
+    ANALYTICS_CACHE_TTL = int(os.environ.get('ANALYTICS_CACHE_TTL', 60))  # Seconds a result may lag behind the clock for rolling windows
+    ANALYTICS_WORKERS = int(os.environ.get('ANALYTICS_WORKERS', 4))  # Threads running analytics page queries concurrently, 0 runs them inline
+    ANALYTICS_TASK_TIMEOUT = float(os.environ.get('ANALYTICS_TASK_TIMEOUT', 10))  # Seconds a page waits for one widget before rendering without it
+    ANALYTICS_API_GZIP_MIN_SIZE = int(os.environ.get('ANALYTICS_API_GZIP_MIN_SIZE', 500))  # Smallest JSON body (bytes) the analytics API gzips
+    EVENT_SEGMENTS_ENABLED = os.environ.get('EVENT_SEGMENTS_ENABLED', 'false').lower() in ('1', 'true', 'yes')  # Read closed days from columnar segments
+    EVENT_SEGMENTS_DIR = os.environ.get('EVENT_SEGMENTS_DIR', os.path.join(instance_path, 'segments'))  # Written by `flask events compact-segments`
+    EVENT_STREAM_CHUNK_SIZE = int(os.environ.get('EVENT_STREAM_CHUNK_SIZE', 100000))  # Events held in memory at once by funnel and path scans
+    PATH_SESSION_GAP = int(os.environ.get('PATH_SESSION_GAP', 1800))  # Seconds of inactivity that end a path
+    PATH_TOP_K = int(os.environ.get('PATH_TOP_K', 5000))  # Transitions and sequences tracked per path analysis
+    SEGMENT_CLUSTERS = int(os.environ.get('SEGMENT_CLUSTERS', 5))  # Behavior clusters fitted per project
+    SEGMENT_DORMANT_DAYS = int(os.environ.get('SEGMENT_DORMANT_DAYS', 7))  # Days without events before a user counts as dormant
+    SEGMENT_INACTIVE_DAYS = int(os.environ.get('SEGMENT_INACTIVE_DAYS', 30))  # Days without events before a user counts as inactive
+    SEGMENT_MODEL_MAX_AGE = int(os.environ.get('SEGMENT_MODEL_MAX_AGE', 7))  # Days before a project's clustering is refitted from scratch
+    ANOMALY_DETECTION_ENABLED = os.environ.get('ANOMALY_DETECTION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    ANOMALY_CHECK_INTERVAL = float(os.environ.get('ANOMALY_CHECK_INTERVAL', 300))  # Seconds between checks of newly closed hours
+    ANOMALY_LEASE_TTL = float(os.environ.get('ANOMALY_LEASE_TTL', 900))  # Seconds the worker running the checks keeps the job without renewing it
+    ANOMALY_THRESHOLD = float(os.environ.get('ANOMALY_THRESHOLD', 3.5))  # Standard deviations from the baseline that make an hour anomalous
+    ANOMALY_MIN_DEVIATION = int(os.environ.get('ANOMALY_MIN_DEVIATION', 5))  # Events off the baseline below which nothing is flagged
+    ANOMALY_HISTORY_DAYS = int(os.environ.get('ANOMALY_HISTORY_DAYS', 28))  # Days of rollups that warm up a new project's baselines
+    SENTIMENT_ENABLED = os.environ.get('SENTIMENT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    SENTIMENT_PROPERTIES = os.environ.get('SENTIMENT_PROPERTIES', 'feedback,comment,review,message')  # Comma-separated event properties holding feedback text
+    SENTIMENT_MODEL_PATH = os.environ.get('SENTIMENT_MODEL_PATH')  # JSON weights of a text classifier used instead of the lexicon (flask events train-sentiment)
+    SENTIMENT_INTERVAL = float(os.environ.get('SENTIMENT_INTERVAL', 30))  # Seconds between background scoring passes when no feedback arrives
+    SENTIMENT_BATCH_SIZE = int(os.environ.get('SENTIMENT_BATCH_SIZE', 1000))  # Events read per scoring query
+    SENTIMENT_MAX_TEXTS = int(os.environ.get('SENTIMENT_MAX_TEXTS', 1000))  # Texts accepted per request to the batch sentiment API
+    ACTIVE_USERS_EXACT_THRESHOLD = int(os.environ.get('ACTIVE_USERS_EXACT_THRESHOLD', 20000))  # Events in both periods below which active users are counted exactly
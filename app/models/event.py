@@ -20,19 +20,62 @@ class JSONType(TypeDecorator):
 # Choose appropriate JSON type based on dialect
 SQLAlchemyJSONType = JSON().with_variant(JSONType(), 'sqlite')
 
+class EventType(db.Model):
+    """Dictionary of event names; events reference it by small integer id"""
+    __tablename__ = 'event_types'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), unique=True, nullable=False)
+    
+    def __repr__(self):
+        return f'<EventType {self.id} {self.name}>'
+
 class Event(db.Model):
     __tablename__ = 'events'
+    __table_args__ = (
+        # Client message IDs are unique per project; backs the in-memory duplicate filter
+        db.Index('ix_events_project_message_id', 'project_id', 'message_id', unique=True),
+        # Serves per-project GROUP BY event type and per-event time range queries
+        db.Index('ix_events_project_type_timestamp', 'project_id', 'event_type_id', 'timestamp'),
+        # Per-identity lookups: first/last seen, alias stitching
+        db.Index('ix_events_project_identity_timestamp', 'project_id', 'identity', 'timestamp'),
+        # Covering index for distinct identities in a time window (active users, cohorts)
+        db.Index('ix_events_project_timestamp_identity', 'project_id', 'timestamp', 'identity'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False)
-    event_name = db.Column(db.String(64), nullable=False, index=True)
+    event_type_id = db.Column(db.Integer, db.ForeignKey('event_types.id'), nullable=False)
     # Store properties as JSON - compatible with both SQLite and PostgreSQL
     properties = db.Column(SQLAlchemyJSONType)
     # External user identifier from the tracked application (not our User model)
     user_id = db.Column(db.String(64), nullable=True, index=True)
     # For anonymous users without a user_id
     anonymous_id = db.Column(db.String(64), nullable=True, index=True)
+    # Canonical person: user_id, else the known user an anonymous_id was stitched to, else anonymous_id
+    identity = db.Column(db.String(64), nullable=True)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    # Optional client-generated ID used to drop retried duplicates
+    message_id = db.Column(db.String(64), nullable=True)
+    
+    event_type = db.relationship('EventType', lazy='joined')
+    
+    @property
+    def event_name(self):
+        """Name of the event, from the event_types dictionary"""
+        return self.event_type.name if self.event_type else None
+    
+    def __repr__(self):
+        return f'<Event {self.event_name} for Project {self.project_id}>'
+
+class IdentityAlias(db.Model):
+    """Links an anonymous_id to the known user it was later identified as"""
+    __tablename__ = 'identity_aliases'
+    
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), primary_key=True)
+    anonymous_id = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
     def __repr__(self):
-        return f'<Event {self.event_name} for Project {self.project_id}>'
\ No newline at end of file
+        return f'<IdentityAlias {self.anonymous_id} -> {self.user_id}>'
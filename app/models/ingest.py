@@ -0,0 +1,14 @@
+from datetime import datetime
+from app.models import db
+
+class IngestLogCheckpoint(db.Model):
+    """How far each ingest log segment has been loaded into the events table"""
+    __tablename__ = 'ingest_log_checkpoints'
+    
+    segment = db.Column(db.String(128), primary_key=True)
+    # Byte offset up to which the segment's records are committed
+    offset = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<IngestLogCheckpoint {self.segment}@{self.offset}>'
@@ -0,0 +1,108 @@
+from datetime import datetime
+from app.models import db
+
+class UserSegmentModel(db.Model):
+    """Fitted behavior clustering of a project, reused to assign new users without refitting"""
+    __tablename__ = 'user_segment_models'
+    
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), primary_key=True)
+    # Last full fit, and last incremental update with new users
+    fitted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Users the full fit saw
+    n_users = db.Column(db.Integer, nullable=False)
+    # Pickled {'type_ids', 'tfidf', 'kmeans'}, see BehaviorClustering
+    model = db.Column(db.LargeBinary, nullable=False)
+    
+    def __repr__(self):
+        return f'<UserSegmentModel for Project {self.project_id} fitted {self.fitted_at}>'
+
+class AnomalyState(db.Model):
+    """Baselines of the anomaly detector for every event type of a project"""
+    __tablename__ = 'anomaly_states'
+    
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), primary_key=True)
+    # Last hour (start of the hourly rollup bucket) folded into the baselines
+    last_hour = db.Column(db.DateTime, nullable=False)
+    hours_observed = db.Column(db.Integer, nullable=False, default=0)
+    # np.savez arrays, see AnomalyDetector
+    state = db.Column(db.LargeBinary, nullable=False)
+    
+    # Saving checks last_hour is still what was read, so two overlapping checks never fold the same hours twice
+    __mapper_args__ = {'version_id_col': last_hour, 'version_id_generator': False}
+    
+    def __repr__(self):
+        return f'<AnomalyState for Project {self.project_id} at {self.last_hour}>'
+
+class EventAnomaly(db.Model):
+    """An hour in which an event type's count was far from its seasonal baseline"""
+    __tablename__ = 'event_anomalies'
+    __table_args__ = (
+        db.Index('ix_event_anomalies_project_type_bucket', 'project_id', 'event_type_id', 'bucket', unique=True),
+        db.Index('ix_event_anomalies_project_bucket', 'project_id', 'bucket'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False)
+    event_type_id = db.Column(db.Integer, db.ForeignKey('event_types.id'), nullable=False)
+    # Start of the hour (naive UTC)
+    bucket = db.Column(db.DateTime, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    expected = db.Column(db.Float, nullable=False)
+    z_score = db.Column(db.Float, nullable=False)
+    # 'medium' or 'high'
+    severity = db.Column(db.String(8), nullable=False)
+    detected_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<EventAnomaly {self.event_type_id} in Project {self.project_id} at {self.bucket}>'
+
+class FeedbackSentiment(db.Model):
+    """Sentiment of the feedback text of an event, scored in the background after ingest"""
+    __tablename__ = 'feedback_sentiments'
+    __table_args__ = (
+        db.Index('ix_feedback_sentiments_project_timestamp', 'project_id', 'timestamp'),
+    )
+    
+    event_id = db.Column(db.Integer, db.ForeignKey('events.id'), primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False)
+    event_type_id = db.Column(db.Integer, db.ForeignKey('event_types.id'), nullable=False)
+    # Time of the event, for aggregating by period without joining events
+    timestamp = db.Column(db.DateTime, nullable=False)
+    # Event property the text was read from
+    property = db.Column(db.String(64), nullable=False)
+    # -1 (negative) to 1 (positive)
+    score = db.Column(db.Float, nullable=False)
+    # 'positive', 'neutral' or 'negative'
+    label = db.Column(db.String(8), nullable=False)
+    confidence = db.Column(db.Float, nullable=False)
+    scored_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<FeedbackSentiment of Event {self.event_id}: {self.label}>'
+
+class SentimentCheckpoint(db.Model):
+    """How far the events table has been scanned for feedback to score"""
+    __tablename__ = 'sentiment_checkpoints'
+    
+    # What was scanned; the background scorer uses 'events'
+    source = db.Column(db.String(32), primary_key=True)
+    # Highest event id scanned
+    last_event_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SentimentCheckpoint {self.source}@{self.last_event_id}>'
+
+class WorkerLease(db.Model):
+    """Expiring claim of one process on a background job that must not run in every worker"""
+    __tablename__ = 'worker_leases'
+    
+    # The job; the anomaly detector uses 'anomaly-detector'
+    name = db.Column(db.String(32), primary_key=True)
+    # Random id of the holding process
+    holder = db.Column(db.String(32), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<WorkerLease {self.name} held by {self.holder} until {self.expires_at}>'
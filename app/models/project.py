@@ -16,20 +16,40 @@ class Project(db.Model):
     tracking_id = db.Column(db.String(36), unique=True, nullable=False, default=generate_tracking_id)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped by every ingest transaction; part of the analytics cache keys
+    data_version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    # Totals kept current by ingestion, so listing projects needs no COUNT queries
+    event_count = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    # Distinct non-null user_ids, counted once each via project_users
+    active_users_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Define relationship to Event - one project can have many events
     events = db.relationship('Event', backref='project', lazy='dynamic', 
                            cascade='all, delete-orphan')
+    # Derived per-project data goes with the project
+    identity_aliases = db.relationship('IdentityAlias', lazy='dynamic', cascade='all, delete-orphan')
+    hourly_rollups = db.relationship('EventRollupHourly', lazy='dynamic', cascade='all, delete-orphan')
+    daily_rollups = db.relationship('EventRollupDaily', lazy='dynamic', cascade='all, delete-orphan')
+    identity_sketches = db.relationship('IdentitySketch', lazy='dynamic', cascade='all, delete-orphan')
+    day_versions = db.relationship('EventDayVersion', lazy='dynamic', cascade='all, delete-orphan')
+    known_users = db.relationship('ProjectUser', lazy='dynamic', cascade='all, delete-orphan')
+    sessions = db.relationship('UserSession', lazy='dynamic', cascade='all, delete-orphan')
+    open_sessions = db.relationship('OpenSession', lazy='dynamic', cascade='all, delete-orphan')
+    segment_model = db.relationship('UserSegmentModel', uselist=False, cascade='all, delete-orphan')
+    anomaly_state = db.relationship('AnomalyState', uselist=False, cascade='all, delete-orphan')
+    anomalies = db.relationship('EventAnomaly', lazy='dynamic', cascade='all, delete-orphan')
+    feedback_sentiments = db.relationship('FeedbackSentiment', lazy='dynamic', cascade='all, delete-orphan')
     
-    @property
-    def event_count(self):
-        """Return the total number of events for this project"""
-        return self.events.count()
+    def __repr__(self):
+        return f'<Project {self.name}>'
+
+class ProjectUser(db.Model):
+    """Every user_id seen in a project, recorded once at ingest"""
+    __tablename__ = 'project_users'
     
-    @property
-    def active_users_count(self):
-        """Return the number of unique user_ids (excluding nulls)"""
-        return self.events.filter(Event.user_id.isnot(None)).distinct(Event.user_id).count()
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), primary_key=True)
+    user_id = db.Column(db.String(64), primary_key=True)
+    first_seen_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
     def __repr__(self):
-        return f'<Project {self.name}>'
\ No newline at end of file
+        return f'<ProjectUser {self.user_id} in Project {self.project_id}>'
@@ -0,0 +1,53 @@
+from app.models import db
+
+class EventRollupHourly(db.Model):
+    """Event counts per project, event type and hour, maintained at ingest"""
+    __tablename__ = 'event_rollups_hourly'
+    
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), primary_key=True)
+    event_type_id = db.Column(db.Integer, db.ForeignKey('event_types.id'), primary_key=True)
+    # Start of the hour (naive UTC)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<EventRollupHourly {self.project_id}/{self.event_type_id} {self.bucket}: {self.count}>'
+
+class EventRollupDaily(db.Model):
+    """Event counts per project, event type and day, maintained at ingest"""
+    __tablename__ = 'event_rollups_daily'
+    
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), primary_key=True)
+    event_type_id = db.Column(db.Integer, db.ForeignKey('event_types.id'), primary_key=True)
+    # Midnight of the day (naive UTC)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<EventRollupDaily {self.project_id}/{self.event_type_id} {self.bucket}: {self.count}>'
+
+class IdentitySketch(db.Model):
+    """HyperLogLog sketch of the identities seen per project per hour or day"""
+    __tablename__ = 'identity_sketches'
+    
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), primary_key=True)
+    # 'hour' or 'day'
+    granularity = db.Column(db.String(8), primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    # Serialized app.utils.hll.HyperLogLog
+    registers = db.Column(db.LargeBinary, nullable=False)
+    
+    def __repr__(self):
+        return f'<IdentitySketch {self.project_id} {self.granularity} {self.bucket}>'
+
+class EventDayVersion(db.Model):
+    """Version of a project's stored events of one day, bumped when they are rewritten in place"""
+    __tablename__ = 'event_day_versions'
+    
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), primary_key=True)
+    # Midnight of the day (naive UTC)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<EventDayVersion {self.project_id} {self.bucket}: {self.version}>'
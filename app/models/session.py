@@ -0,0 +1,39 @@
+from app.models import db
+
+class UserSession(db.Model):
+    """A completed session: one identity's events without a gap longer than SESSION_TIMEOUT"""
+    __tablename__ = 'sessions'
+    __table_args__ = (
+        # Session counts and lengths over a time window
+        db.Index('ix_sessions_project_started_at', 'project_id', 'started_at'),
+        db.Index('ix_sessions_project_identity_started_at', 'project_id', 'identity', 'started_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False)
+    identity = db.Column(db.String(64), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False)
+    ended_at = db.Column(db.DateTime, nullable=False)
+    # Seconds from the first to the last event, 0 for a bounce
+    duration = db.Column(db.Integer, nullable=False, default=0)
+    event_count = db.Column(db.Integer, nullable=False)
+    entry_event_type_id = db.Column(db.Integer, db.ForeignKey('event_types.id'), nullable=False)
+    exit_event_type_id = db.Column(db.Integer, db.ForeignKey('event_types.id'), nullable=False)
+    
+    def __repr__(self):
+        return f'<UserSession {self.identity} in Project {self.project_id} at {self.started_at}>'
+
+class OpenSession(db.Model):
+    """The session an identity is in, saved periodically so a restart can continue it"""
+    __tablename__ = 'open_sessions'
+    
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), primary_key=True)
+    identity = db.Column(db.String(64), primary_key=True)
+    started_at = db.Column(db.DateTime, nullable=False)
+    last_seen_at = db.Column(db.DateTime, nullable=False)
+    event_count = db.Column(db.Integer, nullable=False)
+    entry_event_type_id = db.Column(db.Integer, db.ForeignKey('event_types.id'), nullable=False)
+    exit_event_type_id = db.Column(db.Integer, db.ForeignKey('event_types.id'), nullable=False)
+    
+    def __repr__(self):
+        return f'<OpenSession {self.identity} in Project {self.project_id} since {self.started_at}>'
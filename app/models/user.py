@@ -25,4 +25,4 @@ class User(UserMixin, db.Model):
         return check_password_hash(self.password_hash, password)
     
     def __repr__(self):
-        return f'<User {self.username}>
\ No newline at end of file
+        return f'<User {self.username}>'
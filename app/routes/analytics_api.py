@@ -0,0 +1,190 @@
+import gzip
+import hashlib
+import time
+from flask import Blueprint, request, jsonify, current_app, abort
+from flask_login import current_user
+from app.models.project import Project
+from app.services.analytics import AnalyticsService, MLInsightService, get_data_version
+from app.services.time_buckets import TimeBucketer
+from app.services.funnels import MAX_FUNNEL_STEPS
+
+bp = Blueprint('analytics_api', __name__, url_prefix='/api/projects')
+
+@bp.before_request
+def require_login():
+    """Answer unauthenticated requests with a JSON 401 instead of login_required's redirect to the login page"""
+    if not current_user.is_authenticated:
+        abort(401)
+
+def _choice(name, choices, default):
+    value = request.args.get(name, default)
+    if value is not None and value not in choices:
+        abort(400, f"{name} must be one of: {', '.join(choices)}")
+    return value
+
+def _integer(name, default, low, high):
+    value = request.args.get(name, default, type=int)
+    if value is None or not low <= value <= high:
+        abort(400, f"{name} must be an integer between {low} and {high}")
+    return value
+
+def _flag(name):
+    value = request.args.get(name)
+    return None if value is None else value.lower() in ('1', 'true', 'yes')
+
+def _timezone():
+    timezone = request.args.get('tz', 'UTC')
+    try:
+        TimeBucketer.get_timezone(timezone)
+    except ValueError as e:
+        abort(400, str(e))
+    return timezone
+
+def _active_users_params():
+    return {
+        'time_period': _choice('time_period', ('day', 'week', 'month'), 'day'),
+        'exact': _flag('exact')
+    }
+
+def _event_frequency_params():
+    return {
+        'event_name': request.args.get('event_name') or None,
+        'time_period': _choice('time_period', ('day', 'week', 'month'), 'day'),
+        'timezone': _timezone(),
+        'granularity': _choice('granularity', ('minute', 'hour', 'day', 'week'), None)
+    }
+
+def _top_events_params():
+    return {'limit': _integer('limit', 10, 1, 100)}
+
+def _retention_params():
+    return {
+        'weeks': _integer('weeks', 8, 1, 52),
+        'unit': _choice('unit', ('day', 'week'), 'week'),
+        'rolling': bool(_flag('rolling'))
+    }
+
+def _funnel_params():
+    steps = [step.strip() for step in request.args.get('steps', '').split(',') if step.strip()]
+    if not 2 <= len(steps) <= MAX_FUNNEL_STEPS:
+        abort(400, f"steps must list between 2 and {MAX_FUNNEL_STEPS} comma-separated event names")
+    return {
+        'steps': tuple(steps),
+        'window': _integer('window', 7 * 86400, 60, 90 * 86400),
+        'days': _integer('days', 30, 1, 365)
+    }
+
+def _paths_params():
+    return {
+        'anchor': request.args.get('anchor') or None,
+        'direction': _choice('direction', ('next', 'previous'), 'next'),
+        'depth': _integer('depth', 3, 1, 5),
+        'days': _integer('days', 30, 1, 365)
+    }
+
+def _days_params():
+    return {'days': _integer('days', 30, 1, 365)}
+
+def _anomalies_params():
+    return {
+        'days': _integer('days', 7, 1, 90),
+        'event_name': request.args.get('event_name') or None
+    }
+
+# Metric name -> (service function, parser for its keyword arguments)
+METRICS = {
+    'active-users': (AnalyticsService.get_active_users, _active_users_params),
+    'event-frequency': (AnalyticsService.get_event_frequency, _event_frequency_params),
+    'top-events': (AnalyticsService.get_top_events, _top_events_params),
+    'retention': (AnalyticsService.get_retention_data, _retention_params),
+    'funnel': (AnalyticsService.get_funnel, _funnel_params),
+    'paths': (AnalyticsService.get_paths, _paths_params),
+    'path-summary': (AnalyticsService.get_path_summary, _days_params),
+    'sessions': (AnalyticsService.get_session_metrics, _days_params),
+    'anomalies': (MLInsightService.get_anomalies, _anomalies_params),
+    'sentiment': (AnalyticsService.get_sentiment_summary, _days_params),
+}
+
+def _etag(project_id, metric, params):
+    """
+    Weak validator for a metric response: the project's data version, the
+    request parameters and the current cache ttl window, since results over
+    "the last N hours" drift with the clock even without new data
+    """
+    ttl = max(current_app.config.get('ANALYTICS_CACHE_TTL', 60), 1)
+    raw = repr((project_id, get_data_version(project_id), metric, sorted(params.items()), int(time.time() // ttl)))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def _compressed_json(payload):
+    """JSON response, gzipped when the client accepts it and the body is worth compressing"""
+    response = jsonify(payload)
+    minimum = current_app.config.get('ANALYTICS_API_GZIP_MIN_SIZE', 500)
+    # A listed encoding may still be refused with q=0
+    if request.accept_encodings['gzip'] > 0 and response.content_length >= minimum:
+        response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@bp.route('/<int:id>/analytics/<metric>')
+def get_metric(id, metric):
+    """One AnalyticsService metric as JSON, with conditional GET support"""
+    project = Project.query.get_or_404(id)
+
+    # Security check - only allow viewing own projects
+    if project.user_id != current_user.id:
+        abort(403)
+
+    if metric not in METRICS:
+        return jsonify({"status": "error", "message": f"Unknown metric: {metric}"}), 404
+    func, parse = METRICS[metric]
+    params = parse()
+
+    # Answer polls for unchanged data before running any analytics query
+    etag = _etag(project.id, metric, params)
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = _compressed_json({"status": "success", "metric": metric, "data": func(project.id, **params)})
+
+    response.set_etag(etag, weak=True)
+    # Private to the logged-in user; revalidate on every poll
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.update(('Accept-Encoding', 'Cookie'))
+    return response
+
+@bp.route('/<int:id>/sentiment', methods=['POST'])
+def score_sentiment(id):
+    """Score a batch of feedback texts sent as {"texts": [...]}, without storing them"""
+    project = Project.query.get_or_404(id)
+
+    # Security check - only allow scoring for own projects
+    if project.user_id != current_user.id:
+        abort(403)
+
+    data = request.get_json(silent=True)
+    texts = data.get('texts') if isinstance(data, dict) else None
+    limit = current_app.config.get('SENTIMENT_MAX_TEXTS', 1000)
+    if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+        abort(400, "texts must be a list of strings")
+    if len(texts) > limit:
+        abort(400, f"At most {limit} texts can be scored per request")
+
+    response = _compressed_json({"status": "success", "data": MLInsightService.analyze_sentiments(project.id, texts)})
+    response.vary.add('Accept-Encoding')
+    return response
+
+@bp.errorhandler(400)
+def bad_request(error):
+    return jsonify({"status": "error", "message": error.description}), 400
+
+@bp.errorhandler(401)
+def unauthorized(error):
+    return jsonify({"status": "error", "message": "Authentication required"}), 401
+
+@bp.errorhandler(403)
+def forbidden(error):
+    return jsonify({"status": "error", "message": "You do not have access to this project"}), 403
+
+@bp.errorhandler(404)
+def not_found(error):
+    return jsonify({"status": "error", "message": "Project not found"}), 404
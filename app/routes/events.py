@@ -1,12 +1,66 @@
 from flask import Blueprint, request, jsonify, current_app
+from flask_login import login_required
 from app.models import db
-from app.models.event import Event
+from flask_login import current_user
 from app.models.project import Project
+from app.services.event_processing import (EventProcessingService, EventValidationError, tracking_id_cache,
+                                           message_deduplicator, admission_control)
+from app.services.ingest_buffer import ingest_buffer, IngestUnavailable
+from app.services.ingest_log import ingest_log
+from app.services.analytics import analytics_cache
+from app.services.sketches import IdentitySketchService
 from datetime import datetime
-import json
+import math
 
 bp = Blueprint('events', __name__, url_prefix='/api')
 
+def _cors_json(payload, status):
+    """Build a JSON response that can be read cross-origin by tracking snippets"""
+    response = jsonify(payload)
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response, status
+
+def _backpressure_response():
+    """503 telling clients to back off while the write path is full or failing"""
+    response, status = _cors_json({
+        "status": "error",
+        "message": "Ingestion is temporarily overloaded, please retry"
+    }, 503)
+    response.headers['Retry-After'] = '1'
+    return response, status
+
+def _rate_limited_response(retry_after, **extra):
+    """429 for a project that is over its ingest rate limit"""
+    response, status = _cors_json(dict({
+        "status": "error",
+        "message": "Rate limit exceeded for this project"
+    }, **extra), 429)
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response, status
+
+def _too_large_response(message, **extra):
+    """413 for more events than the project's rate limit burst, which no wait would let through"""
+    return _cors_json(dict({
+        "status": "error",
+        "message": message
+    }, **extra), 413)
+
+def _duplicate_response():
+    """200 for an event whose message_id was already recorded"""
+    return _cors_json({
+        "status": "success",
+        "message": "Duplicate event ignored",
+        "duplicate": True
+    }, 200)
+
+def _cors_preflight():
+    """Answer a CORS preflight request for the ingestion endpoints"""
+    response = current_app.make_default_options_response()
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+    response.headers.add('Access-Control-Allow-Methods', 'POST,OPTIONS')
+    return response
+
 @bp.route('/events', methods=['POST', 'OPTIONS'])
 def capture_event():
     """
@@ -15,86 +69,154 @@ def capture_event():
     """
     # Handle preflight OPTIONS request for CORS
     if request.method == 'OPTIONS':
-        response = current_app.make_default_options_response()
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-        response.headers.add('Access-Control-Allow-Methods', 'POST,OPTIONS')
-        return response
+        return _cors_preflight()
     
     # Check for proper JSON content
     if not request.is_json:
-        response = jsonify({
+        return _cors_json({
             "status": "error",
             "message": "Content-Type must be application/json"
-        })
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        return response, 400
+        }, 400)
     
     # Get the JSON data
     data = request.json
     
-    # Validate required fields
-    required_fields = ['project_id', 'event_name']
-    missing_fields = [field for field in required_fields if field not in data]
-    
-    if missing_fields:
-        response = jsonify({
+    # Validate the payload
+    try:
+        event = EventProcessingService.validate_event(data)
+    except EventValidationError as e:
+        return _cors_json({
             "status": "error",
-            "message": f"Missing required fields: {', '.join(missing_fields)}"
-        })
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        return response, 400
+            "message": str(e)
+        }, 400)
     
+    # Cheap per-project rate limit before any database work
+    if admission_control.burst_for(event['tracking_id']) < 1:
+        return _too_large_response("Event larger than the project's rate limit burst")
+    retry_after = admission_control.acquire(event['tracking_id'])
+    if retry_after:
+        return _rate_limited_response(retry_after)
+    
+    # Shed load while the write path is saturated
+    if not admission_control.enter({event['tracking_id']: 1}):
+        return _backpressure_response()
+    try:
+        return _store_single_event(event)
+    finally:
+        admission_control.leave()
+
+def _store_single_event(event):
+    """Resolve, deduplicate and store one validated event"""
     # Find project by tracking_id
-    project = Project.query.filter_by(tracking_id=data['project_id']).first()
+    project_ids = EventProcessingService.resolve_tracking_ids([event['tracking_id']])
+    project_id = project_ids.get(event['tracking_id'])
     
-    if not project:
-        response = jsonify({
+    if project_id is None:
+        return _cors_json({
             "status": "error",
             "message": "Invalid project ID"
-        })
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        return response, 404
+        }, 404)
     
-    # Process timestamp
-    timestamp = datetime.utcnow()
-    if 'timestamp' in data and data['timestamp']:
+    row = EventProcessingService.build_row(event, project_id)
+    
+    # A retried message is acknowledged without being stored twice
+    if EventProcessingService.find_duplicates([row]):
+        return _duplicate_response()
+    
+    # In write-behind mode, queue the event and answer before it hits the database
+    if ingest_buffer.enabled:
         try:
-            timestamp = datetime.fromisoformat(data['timestamp'].replace('Z', '+00:00'))
-        except (ValueError, TypeError):
-            # If timestamp is invalid, use current time
-            current_app.logger.warning(f"Invalid timestamp format: {data.get('timestamp')}")
-    
-    # Create new event
-    event = Event(
-        project_id=project.id,
-        event_name=data['event_name'],
-        properties=data.get('properties', {}),
-        user_id=data.get('user_id'),
-        anonymous_id=data.get('anonymous_id'),
-        timestamp=timestamp
-    )
+            EventProcessingService.persist([row])
+        except IngestUnavailable:
+            return _backpressure_response()
+        return _cors_json({
+            "status": "success",
+            "message": "Event queued"
+        }, 202)
     
     # Save to database
     try:
-        db.session.add(event)
-        db.session.commit()
-        response = jsonify({
+        event_id = EventProcessingService.store_event(row)
+        if event_id is None:
+            return _duplicate_response()
+        return _cors_json({
             "status": "success",
             "message": "Event recorded successfully",
-            "event_id": event.id
-        })
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        return response, 200
+            "event_id": event_id
+        }, 200)
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error saving event: {str(e)}")
-        response = jsonify({
+        return _cors_json({
             "status": "error",
             "message": "Failed to record event"
-        })
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        return response, 500
+        }, 500)
+
+@bp.route('/events/batch', methods=['POST', 'OPTIONS'])
+def capture_event_batch():
+    """
+    API endpoint for capturing many events in one request.
+    Accepts a JSON array of events (or {"events": [...]}) in the same shape
+    as /api/events and returns a status for each item so clients can retry
+    only the rejected ones.
+    """
+    # Handle preflight OPTIONS request for CORS
+    if request.method == 'OPTIONS':
+        return _cors_preflight()
+    
+    # Check for proper JSON content
+    if not request.is_json:
+        return _cors_json({
+            "status": "error",
+            "message": "Content-Type must be application/json"
+        }, 400)
+    
+    data = request.get_json(silent=True)
+    payloads = data.get('events') if isinstance(data, dict) else data
+    
+    if not isinstance(payloads, list) or not payloads:
+        return _cors_json({
+            "status": "error",
+            "message": "Request body must be a non-empty array of events"
+        }, 400)
+    
+    max_size = current_app.config.get('EVENT_BATCH_MAX_SIZE', 500)
+    if len(payloads) > max_size:
+        return _cors_json({
+            "status": "error",
+            "message": f"Batch too large: at most {max_size} events per request"
+        }, 413)
+    
+    try:
+        results = EventProcessingService.process_batch(payloads)
+    except IngestUnavailable:
+        return _backpressure_response()
+    accepted = sum(1 for result in results if result['status'] in ('accepted', 'queued', 'duplicate'))
+    
+    # More events than a project's burst can never get through: the batch must be split, not retried
+    too_large = any(result['status'] == 'too_large' for result in results)
+    if too_large and not accepted:
+        return _too_large_response("Batch larger than the project's rate limit burst, split it into smaller batches",
+                                   accepted=0, rejected=len(results), results=results)
+    
+    # Nothing got through because of rate limits: tell the client when to come back
+    limited = [result['retry_after'] for result in results if result['status'] == 'rate_limited']
+    if limited and not accepted:
+        return _rate_limited_response(max(limited), accepted=0, rejected=len(results), results=results)
+    
+    if accepted == len(results):
+        status = "success"
+    elif accepted:
+        status = "partial"
+    else:
+        status = "error"
+    
+    return _cors_json({
+        "status": status,
+        "accepted": accepted,
+        "rejected": len(results) - accepted,
+        "results": results
+    }, (202 if ingest_buffer.enabled else 200) if accepted else 400)
 
 @bp.route('/events/test', methods=['GET', 'POST', 'OPTIONS'])
 def test_endpoint():
@@ -118,4 +240,25 @@ def test_endpoint():
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,POST,OPTIONS')
     
-    return response, 200
\ No newline at end of file
+    return response, 200
+
+@bp.route('/events/metrics', methods=['GET'])
+@login_required
+def ingest_metrics():
+    """
+    Counters for the ingestion path (cache effectiveness etc.)
+    """
+    # Per-project counters only for the projects of the logged in user
+    tracking_ids = [row.tracking_id for row in
+                    Project.query.with_entities(Project.tracking_id).filter_by(user_id=current_user.id)]
+    
+    return jsonify({
+        "status": "success",
+        "admission": admission_control.stats(tracking_ids),
+        "tracking_id_cache": tracking_id_cache.stats(),
+        "ingest_buffer": ingest_buffer.stats(),
+        "ingest_log": ingest_log.stats(),
+        "deduplication": message_deduplicator.stats(),
+        "identity_sketches": IdentitySketchService.stats(),
+        "analytics_cache": analytics_cache.stats()
+    }), 200
@@ -1,9 +1,21 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, abort
+from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, jsonify, current_app
 from flask_login import login_required, current_user
 from app.models import db
 from app.models.project import Project
-from app.models.event import Event
+from app.models.event import Event, IdentityAlias
+from app.models.rollup import EventRollupHourly, EventRollupDaily, IdentitySketch, EventDayVersion
+from app.models.project import ProjectUser
+from app.models.session import UserSession, OpenSession
+from app.models.insights import UserSegmentModel, AnomalyState, EventAnomaly, FeedbackSentiment
 from app.services.analytics import AnalyticsService, MLInsightService
+from app.services.event_processing import tracking_id_cache
+from app.services.backfill import BackfillImporter
+from app.services.time_buckets import TimeBucketer
+from app.services.query_executor import query_executor
+from app.services.segments import event_segments
+from app.services.sessions import sessionizer
+from app.services.funnels import MAX_FUNNEL_STEPS
+from app.services.clustering import LIFECYCLE_SEGMENTS
 from app.forms import ProjectForm
 import uuid
 
@@ -11,6 +23,12 @@ from app.services.deepseek_insights import DeepSeekMLInsights
 
 bp = Blueprint('project', __name__, url_prefix='/projects')
 
+# Tables holding a project's rows, deleted in this order (sentiments reference events)
+PROJECT_TABLES = [
+    FeedbackSentiment, EventAnomaly, AnomalyState, UserSegmentModel, OpenSession, UserSession, ProjectUser,
+    IdentitySketch, EventDayVersion, EventRollupHourly, EventRollupDaily, IdentityAlias, Event
+]
+
 @bp.route('/')
 @login_required
 def list():
@@ -32,6 +50,8 @@ def create():
         )
         db.session.add(project)
         db.session.commit()
+        # Forget any negative cache entry for the new tracking ID
+        tracking_id_cache.invalidate(project.tracking_id)
         flash('Project created successfully!', 'success')
         return redirect(url_for('project.detail', id=project.id))
     
@@ -91,6 +111,7 @@ def detail(id):
             properties: properties || {{}},
             user_id: config.userId,
             anonymous_id: config.anonymousId,
+            message_id: generateId(),
             timestamp: new Date().toISOString()
         }};
         
@@ -107,14 +128,18 @@ def detail(id):
     }}
     
     // Helper function to send event data
-    function sendEvent(eventData) {{
+    // Retries reuse the same message_id, so the server ignores duplicates
+    function sendEvent(eventData, attempt) {{
+        attempt = attempt || 0;
         var xhr = new XMLHttpRequest();
         xhr.open('POST', config.apiEndpoint, true);
         xhr.setRequestHeader('Content-Type', 'application/json');
         xhr.onreadystatechange = function() {{
             if (xhr.readyState === 4) {{
-                if (xhr.status === 200) {{
+                if (xhr.status >= 200 && xhr.status < 300) {{
                     console.log('Event tracked:', eventData.event_name);
+                }} else if ((xhr.status === 0 || xhr.status === 429 || xhr.status >= 500) && attempt < 3) {{
+                    setTimeout(function() {{ sendEvent(eventData, attempt + 1); }}, 1000 * Math.pow(2, attempt));
                 }} else {{
                     console.error('Failed to track event:', xhr.statusText);
                 }}
@@ -137,9 +162,10 @@ def detail(id):
 (function(w,d,p){{
   w[p]=w[p]||{{}};
   var id='{project.tracking_id}';
-  var aid='xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g,function(c){{
+  var g=function(){{return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g,function(c){{
     var r=Math.random()*16|0,v=c=='x'?r:(r&0x3|0x8);return v.toString(16);
-  }});
+  }});}};
+  var aid=g();
   
   w[p].track=function(n,p){{
     var x=new XMLHttpRequest();
@@ -150,6 +176,7 @@ def detail(id):
       event_name:n,
       properties:p||{{}},
       anonymous_id:aid,
+      message_id:g(),
       timestamp:new Date().toISOString()
     }}));
   }};
@@ -185,8 +212,11 @@ def edit(id):
     
     form = ProjectForm(obj=project)
     if form.validate_on_submit():
+        old_tracking_id = project.tracking_id
         form.populate_obj(project)
         db.session.commit()
+        tracking_id_cache.invalidate(old_tracking_id)
+        tracking_id_cache.invalidate(project.tracking_id)
         flash('Project updated successfully!', 'success')
         return redirect(url_for('project.detail', id=project.id))
     
@@ -202,12 +232,73 @@ def delete(id):
     if project.user_id != current_user.id:
         abort(403)
     
+    tracking_id = project.tracking_id
+    sessionizer.forget(id)
+    # Bulk deletes, so the relationship cascades below find nothing to load row by row
+    for table in PROJECT_TABLES:
+        table.query.filter(table.project_id == id).delete(synchronize_session=False)
     db.session.delete(project)
     db.session.commit()
+    tracking_id_cache.invalidate(tracking_id)
+    event_segments.drop(id)
     flash('Project deleted successfully!', 'success')
     return redirect(url_for('project.list'))
 
 
+@bp.route('/<int:id>/import', methods=['POST'])
+@login_required
+def import_events(id):
+    """
+    Backfill historical events from an NDJSON or CSV file (optionally gzipped).
+    Accepts a multipart upload in the 'file' field or the raw file as the request
+    body. Each request must fit in MAX_CONTENT_LENGTH, so larger exports are sent
+    as several parts or loaded with `flask events import`.
+    """
+    project = Project.query.get_or_404(id)
+    
+    # Security check - only allow importing into own projects
+    if project.user_id != current_user.id:
+        abort(403)
+    
+    upload = request.files.get('file')
+    if upload:
+        stream = upload.stream
+        fmt = BackfillImporter.detect_format(upload.filename, upload.mimetype)
+    else:
+        stream = request.stream
+        fmt = BackfillImporter.detect_format(content_type=request.mimetype)
+    fmt = request.args.get('format', fmt)
+    
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({"status": "error", "message": "format must be ndjson or csv"}), 400
+    
+    importer = BackfillImporter(project, chunk_size=current_app.config.get('BACKFILL_CHUNK_SIZE', 5000))
+    try:
+        summary = importer.run(stream, fmt)
+    except Exception as e:
+        current_app.logger.error(f"Error importing events: {str(e)}")
+        return jsonify(dict(importer.summary(), status="error", message="Import failed")), 500
+    
+    return jsonify(dict(summary, status="success")), 200
+
+# Conversion windows (hours) offered for funnels on the analytics page
+FUNNEL_WINDOWS = (1, 24, 24 * 7, 24 * 30)
+
+def _analytics_placeholders(time_period):
+    """Empty widget data shown in place of a computation that failed or timed out"""
+    return {
+        'active_users': {'count': 0, 'change': 0, 'change_percent': 0, 'time_period': time_period},
+        'event_frequency': {'periods': [], 'counts': [], 'event_name': None, 'time_period': time_period},
+        'top_events': {'events': [], 'counts': []},
+        'user_segments': {'segments': [], 'metrics': {
+            'segment_counts': dict.fromkeys(LIFECYCLE_SEGMENTS, 0),
+            'segment_percentages': dict.fromkeys(LIFECYCLE_SEGMENTS, 0)
+        }},
+        'funnel': None,
+        'anomalies': {'has_anomalies': False, 'anomalies': [], 'confidence': 0, 'message': 'Unavailable'},
+        'sentiment': {'scored': 0}
+    }
+
 @bp.route('/<int:id>/analytics')
 @login_required
 def analytics(id):
@@ -223,12 +314,42 @@ def analytics(id):
     if time_period not in ['day', 'week', 'month']:
         time_period = 'day'
     
-    # Get analytics data
-    active_users = AnalyticsService.get_active_users(project.id, time_period)
-    event_frequency = AnalyticsService.get_event_frequency(project.id, None, time_period)
-    top_events = AnalyticsService.get_top_events(project.id)
-    user_segments = MLInsightService.get_user_segments(project.id)
-    anomalies = MLInsightService.detect_anomalies(project.id, None, time_period)
+    # Chart buckets follow the viewer's timezone (IANA name, default UTC)
+    timezone = request.args.get('tz', 'UTC')
+    try:
+        TimeBucketer.get_timezone(timezone)
+    except ValueError:
+        timezone = 'UTC'
+    
+    # Run the independent widget queries concurrently, each in its own session
+    batch = query_executor.batch()
+    batch.submit('active_users', AnalyticsService.get_active_users, project.id, time_period)
+    batch.submit('event_frequency', AnalyticsService.get_event_frequency, project.id, None, time_period, timezone)
+    batch.submit('top_events', AnalyticsService.get_top_events, project.id)
+    batch.submit('user_segments', MLInsightService.get_user_segments, project.id)
+    batch.submit('anomalies', MLInsightService.get_anomalies, project.id)
+    batch.submit('sentiment', AnalyticsService.get_sentiment_summary, project.id)
+    
+    # Optional funnel: comma-separated event names and a conversion window in hours
+    funnel_steps = [step.strip() for step in request.args.get('funnel', '').split(',') if step.strip()]
+    funnel_window = request.args.get('funnel_window', 24 * 7, type=int)
+    if funnel_window not in FUNNEL_WINDOWS:
+        funnel_window = 24 * 7
+    if 2 <= len(funnel_steps) <= MAX_FUNNEL_STEPS:
+        batch.submit('funnel', AnalyticsService.get_funnel, project.id, tuple(funnel_steps), funnel_window * 3600)
+    results, failures = batch.gather()
+    
+    # Widgets that failed or timed out render empty, with a notice
+    placeholders = _analytics_placeholders(time_period)
+    for name in failures:
+        results[name] = placeholders[name]
+    active_users = results['active_users']
+    event_frequency = results['event_frequency']
+    top_events = results['top_events']
+    user_segments = results['user_segments']
+    anomalies = results['anomalies']
+    sentiment = results['sentiment']
+    funnel = results.get('funnel')
     
     # Get total events count
     total_events = sum(event_frequency['counts']) if event_frequency['counts'] else 0
@@ -240,13 +361,60 @@ def analytics(id):
                           title=f"{project.name} Analytics",
                           project=project,
                           time_period=time_period,
+                          timezone=timezone,
                           active_users=active_users,
                           event_frequency=event_frequency,
                           top_events=top_events,
                           user_segments=user_segments,
                           anomalies=anomalies,
+                          sentiment=sentiment,
                           total_events=total_events,
-                          events_per_user=events_per_user)
+                          events_per_user=events_per_user,
+                          funnel=funnel,
+                          funnel_steps=funnel_steps,
+                          funnel_window=funnel_window,
+                          funnel_windows=FUNNEL_WINDOWS,
+                          unavailable=failures)
+
+# Steps offered for path exploration on the paths page
+PATH_DEPTHS = (1, 2, 3, 4, 5)
+
+@bp.route('/<int:id>/paths')
+@login_required
+def paths(id):
+    """Show the flows before or after an event, and the most common paths"""
+    project = Project.query.get_or_404(id)
+    
+    # Security check - only allow viewing own projects
+    if project.user_id != current_user.id:
+        abort(403)
+    
+    # Without an anchor event, flows start at path starts (or end at path ends)
+    anchor = request.args.get('anchor') or None
+    direction = request.args.get('direction', 'next')
+    if direction not in ('next', 'previous'):
+        direction = 'next'
+    depth = request.args.get('depth', 3, type=int)
+    if depth not in PATH_DEPTHS:
+        depth = 3
+    
+    batch = query_executor.batch()
+    batch.submit('flow', AnalyticsService.get_paths, project.id, anchor, direction, depth)
+    batch.submit('summary', AnalyticsService.get_path_summary, project.id)
+    batch.submit('top_events', AnalyticsService.get_top_events, project.id, 20)
+    results, failures = batch.gather()
+    
+    return render_template('projects/paths.html',
+                          title=f"{project.name} Paths",
+                          project=project,
+                          anchor=anchor,
+                          direction=direction,
+                          depth=depth,
+                          depths=PATH_DEPTHS,
+                          flow=results.get('flow'),
+                          summary=results.get('summary'),
+                          events=results['top_events']['events'] if 'top_events' in results else [],
+                          unavailable=failures)
 
 @bp.route('/<int:id>/connection-test')
 @login_required
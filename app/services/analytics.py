@@ -1,47 +1,69 @@
 from datetime import datetime, timedelta
-from sqlalchemy import func, desc, and_
-from collections import defaultdict
-import numpy as np
+from flask import current_app, g, has_request_context
 from app.models import db
-from app.models.event import Event
 from app.models.project import Project
+from app.services.event_types import event_type_cache
+from app.services.anomalies import AnomalyDetector
+from app.services.rollups import RollupService
+from app.services.sketches import IdentitySketchService
+from app.services.retention import RetentionEngine
+from app.services.clustering import BehaviorClustering
+from app.services.funnels import FunnelEngine
+from app.services.paths import PathAnalyzer
+from app.services.sessions import Sessionizer
+from app.services.sentiment import FeedbackScorer, sentiment_analyzer
+from app.services.time_buckets import TimeBucketer
+from app.utils.query_cache import QueryCache
+
+def get_data_version(project_id):
+    """Current data version of a project, read at most once per request"""
+    if has_request_context():
+        versions = g.setdefault('project_data_versions', {})
+        if project_id not in versions:
+            versions[project_id] = db.session.query(Project.data_version).filter(Project.id == project_id).scalar()
+        return versions[project_id]
+    return db.session.query(Project.data_version).filter(Project.id == project_id).scalar()
+
+# Shared result cache for the analytics services, configured in create_app
+analytics_cache = QueryCache(get_data_version)
 
 class AnalyticsService:
     @staticmethod
-    def get_active_users(project_id, time_period='day'):
+    @analytics_cache.cached
+    def get_active_users(project_id, time_period='day', exact=None):
         """
-        Get count of active users for a project within time period
+        Get count of active users for a project within time period.
+        Small projects are counted exactly; larger ones are estimated by merging
+        HyperLogLog sketches, and error_bound gives the relative standard error.
+        Pass exact=True/False to force either mode.
         """
         # Determine the cutoff date based on time_period
-        cutoff = datetime.utcnow()
+        now = datetime.utcnow()
         if time_period == 'day':
-            cutoff = cutoff - timedelta(days=1)
+            period = timedelta(days=1)
         elif time_period == 'week':
-            cutoff = cutoff - timedelta(days=7)
+            period = timedelta(days=7)
         elif time_period == 'month':
-            cutoff = cutoff - timedelta(days=30)
-        
-        # Count unique user_ids + anonymous_ids
-        query = db.session.query(
-            func.count(func.distinct(Event.user_id if Event.user_id is not None else Event.anonymous_id))
-        ).filter(
-            Event.project_id == project_id,
-            Event.timestamp >= cutoff
-        )
-        
-        count = query.scalar() or 0
-        
-        # Get previous period for comparison
-        previous_cutoff = cutoff - (cutoff - datetime.utcnow())
-        previous_query = db.session.query(
-            func.count(func.distinct(Event.user_id if Event.user_id is not None else Event.anonymous_id))
-        ).filter(
-            Event.project_id == project_id,
-            Event.timestamp >= previous_cutoff,
-            Event.timestamp < cutoff
-        )
+            period = timedelta(days=30)
+        cutoff = now - period
+        # Previous period of the same length for comparison
+        previous_cutoff = cutoff - period
+        
+        if exact is None:
+            threshold = current_app.config.get('ACTIVE_USERS_EXACT_THRESHOLD', 20000)
+            exact = RollupService.count_range(project_id, previous_cutoff, now) <= threshold
+        
+        # Count unique identities (known users and anonymous visitors)
+        if exact:
+            count = IdentitySketchService.exact_count(project_id, cutoff, now)
+            previous_count = IdentitySketchService.exact_count(project_id, previous_cutoff, cutoff)
+            error_bound = 0
+        else:
+            sketch = IdentitySketchService.window_sketch(project_id, cutoff, now)
+            count = sketch.count()
+            previous_count = IdentitySketchService.window_sketch(project_id, previous_cutoff, cutoff).count()
+            error_bound = round(sketch.relative_error, 4)
         
-        previous_count = previous_query.scalar() or 0
         change = count - previous_count
         change_percent = (change / previous_count * 100) if previous_count > 0 else 0
         
@@ -49,80 +71,67 @@ class AnalyticsService:
             'count': count,
             'change': change,
             'change_percent': round(change_percent, 1),
-            'time_period': time_period
+            'time_period': time_period,
+            'exact': exact,
+            'error_bound': error_bound
         }
     
     @staticmethod
-    def get_event_frequency(project_id, event_name=None, time_period='day'):
+    @analytics_cache.cached
+    def get_event_frequency(project_id, event_name=None, time_period='day', timezone='UTC', granularity=None):
         """
-        Get frequency of events within time period
+        Get frequency of events within time period, as a zero-filled series of
+        buckets in the given timezone (hourly for a day, daily otherwise, unless
+        granularity is 'minute', 'hour', 'day' or 'week')
         """
-        # Determine the cutoff date based on time_period
-        cutoff = datetime.utcnow()
+        # Determine the cutoff date and default bucket size based on time_period
+        now = datetime.utcnow()
         if time_period == 'day':
-            cutoff = cutoff - timedelta(days=1)
-            group_by = func.strftime('%H', Event.timestamp)
-            format_str = '%H:00'
+            cutoff = now - timedelta(days=1)
+            granularity = granularity or 'hour'
         elif time_period == 'week':
-            cutoff = cutoff - timedelta(days=7)
-            group_by = func.strftime('%Y-%m-%d', Event.timestamp)
-            format_str = '%Y-%m-%d'
+            cutoff = now - timedelta(days=7)
+            granularity = granularity or 'day'
         elif time_period == 'month':
-            cutoff = cutoff - timedelta(days=30)
-            group_by = func.strftime('%Y-%m-%d', Event.timestamp)
-            format_str = '%Y-%m-%d'
+            cutoff = now - timedelta(days=30)
+            granularity = granularity or 'day'
         
-        # Build the query
-        query = db.session.query(
-            group_by.label('period'),
-            func.count(Event.id).label('count')
-        ).filter(
-            Event.project_id == project_id,
-            Event.timestamp >= cutoff
-        )
+        # Bucket boundaries in the requested timezone, starting on a whole bucket
+        tz = TimeBucketer.get_timezone(timezone)
+        bounds = TimeBucketer.boundaries(cutoff, now, granularity, tz)
         
-        # Add event_name filter if provided
+        # Add event_name filter if provided; unknown names have no events
         if event_name:
-            query = query.filter(Event.event_name == event_name)
-        
-        # Group by time period and order by period
-        query = query.group_by('period').order_by('period')
-        
-        # Execute query and process results
-        results = query.all()
+            event_type_id = event_type_cache.id_for(event_name)
+            counts = TimeBucketer.counts(project_id, bounds, now, event_type_id) if event_type_id else [0] * len(bounds)
+        else:
+            counts = TimeBucketer.counts(project_id, bounds, now)
         
         # Format the result for Plotly
-        periods = [r.period for r in results]
-        counts = [r.count for r in results]
+        periods = TimeBucketer.labels(bounds, granularity, tz)
         
         return {
             'periods': periods,
             'counts': counts,
             'event_name': event_name,
-            'time_period': time_period
+            'time_period': time_period,
+            'granularity': granularity,
+            'timezone': tz.key
         }
     
     @staticmethod
+    @analytics_cache.cached
     def get_top_events(project_id, limit=10):
         """
         Get the most frequent events for a project
         """
-        query = db.session.query(
-            Event.event_name,
-            func.count(Event.id).label('count')
-        ).filter(
-            Event.project_id == project_id
-        ).group_by(
-            Event.event_name
-        ).order_by(
-            desc('count')
-        ).limit(limit)
-        
-        results = query.all()
+        # Served from the daily rollup instead of scanning the project's full history
+        results = RollupService.top_event_types(project_id, limit)
+        names = event_type_cache.names_for(r.event_type_id for r in results)
         
         # Format the result for Plotly
-        events = [r.event_name for r in results]
-        counts = [r.count for r in results]
+        events = [names[r.event_type_id] for r in results]
+        counts = [int(r.count) for r in results]
         
         return {
             'events': events,
@@ -130,76 +139,57 @@ class AnalyticsService:
         }
     
     @staticmethod
-    def get_retention_data(project_id, weeks=8):
+    @analytics_cache.cached
+    def get_retention_data(project_id, weeks=8, unit='week', rolling=False):
         """
-        Calculate retention data for cohort analysis
+        Calculate retention data for cohort analysis.
+        unit='week' gives week-N retention over `weeks` weeks, unit='day' gives day-N
+        retention over the same window; rolling=True counts users active N or more
+        periods after their first one (unbounded retention)
         """
-        # Get the cutoff date (8 weeks ago)
-        cutoff = datetime.utcnow() - timedelta(weeks=weeks)
-        
-        # Get all users who had their first event in each week
-        first_events = db.session.query(
-            Event.user_id if Event.user_id is not None else Event.anonymous_id,
-            func.min(Event.timestamp).label('first_seen')
-        ).filter(
-            Event.project_id == project_id,
-            Event.timestamp >= cutoff
-        ).group_by(
-            Event.user_id if Event.user_id is not None else Event.anonymous_id
-        ).subquery()
-        
-        # Group users into weekly cohorts
-        user_cohorts = db.session.query(
-            func.strftime('%Y-%W', first_events.c.first_seen).label('cohort'),
-            func.count().label('count')
-        ).group_by(
-            'cohort'
-        ).order_by(
-            'cohort'
-        ).all()
-        
-        # For each cohort, calculate retention in subsequent weeks
-        retention_data = []
-        for cohort_row in user_cohorts:
-            cohort = cohort_row.cohort
-            cohort_size = cohort_row.count
-            
-            # Initialize cohort data
-            cohort_data = {
-                'cohort': cohort,
-                'size': cohort_size,
-                'retention': {}
-            }
-            
-            # Get users in this cohort
-            cohort_users = db.session.query(
-                Event.user_id if Event.user_id is not None else Event.anonymous_id
-            ).filter(
-                Event.project_id == project_id,
-                func.strftime('%Y-%W', Event.timestamp) == cohort
-            ).distinct().subquery()
-            
-            # For each subsequent week, calculate retention
-            for week in range(weeks):
-                target_date = datetime.strptime(f"{cohort}-1", "%Y-%W-%w") + timedelta(weeks=week)
-                target_week = target_date.strftime('%Y-%W')
-                
-                # Count users from cohort who were active in target week
-                retained_users = db.session.query(
-                    func.count(func.distinct(Event.user_id if Event.user_id is not None else Event.anonymous_id))
-                ).filter(
-                    Event.project_id == project_id,
-                    func.strftime('%Y-%W', Event.timestamp) == target_week,
-                    (Event.user_id if Event.user_id is not None else Event.anonymous_id).in_(cohort_users)
-                ).scalar() or 0
-                
-                # Calculate retention percentage
-                retention_pct = round((retained_users / cohort_size) * 100, 1) if cohort_size > 0 else 0
-                cohort_data['retention'][week] = retention_pct
-            
-            retention_data.append(cohort_data)
-        
-        return retention_data
+        return RetentionEngine.retention(project_id, weeks, unit, rolling)
+    
+    @staticmethod
+    @analytics_cache.cached
+    def get_funnel(project_id, steps, window=7 * 86400, days=30):
+        """
+        Get conversion through an ordered list of event names, each step
+        within window seconds of the first, for funnels started in the last days
+        """
+        return FunnelEngine.funnel(project_id, list(steps), window, days)
+    
+    @staticmethod
+    @analytics_cache.cached
+    def get_paths(project_id, anchor=None, direction='next', depth=3, days=30):
+        """
+        Get the flows after (direction='next') or before ('previous') an anchor
+        event, or from path starts when there is none, as Sankey nodes and links
+        """
+        return PathAnalyzer.explore(project_id, anchor, direction, depth, days)
+    
+    @staticmethod
+    @analytics_cache.cached
+    def get_path_summary(project_id, days=30):
+        """
+        Get the most common entry and exit events, transitions and sequences
+        """
+        return PathAnalyzer.summary(project_id, days)
+    
+    @staticmethod
+    @analytics_cache.cached
+    def get_session_metrics(project_id, days=30):
+        """
+        Get session count, average session length, events per session and bounce rate
+        """
+        return Sessionizer.metrics(project_id, days)
+    
+    @staticmethod
+    @analytics_cache.cached
+    def get_sentiment_summary(project_id, days=30):
+        """
+        Get the sentiment of the feedback scored in the last days, overall and per event
+        """
+        return FeedbackScorer.summary(project_id, days)
 
 class MLInsightService:
     @staticmethod
@@ -207,169 +197,34 @@ class MLInsightService:
         """
         Detect anomalies in event frequency
         """
-        # Get event frequency data
-        frequency_data = AnalyticsService.get_event_frequency(project_id, event_name, time_period)
-        
-        # Convert to numpy array for analysis
-        counts = np.array(frequency_data['counts'])
-        
-        # No data or insufficient data for anomaly detection
-        if len(counts) < 3:
-            return {
-                'has_anomalies': False,
-                'anomalies': [],
-                'confidence': 0,
-                'message': 'Insufficient data for anomaly detection'
-            }
-        
-        # Simple anomaly detection using Z-score
-        mean = np.mean(counts)
-        std = np.std(counts)
-        
-        # If standard deviation is 0, no anomalies can be detected
-        if std == 0:
-            return {
-                'has_anomalies': False,
-                'anomalies': [],
-                'confidence': 0,
-                'message': 'No variance in data for anomaly detection'
-            }
-        
-        # Calculate Z-scores
-        z_scores = (counts - mean) / std
-        
-        # Define anomaly threshold (usually 3 sigma)
-        threshold = 3
-        
-        # Find anomalies
-        anomalies = []
-        has_anomalies = False
-        
-        for i, z_score in enumerate(z_scores):
-            if abs(z_score) > threshold:
-                has_anomalies = True
-                anomalies.append({
-                    'period': frequency_data['periods'][i],
-                    'count': int(counts[i]),
-                    'z_score': round(float(z_score), 2),
-                    'severity': 'high' if abs(z_score) > 4 else 'medium'
-                })
-        
-        # Calculate confidence level based on data quantity
-        confidence = min(0.5 + 0.05 * len(counts), 0.95)
-        
-        return {
-            'has_anomalies': has_anomalies,
-            'anomalies': anomalies,
-            'confidence': round(confidence, 2),
-            'message': 'Anomalies detected' if has_anomalies else 'No anomalies detected'
-        }
+        days = {'day': 1, 'week': 7, 'month': 30}.get(time_period, 1)
+        return MLInsightService.get_anomalies(project_id, days, event_name)
     
     @staticmethod
+    def get_anomalies(project_id, days=7, event_name=None):
+        """
+        Get the anomalies found by the background detector in the last days
+        """
+        return AnomalyDetector.recent(project_id, days, event_name)
+    
+    @staticmethod
+    @analytics_cache.cached
     def get_user_segments(project_id):
         """
         Identify user segments based on behavior
         """
-        # Get all events for this project
-        events = db.session.query(
-            Event.user_id,
-            Event.anonymous_id,
-            Event.event_name,
-            func.count(Event.id).label('count')
-        ).filter(
-            Event.project_id == project_id
-        ).group_by(
-            Event.user_id,
-            Event.anonymous_id,
-            Event.event_name
-        ).all()
-        
-        # Process events into user behavior profiles
-        user_profiles = defaultdict(lambda: defaultdict(int))
-        
-        for event in events:
-            user_id = event.user_id or event.anonymous_id
-            user_profiles[user_id][event.event_name] = event.count
-        
-        # Simple segmentation based on event patterns
-        segments = {
-            'power_users': [],
-            'casual_users': [],
-            'new_users': [],
-            'inactive_users': []
-        }
-        
-        # Define thresholds for segmentation
-        power_threshold = 20  # Users with > 20 total events
-        new_threshold = 3     # Users with <= 3 total events
-        
-        for user_id, profile in user_profiles.items():
-            total_events = sum(profile.values())
-            
-            if total_events > power_threshold:
-                segments['power_users'].append(user_id)
-            elif total_events <= new_threshold:
-                segments['new_users'].append(user_id)
-            else:
-                segments['casual_users'].append(user_id)
-        
-        # Calculate segment metrics
-        metrics = {
-            'total_users': len(user_profiles),
-            'segment_counts': {
-                'power_users': len(segments['power_users']),
-                'casual_users': len(segments['casual_users']),
-                'new_users': len(segments['new_users']),
-                'inactive_users': len(segments['inactive_users'])
-            },
-            'segment_percentages': {}
-        }
-        
-        # Calculate percentages
-        total = metrics['total_users']
-        if total > 0:
-            for segment, count in metrics['segment_counts'].items():
-                metrics['segment_percentages'][segment] = round((count / total) * 100, 1)
-        
-        return {
-            'segments': segments,
-            'metrics': metrics
-        }
+        return BehaviorClustering.segment(project_id)
     
     @staticmethod
     def analyze_sentiment(project_id, feedback_text):
         """
-        Simple sentiment analysis of user feedback (placeholder)
-        This would ideally use a proper NLP model
+        Analyze sentiment of user feedback
         """
-        # Placeholder implementation - would be replaced with actual NLP
-        positive_words = ['good', 'great', 'excellent', 'awesome', 'love', 'like', 'best', 'happy']
-        negative_words = ['bad', 'terrible', 'awful', 'hate', 'dislike', 'worst', 'poor', 'disappointed']
-        
-        # Normalize text
-        text = feedback_text.lower()
-        
-        # Count positive and negative words
-        positive_count = sum(1 for word in positive_words if word in text)
-        negative_count = sum(1 for word in negative_words if word in text)
-        
-        # Calculate sentiment score (-1 to 1)
-        total = positive_count + negative_count
-        if total == 0:
-            score = 0  # Neutral
-        else:
-            score = (positive_count - negative_count) / total
-        
-        # Determine sentiment category
-        if score > 0.3:
-            sentiment = 'positive'
-        elif score < -0.3:
-            sentiment = 'negative'
-        else:
-            sentiment = 'neutral'
-        
-        return {
-            'sentiment': sentiment,
-            'score': round(score, 2),
-            'confidence': 0.6  # Fixed confidence as this is a simple implementation
-        }
\ No newline at end of file
+        return sentiment_analyzer.score([feedback_text])[0]
+    
+    @staticmethod
+    def analyze_sentiments(project_id, feedback_texts):
+        """
+        Analyze sentiment of many feedback texts at once, in order
+        """
+        return sentiment_analyzer.score(feedback_texts)
@@ -0,0 +1,358 @@
+import atexit
+import io
+import threading
+import uuid
+from datetime import datetime, timedelta
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, or_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from app.models import db
+from app.models.insights import AnomalyState, EventAnomaly, WorkerLease
+from app.models.project import Project
+from app.models.rollup import EventRollupHourly
+from app.services.event_types import event_type_cache
+from app.utils.background import background_workers_enabled
+
+HOURS_PER_WEEK = 168
+# EWMA weights: the hourly level adapts over about a day, each hour-of-week slot over a few weeks
+LEVEL_ALPHA = 0.05
+SEASON_ALPHA = 0.3
+# Hours of history before an event type can be flagged, weeks before its hour-of-week profile is used
+WARMUP_HOURS = 48
+SEASON_MIN_WEEKS = 2
+
+LEASE_NAME = 'anomaly-detector'
+
+STATE_ARRAYS = ('type_ids', 'mean', 'var', 'n', 'season_mean', 'season_var', 'season_n')
+
+class AnomalyDetector:
+    """
+    Online anomaly detection over the hourly rollups of every event type.
+
+    Each event type of a project has an EWMA level with its variance and an
+    hour-of-week profile (168 EWMA means and variances). Closed hours are
+    read from the hourly rollups and folded in one at a time, every event
+    type at once as columns of NumPy arrays. An hour whose count is more
+    than ANOMALY_THRESHOLD standard deviations from its expectation (the
+    hour-of-week mean once SEASON_MIN_WEEKS weeks were seen, the level
+    before that) is stored in event_anomalies; the values folded into the
+    baselines are clipped to that band so an outage or spike does not
+    become the new normal. The baselines are saved per project in
+    anomaly_states, so each check only reads the hours closed since the
+    last one.
+
+    Events arriving after their hour was checked are not re-evaluated.
+
+    Every web worker starts the checking thread, but a pass only runs in the
+    one holding the 'anomaly-detector' row of worker_leases; it renews the
+    lease each pass and another worker takes over once it has not been
+    renewed for ANOMALY_LEASE_TTL seconds. Saving a project's baselines also
+    checks that its last_hour did not move since it was read (a manual
+    detect-anomalies run, or a worker that lost its lease mid-pass), so the
+    same hours are never folded in or flagged twice.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.app = None
+        self.interval = 300.0
+        self.lease_ttl = 900.0
+        # Identifies this process as the lease holder
+        self.holder = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._thread = None
+        self.checks = 0
+        self.failures = 0
+
+    def init_app(self, app):
+        """Read settings and start the checking thread when enabled and background workers run here"""
+        self.enabled = app.config.get('ANOMALY_DETECTION_ENABLED', True)
+        if not self.enabled or not background_workers_enabled(app):
+            return
+
+        self.app = app
+        self.interval = app.config.get('ANOMALY_CHECK_INTERVAL', 300)
+        self.lease_ttl = app.config.get('ANOMALY_LEASE_TTL', 900)
+        self.start()
+        atexit.register(self.shutdown)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='anomaly-detector', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    if self.acquire_lease():
+                        project_ids = [project_id for project_id, in db.session.query(Project.id).all()]
+                    else:
+                        project_ids = []
+                except Exception as e:
+                    db.session.rollback()
+                    self.failures += 1
+                    self.app.logger.error(f"Error listing projects for anomaly checks: {str(e)}")
+                    project_ids = []
+
+                for project_id in project_ids:
+                    try:
+                        self.update(project_id)
+                        self.checks += 1
+                    except Exception as e:
+                        db.session.rollback()
+                        self.failures += 1
+                        self.app.logger.error(f"Error checking project {project_id} for anomalies: {str(e)}")
+                db.session.remove()
+
+    def shutdown(self, timeout=30):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        # Let another worker take over without waiting for the lease to expire
+        with self.app.app_context():
+            try:
+                self.release_lease()
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.error(f"Error releasing the anomaly detector lease: {str(e)}")
+            db.session.remove()
+
+    def acquire_lease(self, now=None):
+        """Take or renew the lease on the checks unless another worker holds it; returns whether this one does"""
+        now = now or datetime.utcnow()
+        values = {'holder': self.holder, 'expires_at': now + timedelta(seconds=self.lease_ttl)}
+        renewed = db.session.execute(
+            WorkerLease.__table__.update().where(
+                WorkerLease.name == LEASE_NAME,
+                or_(WorkerLease.holder == self.holder, WorkerLease.expires_at < now)
+            ).values(**values)
+        ).rowcount
+        if not renewed:
+            dialect = db.session.get_bind().dialect.name
+            row = {'name': LEASE_NAME, **values}
+            if dialect == 'sqlite':
+                renewed = db.session.execute(sqlite_insert(WorkerLease).values(**row).on_conflict_do_nothing()).rowcount
+            elif dialect == 'postgresql':
+                renewed = db.session.execute(postgresql_insert(WorkerLease).values(**row).on_conflict_do_nothing()).rowcount
+            else:
+                try:
+                    with db.session.begin_nested():
+                        db.session.execute(WorkerLease.__table__.insert().values(**row))
+                    renewed = 1
+                except IntegrityError:
+                    renewed = 0
+        db.session.commit()
+        return bool(renewed)
+
+    def release_lease(self):
+        """Expire the lease now if this worker holds it"""
+        db.session.execute(
+            WorkerLease.__table__.update().where(
+                WorkerLease.name == LEASE_NAME,
+                WorkerLease.holder == self.holder
+            ).values(expires_at=datetime.utcnow())
+        )
+        db.session.commit()
+
+    @staticmethod
+    def empty_state():
+        return {
+            'type_ids': np.empty(0, dtype=np.int64),
+            'mean': np.empty(0), 'var': np.empty(0), 'n': np.empty(0, dtype=np.int64),
+            'season_mean': np.empty((0, HOURS_PER_WEEK)), 'season_var': np.empty((0, HOURS_PER_WEEK)),
+            'season_n': np.empty((0, HOURS_PER_WEEK), dtype=np.int64)
+        }
+
+    @staticmethod
+    def dump_state(state):
+        buffer = io.BytesIO()
+        np.savez(buffer, **state)
+        return buffer.getvalue()
+
+    @staticmethod
+    def load_state(blob):
+        with np.load(io.BytesIO(blob)) as arrays:
+            return {name: arrays[name] for name in STATE_ARRAYS}
+
+    @staticmethod
+    def add_types(state, type_ids):
+        """Give event types not tracked yet empty baselines; returns the column of each type id"""
+        new = np.setdiff1d(np.asarray(type_ids, dtype=np.int64), state['type_ids'])
+        if len(new):
+            state['type_ids'] = np.concatenate([state['type_ids'], new])
+            for name in ('mean', 'var', 'n'):
+                state[name] = np.concatenate([state[name], np.zeros(len(new), dtype=state[name].dtype)])
+            for name in ('season_mean', 'season_var', 'season_n'):
+                state[name] = np.vstack([state[name], np.zeros((len(new), HOURS_PER_WEEK), dtype=state[name].dtype)])
+        return {int(type_id): column for column, type_id in enumerate(state['type_ids'])}
+
+    @staticmethod
+    def hour_of_week(hours):
+        """Monday 00:00 UTC = 0 for hours since the epoch (which began on a Thursday)"""
+        return (np.asarray(hours) + 3 * 24) % HOURS_PER_WEEK
+
+    @staticmethod
+    def evaluate(counts, slots, state, threshold, min_deviation):
+        """
+        Score hours of counts (hours x event types) against the baselines and
+        fold them in, updating state in place. Returns (expected, z scores, flagged).
+        """
+        mean, var, n = state['mean'], state['var'], state['n']
+        season_mean, season_var, season_n = state['season_mean'], state['season_var'], state['season_n']
+        expected = np.zeros(counts.shape)
+        z_scores = np.zeros(counts.shape)
+        flagged = np.zeros(counts.shape, dtype=bool)
+
+        for hour, (x, slot) in enumerate(zip(counts, slots)):
+            seasonal = season_n[:, slot] >= SEASON_MIN_WEEKS
+            expect = np.where(seasonal, season_mean[:, slot], mean)
+            # Counts are at least Poisson-noisy
+            std = np.sqrt(np.maximum.reduce([np.where(seasonal, season_var[:, slot], var), expect, np.ones(len(x))]))
+            z = (x - expect) / std
+            warm = n >= WARMUP_HOURS
+            expected[hour], z_scores[hour] = expect, z
+            flagged[hour] = warm & (np.abs(z) > threshold) & (np.abs(x - expect) >= min_deviation)
+
+            # Fold the hour in, clipped to the normal band once the baseline is warm
+            value = np.where(warm, np.clip(x, expect - threshold * std, expect + threshold * std), x)
+            first = n == 0
+            delta = value - mean
+            mean[:] = np.where(first, value, mean + LEVEL_ALPHA * delta)
+            var[:] = np.where(first, 0, (1 - LEVEL_ALPHA) * (var + LEVEL_ALPHA * delta ** 2))
+            n += 1
+
+            first = season_n[:, slot] == 0
+            delta = value - season_mean[:, slot]
+            season_var[:, slot] = np.where(first, 0, (1 - SEASON_ALPHA) * (season_var[:, slot] + SEASON_ALPHA * delta ** 2))
+            season_mean[:, slot] = np.where(first, value, season_mean[:, slot] + SEASON_ALPHA * delta)
+            season_n[:, slot] += 1
+        return expected, z_scores, flagged
+
+    @staticmethod
+    def _store(rows):
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'sqlite':
+            statement = sqlite_insert(EventAnomaly).on_conflict_do_nothing()
+        elif dialect == 'postgresql':
+            statement = postgresql_insert(EventAnomaly).on_conflict_do_nothing()
+        else:
+            statement = EventAnomaly.__table__.insert()
+        db.session.execute(statement, rows)
+
+    @classmethod
+    def update(cls, project_id, now=None):
+        """
+        Fold the hours closed since the last check into the baselines; returns
+        the anomalies found, 0 when another check saved the project first.
+        """
+        end = (now or datetime.utcnow()).replace(minute=0, second=0, microsecond=0)
+        history = timedelta(days=current_app.config.get('ANOMALY_HISTORY_DAYS', 28))
+        stored = db.session.get(AnomalyState, project_id)
+        start = max(stored.last_hour + timedelta(hours=1) if stored else end - history, end - history)
+        if start >= end:
+            return 0
+
+        rollups = db.session.query(
+            EventRollupHourly.event_type_id,
+            EventRollupHourly.bucket,
+            EventRollupHourly.count
+        ).filter(
+            EventRollupHourly.project_id == project_id,
+            EventRollupHourly.bucket >= start,
+            EventRollupHourly.bucket < end
+        ).all()
+
+        state = cls.load_state(stored.state) if stored else cls.empty_state()
+        columns = cls.add_types(state, [row.event_type_id for row in rollups])
+        n_hours = int((end - start).total_seconds() // 3600)
+        counts = np.zeros((n_hours, len(columns)))
+        for event_type_id, bucket, count in rollups:
+            counts[int((bucket - start).total_seconds() // 3600), columns[event_type_id]] = count
+
+        first_hour = int((start - datetime(1970, 1, 1)).total_seconds() // 3600)
+        slots = cls.hour_of_week(np.arange(first_hour, first_hour + n_hours))
+        threshold = current_app.config.get('ANOMALY_THRESHOLD', 3.5)
+        expected, z_scores, flagged = cls.evaluate(
+            counts, slots, state, threshold, current_app.config.get('ANOMALY_MIN_DEVIATION', 5)
+        )
+
+        hours, found = np.nonzero(flagged)
+        if len(hours):
+            now = datetime.utcnow()
+            cls._store([{
+                'project_id': project_id,
+                'event_type_id': int(state['type_ids'][column]),
+                'bucket': start + timedelta(hours=int(hour)),
+                'count': int(counts[hour, column]),
+                'expected': round(float(expected[hour, column]), 2),
+                'z_score': round(float(z_scores[hour, column]), 2),
+                'severity': 'high' if abs(z_scores[hour, column]) > threshold * 1.5 else 'medium',
+                'detected_at': now
+            } for hour, column in zip(hours.tolist(), found.tolist())])
+
+        stored = stored or AnomalyState(project_id=project_id, hours_observed=0)
+        stored.last_hour = end - timedelta(hours=1)
+        stored.hours_observed += n_hours
+        stored.state = cls.dump_state(state)
+        db.session.add(stored)
+        try:
+            db.session.commit()
+        except (StaleDataError, IntegrityError):
+            # Another check folded these hours in since they were read; keep its result
+            db.session.rollback()
+            return 0
+        return len(hours)
+
+    @staticmethod
+    def reset(project_id):
+        """Forget a project's baselines and detected anomalies"""
+        AnomalyState.query.filter_by(project_id=project_id).delete()
+        EventAnomaly.query.filter_by(project_id=project_id).delete()
+        db.session.commit()
+
+    @staticmethod
+    def recent(project_id, days=7, event_name=None, limit=50):
+        """Stored anomalies of the last days, the strongest first, in the shape the analytics page shows"""
+        query = EventAnomaly.query.filter(
+            EventAnomaly.project_id == project_id,
+            EventAnomaly.bucket >= datetime.utcnow() - timedelta(days=days)
+        )
+        if event_name is not None:
+            query = query.filter(EventAnomaly.event_type_id == event_type_cache.id_for(event_name))
+        anomalies = query.order_by(func.abs(EventAnomaly.z_score).desc()).limit(limit).all()
+        hours = db.session.query(AnomalyState.hours_observed).filter(AnomalyState.project_id == project_id).scalar()
+
+        if not hours:
+            return {
+                'has_anomalies': False,
+                'anomalies': [],
+                'confidence': 0,
+                'message': 'Baselines are still being built'
+            }
+        names = event_type_cache.names_for(anomaly.event_type_id for anomaly in anomalies)
+        return {
+            'has_anomalies': bool(anomalies),
+            'anomalies': [{
+                'period': anomaly.bucket.strftime('%Y-%m-%d %H:00'),
+                'event_name': names.get(anomaly.event_type_id),
+                'count': anomaly.count,
+                'expected': anomaly.expected,
+                'z_score': anomaly.z_score,
+                'severity': anomaly.severity
+            } for anomaly in anomalies],
+            # Grows with the weeks of history behind the hour-of-week baselines
+            'confidence': round(min(0.5 + 0.1 * hours / HOURS_PER_WEEK, 0.95), 2),
+            'message': 'Anomalies detected' if anomalies else 'No anomalies detected'
+        }
+
+# Shared instance, configured in create_app
+anomaly_detector = AnomalyDetector()
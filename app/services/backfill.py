@@ -0,0 +1,132 @@
+import csv
+import gzip
+import io
+import json
+from flask import current_app
+from app.models import db
+from app.services.event_processing import EventProcessingService, EventValidationError
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Columns of a CSV export that map directly onto an event; anything else goes into properties
+CSV_EVENT_COLUMNS = {'event_name', 'user_id', 'anonymous_id', 'timestamp', 'properties', 'project_id'}
+
+class BackfillImporter:
+    """
+    Streams historical events from NDJSON or CSV files into a project.
+
+    Input is read and parsed incrementally (gzip is detected from the magic
+    bytes) and written in chunked transactions, so memory use depends on
+    the chunk size only, never on the file size.
+    """
+
+    def __init__(self, project, chunk_size=5000, progress=None, max_errors=20):
+        self.project = project
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.max_errors = max_errors
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []
+
+    @staticmethod
+    def detect_format(filename=None, content_type=None):
+        """Guess 'ndjson' or 'csv' from a file name or content type"""
+        name = (filename or '').lower()
+        if name.endswith('.gz'):
+            name = name[:-3]
+        if name.endswith('.csv') or (content_type or '').startswith('text/csv'):
+            return 'csv'
+        return 'ndjson'
+
+    @staticmethod
+    def open_text(stream):
+        """Wrap a binary stream as text, transparently decompressing gzip"""
+        buffered = stream if hasattr(stream, 'peek') else io.BufferedReader(stream)
+        if buffered.peek(2)[:2] == GZIP_MAGIC:
+            buffered = gzip.GzipFile(fileobj=buffered, mode='rb')
+        return io.TextIOWrapper(buffered, encoding='utf-8', newline='')
+
+    @staticmethod
+    def iter_ndjson(text):
+        """Yield (line number, record) for each non-empty line"""
+        for line_number, line in enumerate(text, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, EventValidationError(f"Invalid JSON: {e.msg}")
+
+    @staticmethod
+    def iter_csv(text):
+        """Yield (line number, record) for each CSV row, folding extra columns into properties"""
+        reader = csv.DictReader(text)
+        for row in reader:
+            record = {key: value for key, value in row.items() if key in CSV_EVENT_COLUMNS and value != ''}
+            properties = {}
+            if record.get('properties'):
+                try:
+                    properties = json.loads(record['properties'])
+                except json.JSONDecodeError:
+                    yield reader.line_num, EventValidationError("properties column is not valid JSON")
+                    continue
+            for key, value in row.items():
+                if key and key not in CSV_EVENT_COLUMNS and value not in (None, ''):
+                    properties[key] = value
+            record['properties'] = properties
+            yield reader.line_num, record
+
+    def run(self, stream, fmt='ndjson'):
+        """Import every record from a binary stream and return a summary dict"""
+        text = self.open_text(stream)
+        records = self.iter_csv(text) if fmt == 'csv' else self.iter_ndjson(text)
+
+        chunk = []
+        for line_number, record in records:
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                if not isinstance(record, dict):
+                    raise EventValidationError("Record must be a JSON object")
+                # Imported events always belong to the target project
+                record['project_id'] = self.project.tracking_id
+                event = EventProcessingService.validate_event(record, strict_timestamp=True)
+            except EventValidationError as e:
+                self._reject(line_number, str(e))
+                continue
+
+            chunk.append(EventProcessingService.build_row(event, self.project.id))
+            if len(chunk) >= self.chunk_size:
+                self._write_chunk(chunk)
+                chunk = []
+
+        if chunk:
+            self._write_chunk(chunk)
+
+        return self.summary()
+
+    def _write_chunk(self, rows):
+        try:
+            EventProcessingService.store_events(rows)
+        except Exception:
+            db.session.rollback()
+            current_app.logger.error(f"Backfill aborted after {self.imported} events for project {self.project.id}")
+            raise
+        self.imported += len(rows)
+        if self.progress:
+            self.progress(self.imported, self.rejected)
+
+    def _reject(self, line_number, message):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line_number, 'message': message})
+
+    def summary(self):
+        return {
+            'project_id': self.project.id,
+            'imported': self.imported,
+            'rejected': self.rejected,
+            'errors': self.errors
+        }
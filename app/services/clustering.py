@@ -0,0 +1,216 @@
+import pickle
+import time
+from datetime import datetime
+import numpy as np
+from flask import current_app
+from scipy.sparse import csr_matrix
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.feature_extraction.text import TfidfTransformer
+from sqlalchemy import func
+from app.models import db
+from app.models.event import Event
+from app.models.insights import UserSegmentModel
+from app.services.event_types import event_type_cache
+from app.services.segments import event_segments, EventSegmentStore
+
+LIFECYCLE_SEGMENTS = ('power_users', 'casual_users', 'new_users', 'dormant_users', 'inactive_users')
+
+class BehaviorClustering:
+    """
+    User segments of a project from what its users do.
+
+    Every identity becomes a sparse row of event counts per event type,
+    read with one grouped query (plus columnar segments for closed days).
+    The rows are TF-IDF weighted with log-scaled counts, so clusters follow
+    the mix of events rather than raw volume, and grouped by MiniBatchKMeans.
+    Each cluster is named after the event types that weigh most in its
+    centre. The fit is stored per project: later calls assign users with
+    it and fold new users in with partial_fit, refitting from scratch only
+    when it is older than SEGMENT_MODEL_MAX_AGE days or the user base has
+    doubled.
+
+    Lifecycle segments come from recency and volume: users idle for
+    SEGMENT_INACTIVE_DAYS are inactive, for SEGMENT_DORMANT_DAYS dormant;
+    active users first seen within the dormant window are new, and the
+    busiest fifth of the others are power users.
+    """
+
+    @staticmethod
+    def profiles(project_id):
+        """
+        (identities, CSR matrix of event counts per identity and event type,
+        event type ids of the columns, first and last seen in epoch seconds)
+        """
+        days = event_segments.fresh_days(project_id)
+        query = db.session.query(
+            Event.identity,
+            Event.event_type_id,
+            func.count(Event.id),
+            func.min(Event.timestamp),
+            func.max(Event.timestamp)
+        ).filter(
+            Event.project_id == project_id,
+            Event.identity.isnot(None)
+        )
+        skip = EventSegmentStore.excluding(Event.timestamp, days)
+        if skip is not None:
+            query = query.filter(skip)
+        rows = query.group_by(Event.identity, Event.event_type_id).all()
+        identities, types, counts, first, last = [], [], [], [], []
+        if rows:
+            identities, types, counts, first, last = (list(column) for column in zip(*rows))
+        first = np.array(first, dtype='datetime64[s]').astype(np.int64)
+        last = np.array(last, dtype='datetime64[s]').astype(np.int64)
+
+        scan = event_segments.scan(project_id, days)
+        present = np.flatnonzero(scan.identity >= 0)
+        if len(present):
+            pairs, inverse, pair_counts = np.unique(
+                np.stack([scan.identity[present], scan.event_type_id[present]]),
+                axis=1, return_inverse=True, return_counts=True
+            )
+            inverse = inverse.ravel()
+            pair_first = np.full(pairs.shape[1], np.iinfo(np.int64).max)
+            pair_last = np.full(pairs.shape[1], np.iinfo(np.int64).min)
+            np.minimum.at(pair_first, inverse, scan.timestamp[present])
+            np.maximum.at(pair_last, inverse, scan.timestamp[present])
+            identities += scan.identities[pairs[0]].tolist()
+            types += pairs[1].tolist()
+            counts += pair_counts.tolist()
+            first = np.concatenate([first, pair_first])
+            last = np.concatenate([last, pair_last])
+
+        names, rows_index = np.unique(np.array(identities, dtype=object), return_inverse=True)
+        type_ids, columns = np.unique(np.array(types, dtype=np.int64), return_inverse=True)
+        # Pairs split between SQL and segments are summed by the CSR constructor
+        matrix = csr_matrix((np.array(counts, dtype=np.float64), (rows_index, columns)),
+                            shape=(len(names), len(type_ids)))
+        first_seen = np.full(len(names), np.iinfo(np.int64).max)
+        last_seen = np.full(len(names), np.iinfo(np.int64).min)
+        np.minimum.at(first_seen, rows_index, first)
+        np.maximum.at(last_seen, rows_index, last)
+        return names, matrix, type_ids, first_seen, last_seen
+
+    @staticmethod
+    def align(matrix, type_ids, model_type_ids):
+        """Re-index the columns on a fitted model's event types; types it never saw are dropped"""
+        position = {type_id: index for index, type_id in enumerate(model_type_ids)}
+        column_map = np.array([position.get(int(type_id), -1) for type_id in type_ids], dtype=np.int64)
+        coo = matrix.tocoo()
+        keep = column_map[coo.col] >= 0
+        return csr_matrix((coo.data[keep], (coo.row[keep], column_map[coo.col[keep]])),
+                          shape=(matrix.shape[0], len(model_type_ids)))
+
+    @staticmethod
+    def fit(matrix, type_ids, n_clusters):
+        """Fit the TF-IDF weighting and the clustering"""
+        tfidf = TfidfTransformer(sublinear_tf=True).fit(matrix)
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=0, batch_size=1024, n_init=3)
+        kmeans.fit(tfidf.transform(matrix))
+        return {'type_ids': [int(type_id) for type_id in type_ids], 'tfidf': tfidf, 'kmeans': kmeans}
+
+    @classmethod
+    def _model(cls, project_id, matrix, type_ids, first_seen, n_clusters):
+        """The project's fitted model and its last full fit, refitted or updated with new users as needed"""
+        stored = db.session.get(UserSegmentModel, project_id)
+        now = datetime.utcnow()
+        max_age = current_app.config.get('SEGMENT_MODEL_MAX_AGE', 7) * 86400
+        model = pickle.loads(stored.model) if stored is not None else None
+        if (model is None
+                or model['kmeans'].n_clusters != n_clusters
+                or (now - stored.fitted_at).total_seconds() > max_age
+                or matrix.shape[0] >= 2 * stored.n_users):
+            model = cls.fit(matrix, type_ids, n_clusters)
+            stored = stored or UserSegmentModel(project_id=project_id)
+            stored.fitted_at = now
+            stored.n_users = matrix.shape[0]
+        else:
+            # Users first seen since the last update move the centres a little
+            new_users = first_seen > (stored.updated_at - datetime(1970, 1, 1)).total_seconds()
+            if not new_users.any():
+                return model, stored.fitted_at
+            features = model['tfidf'].transform(cls.align(matrix[new_users], type_ids, model['type_ids']))
+            model['kmeans'].partial_fit(features)
+
+        stored.updated_at = now
+        stored.model = pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+        db.session.add(stored)
+        db.session.commit()
+        return model, stored.fitted_at
+
+    @staticmethod
+    def _labels(centers, type_ids, limit=2):
+        """Name each cluster after its heaviest event types"""
+        names = event_type_cache.names_for(int(type_id) for type_id in type_ids)
+        labels = []
+        for center in centers:
+            top = [names[int(type_ids[index])] for index in np.argsort(center)[::-1][:limit] if center[index] > 0]
+            label = ' + '.join(top) or 'No events'
+            labels.append(label if label not in labels else f"{label} ({len(labels) + 1})")
+        return labels
+
+    @staticmethod
+    def lifecycle(totals, first_seen, last_seen, now=None):
+        """Boolean masks of the lifecycle segments, from recency and event volume"""
+        now = now or time.time()
+        dormant_after = current_app.config.get('SEGMENT_DORMANT_DAYS', 7) * 86400
+        inactive_after = current_app.config.get('SEGMENT_INACTIVE_DAYS', 30) * 86400
+        idle = now - last_seen
+        inactive = idle > inactive_after
+        dormant = ~inactive & (idle > dormant_after)
+        active = ~inactive & ~dormant
+        new = active & (now - first_seen <= dormant_after)
+        established = active & ~new
+        threshold = np.percentile(totals[established], 80) if established.any() else 0
+        power = established & (totals > threshold)
+        return {
+            'power_users': power,
+            'casual_users': established & ~power,
+            'new_users': new,
+            'dormant_users': dormant,
+            'inactive_users': inactive
+        }
+
+    @classmethod
+    def segment(cls, project_id):
+        """Behavior clusters and lifecycle segment sizes of a project's users"""
+        identities, matrix, type_ids, first_seen, last_seen = cls.profiles(project_id)
+        n_users = len(identities)
+        totals = np.asarray(matrix.sum(axis=1)).ravel()
+        masks = cls.lifecycle(totals, first_seen, last_seen)
+        counts = {name: int(mask.sum()) for name, mask in masks.items()}
+
+        clusters = []
+        fitted_at = None
+        n_clusters = min(current_app.config.get('SEGMENT_CLUSTERS', 5), n_users)
+        if n_clusters >= 2:
+            model, fitted_at = cls._model(project_id, matrix, type_ids, first_seen, n_clusters)
+            features = model['tfidf'].transform(cls.align(matrix, type_ids, model['type_ids']))
+            assignment = model['kmeans'].predict(features)
+            labels = cls._labels(model['kmeans'].cluster_centers_, model['type_ids'])
+            for cluster in range(n_clusters):
+                members = assignment == cluster
+                size = int(members.sum())
+                if not size:
+                    continue
+                clusters.append({
+                    'label': labels[cluster],
+                    'size': size,
+                    'percentage': round(size / n_users * 100, 1),
+                    'events_per_user': round(float(totals[members].mean()), 1),
+                    'active_percentage': round(float((masks['power_users'] | masks['casual_users'] |
+                                                      masks['new_users'])[members].mean()) * 100, 1)
+                })
+            clusters.sort(key=lambda cluster: cluster['size'], reverse=True)
+
+        return {
+            'segments': clusters,
+            'metrics': {
+                'total_users': n_users,
+                'segment_counts': counts,
+                'segment_percentages': {
+                    name: round(count / n_users * 100, 1) if n_users else 0 for name, count in counts.items()
+                },
+                'model_fitted_at': fitted_at.isoformat() if fitted_at else None
+            }
+        }
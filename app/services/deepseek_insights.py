@@ -7,6 +7,8 @@ from flask import current_app
 from app.models import db
 from app.models.event import Event
 from app.models.project import Project
+from app.services.event_types import event_type_cache
+from app.services.paths import PathAnalyzer
 
 class DeepSeekMLInsights:
     """Service for providing advanced ML-powered insights and recommendations using DeepSeek API"""
@@ -98,9 +100,8 @@ class DeepSeekMLInsights:
         
         # Query events for the project
         events = db.session.query(
-            Event.user_id,
-            Event.anonymous_id,
-            Event.event_name,
+            Event.identity,
+            Event.event_type_id,
             Event.properties,
             Event.timestamp
         ).filter(
@@ -110,13 +111,14 @@ class DeepSeekMLInsights:
             Event.timestamp
         ).all()
         
+        names = event_type_cache.names_for(event.event_type_id for event in events)
+        
         # Process events into a more usable format
         processed_events = []
         for event in events:
-            user_id = event.user_id or event.anonymous_id
             processed_events.append({
-                'user_id': user_id,
-                'event_name': event.event_name,
+                'user_id': event.identity,
+                'event_name': names[event.event_type_id],
                 'properties': event.properties,
                 'timestamp': event.timestamp.isoformat()
             })
@@ -149,51 +151,55 @@ class DeepSeekMLInsights:
         
         # Get event types and frequencies
         event_counts = db.session.query(
-            Event.event_name,
+            Event.event_type_id,
             db.func.count(Event.id).label('count')
         ).filter(
             Event.project_id == project_id
         ).group_by(
-            Event.event_name
+            Event.event_type_id
         ).order_by(
             db.desc('count')
         ).all()
         
-        event_frequencies = {event.event_name: event.count for event in event_counts}
+        names = event_type_cache.names_for(event.event_type_id for event in event_counts)
+        event_frequencies = {names[event.event_type_id]: event.count for event in event_counts}
+        
+        # Only the sampled identities' paths are loaded, not every user's
+        total_users = db.session.query(db.func.count(db.func.distinct(Event.identity))).filter(
+            Event.project_id == project_id
+        ).scalar() or 0
+        sample_identities = [identity for identity, in db.session.query(Event.identity).filter(
+            Event.project_id == project_id,
+            Event.identity.isnot(None)
+        ).distinct().order_by(Event.identity).limit(20)]  # 20 user paths
         
-        # Get user paths/flows - the sequence of events for each user
+        # Get user paths/flows - the sequence of events for each sampled user
         user_paths_query = db.session.query(
-            Event.user_id,
-            Event.anonymous_id,
-            Event.event_name,
+            Event.identity,
+            Event.event_type_id,
             Event.timestamp
         ).filter(
-            Event.project_id == project_id
+            Event.project_id == project_id,
+            Event.identity.in_(sample_identities)
         ).order_by(
-            Event.user_id, 
-            Event.anonymous_id,
+            Event.identity,
             Event.timestamp
         ).all()
         
         # Process into user paths
-        user_paths = {}
+        sample_paths = {}
         for event in user_paths_query:
-            user_id = event.user_id or event.anonymous_id
-            if user_id not in user_paths:
-                user_paths[user_id] = []
-            user_paths[user_id].append({
-                'event': event.event_name,
+            sample_paths.setdefault(event.identity, []).append({
+                'event': names.get(event.event_type_id),
                 'timestamp': event.timestamp.isoformat()
             })
         
-        # Keep only a sample of user paths to limit payload size
-        sample_paths = dict(list(user_paths.items())[:20])  # 20 user paths
-        
         return {
             'project_name': project.name,
             'event_frequencies': event_frequencies,
             'sample_user_paths': sample_paths,
-            'total_users': len(user_paths)
+            'path_summary': PathAnalyzer.summary(project_id, limit=5),
+            'total_users': total_users
         }
     
     @classmethod
@@ -271,6 +277,9 @@ class DeepSeekMLInsights:
             Sample user paths:
             {json.dumps(list(data['sample_user_paths'].values())[:5], indent=2)}
             
+            Most common entry and exit events, transitions and sequences across all users:
+            {json.dumps(data['path_summary'], indent=2)}
+            
             Based on this data, provide recommendations for improving the product, increasing user engagement,
             and enhancing the overall user experience.
             """}
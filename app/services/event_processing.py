@@ -0,0 +1,594 @@
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import insert, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from app.models import db
+from app.models.event import Event
+from app.models.project import Project
+from app.services.ingest_buffer import ingest_buffer, IngestQueueFull, IngestUnavailable
+from app.services.ingest_log import ingest_log
+from app.services.event_types import event_type_cache
+from app.services.identity import identity_resolver
+from app.services.rollups import RollupService
+from app.services.sketches import IdentitySketchService
+from app.services.project_stats import ProjectStatsService
+from app.services.sessions import sessionizer
+from app.services.sentiment import feedback_scorer
+from app.utils.bloom import RotatingBloomFilter
+from app.utils.cache import LRUCache
+from app.utils.rate_limit import RateLimiter
+
+_UNRESOLVED = object()
+
+class EventValidationError(ValueError):
+    """Raised when an incoming event payload cannot be accepted"""
+    pass
+
+class TrackingIdCache:
+    """
+    In-process cache of tracking ID -> project id for the ingest hot path.
+    Unknown tracking IDs are cached too (with a shorter ttl) so a misconfigured
+    snippet cannot turn every request into a database lookup.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300, negative_ttl=30):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.negative_ttl = negative_ttl
+        self.negative_hits = 0
+        self.queries = 0
+
+    def init_app(self, app):
+        """Size the cache from the application config"""
+        self._cache = LRUCache(
+            maxsize=app.config.get('TRACKING_ID_CACHE_SIZE', 10000),
+            ttl=app.config.get('TRACKING_ID_CACHE_TTL', 300)
+        )
+        self.negative_ttl = app.config.get('TRACKING_ID_CACHE_NEGATIVE_TTL', 30)
+
+    def resolve(self, tracking_ids):
+        """
+        Map tracking IDs to project ids, querying the database only for IDs
+        that are not cached. Unknown tracking IDs are left out of the result.
+        """
+        resolved = {}
+        missing = set()
+        for tracking_id in set(tracking_ids):
+            project_id = self._cache.get(tracking_id, _UNRESOLVED)
+            if project_id is _UNRESOLVED:
+                missing.add(tracking_id)
+            elif project_id is None:
+                self.negative_hits += 1
+            else:
+                resolved[tracking_id] = project_id
+
+        if missing:
+            self.queries += 1
+            rows = db.session.query(Project.tracking_id, Project.id).filter(
+                Project.tracking_id.in_(missing)
+            ).all()
+            found = {row.tracking_id: row.id for row in rows}
+
+            for tracking_id in missing:
+                if tracking_id in found:
+                    self._cache.set(tracking_id, found[tracking_id])
+                else:
+                    self._cache.set(tracking_id, None, ttl=self.negative_ttl)
+            resolved.update(found)
+
+        return resolved
+
+    def invalidate(self, tracking_id):
+        """Drop a tracking ID after its project was changed or deleted"""
+        self._cache.pop(tracking_id)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        """Return hit/miss counters for monitoring"""
+        stats = self._cache.stats()
+        stats['negative_hits'] = self.negative_hits
+        stats['queries'] = self.queries
+        return stats
+
+# Shared instance, configured in create_app
+tracking_id_cache = TrackingIdCache()
+
+class MessageDeduplicator:
+    """
+    Duplicate detection for client-supplied message IDs.
+
+    A Bloom filter of recently stored (project, message_id) keys answers
+    "definitely new" without touching the database; only possible duplicates
+    are confirmed with a query. The unique index on (project_id, message_id)
+    covers what this process has not seen (other workers, restarts): inserts
+    skip conflicting rows instead of failing.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self._filter = RotatingBloomFilter(capacity, error_rate)
+        self.checked = 0
+        self.filter_hits = 0
+        self.duplicates = 0
+        self.false_positives = 0
+
+    def init_app(self, app):
+        """Size the filter from the application config"""
+        self._filter = RotatingBloomFilter(
+            app.config.get('DEDUP_FILTER_CAPACITY', 1000000),
+            app.config.get('DEDUP_FILTER_ERROR_RATE', 0.001)
+        )
+
+    @staticmethod
+    def _key(project_id, message_id):
+        return f"{project_id}:{message_id}"
+
+    def find_duplicates(self, rows):
+        """Return the indexes of rows that repeat an already stored (or earlier) message"""
+        duplicates = set()
+        seen = set()
+        candidates = {}
+
+        for index, row in enumerate(rows):
+            message_id = row.get('message_id')
+            if not message_id:
+                continue
+            key = (row['project_id'], message_id)
+            if key in seen:
+                duplicates.add(index)
+                continue
+            seen.add(key)
+            self.checked += 1
+            if self._filter.might_contain(self._key(*key)):
+                candidates[key] = index
+
+        if candidates:
+            # Only possible duplicates cost a query
+            self.filter_hits += len(candidates)
+            existing = db.session.query(Event.project_id, Event.message_id).filter(
+                Event.project_id.in_({project_id for project_id, _ in candidates}),
+                Event.message_id.in_({message_id for _, message_id in candidates})
+            ).all()
+            confirmed = {(row.project_id, row.message_id) for row in existing} & candidates.keys()
+            duplicates.update(candidates[key] for key in confirmed)
+            self.false_positives += len(candidates) - len(confirmed)
+
+        self.duplicates += len(duplicates)
+        return duplicates
+
+    def remember(self, rows):
+        """Record the message IDs of stored (or queued) rows"""
+        for row in rows:
+            if row.get('message_id'):
+                self._filter.add(self._key(row['project_id'], row['message_id']))
+
+    def stats(self):
+        return {
+            'checked': self.checked,
+            'filter_hits': self.filter_hits,
+            'duplicates': self.duplicates,
+            'false_positives': self.false_positives,
+            'filter_bytes': self._filter.memory_bytes()
+        }
+
+# Shared instance, configured in create_app
+message_deduplicator = MessageDeduplicator()
+
+class IngestAdmissionControl:
+    """
+    Database-free checks run before an event is accepted: per-tracking-ID
+    token-bucket rate limits, and global load shedding when the write path
+    is saturated (too many synchronous writes in flight, or the write-behind
+    queue above its high-water mark).
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.limiter = RateLimiter()
+        self.max_inflight = 32
+        self.shed_queue_ratio = 0.9
+        self._inflight = 0
+        self._lock = threading.Lock()
+        self.shed = 0
+
+    def init_app(self, app):
+        """Configure limits from the application config"""
+        self.enabled = app.config.get('INGEST_RATE_LIMIT_ENABLED', True)
+        self.limiter = RateLimiter(
+            rate=app.config.get('INGEST_RATE_LIMIT', 100.0),
+            burst=app.config.get('INGEST_RATE_BURST', 500),
+            overrides=app.config.get('INGEST_RATE_LIMIT_OVERRIDES') or {}
+        )
+        self.max_inflight = app.config.get('INGEST_MAX_INFLIGHT_WRITES', 32)
+        self.shed_queue_ratio = app.config.get('INGEST_SHED_QUEUE_RATIO', 0.9)
+
+    def acquire(self, tracking_id, count=1):
+        """Take count events from the project's bucket; returns seconds to wait, 0 when allowed"""
+        if not self.enabled:
+            return 0
+        return self.limiter.acquire(tracking_id, count)
+
+    def burst_for(self, tracking_id):
+        """Most events the project may send in one request"""
+        if not self.enabled:
+            return float('inf')
+        return self.limiter.burst_for(tracking_id)
+
+    def enter(self, counts):
+        """
+        Reserve a slot on the write path for events of the given
+        {tracking_id: count}. Returns False (and counts them as shed) when the
+        write path is saturated; callers that get True must call leave().
+        """
+        with self._lock:
+            if ingest_buffer.enabled:
+                saturated = ingest_buffer.depth() >= ingest_buffer.max_size * self.shed_queue_ratio
+            else:
+                saturated = self._inflight >= self.max_inflight
+            if not saturated:
+                self._inflight += 1
+                return True
+
+        self.shed += sum(counts.values())
+        if self.enabled:
+            for tracking_id, count in counts.items():
+                self.limiter.record_shed(tracking_id, count)
+        return False
+
+    def leave(self):
+        with self._lock:
+            self._inflight -= 1
+
+    def stats(self, tracking_ids=None):
+        return {
+            'enabled': self.enabled,
+            'inflight_writes': self._inflight,
+            'shed': self.shed,
+            'projects': self.limiter.counters(tracking_ids)
+        }
+
+# Shared instance, configured in create_app
+admission_control = IngestAdmissionControl()
+
+class EventProcessingService:
+    """Validation and storage of events coming in through the tracking API"""
+
+    REQUIRED_FIELDS = ['project_id', 'event_name']
+
+    @staticmethod
+    def parse_timestamp(value, strict=False):
+        """
+        Parse an ISO-8601 timestamp into a naive UTC datetime.
+        Falls back to the current time when the value is missing or invalid,
+        unless strict is set, in which case EventValidationError is raised.
+        """
+        if not value:
+            if strict:
+                raise EventValidationError("Missing timestamp")
+            return datetime.utcnow()
+        try:
+            timestamp = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except (ValueError, TypeError):
+            if strict:
+                raise EventValidationError(f"Invalid timestamp format: {value}")
+            # If timestamp is invalid, use current time
+            current_app.logger.warning(f"Invalid timestamp format: {value}")
+            return datetime.utcnow()
+
+        # Store everything as naive UTC like the rest of the events table
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        return timestamp
+
+    @classmethod
+    def validate_event(cls, data, strict_timestamp=False):
+        """
+        Validate a single raw event payload.
+        Returns a dict with the tracking ID and the column values for the events table.
+        """
+        if not isinstance(data, dict):
+            raise EventValidationError("Event must be a JSON object")
+
+        missing_fields = [field for field in cls.REQUIRED_FIELDS if not data.get(field)]
+        if missing_fields:
+            raise EventValidationError(f"Missing required fields: {', '.join(missing_fields)}")
+
+        event_name = data['event_name']
+        if not isinstance(event_name, str) or len(event_name) > 64:
+            raise EventValidationError("event_name must be a string of at most 64 characters")
+
+        properties = data.get('properties') or {}
+        if not isinstance(properties, dict):
+            raise EventValidationError("properties must be a JSON object")
+
+        for field in ('user_id', 'anonymous_id', 'message_id'):
+            value = data.get(field)
+            if value is not None and (not isinstance(value, (str, int)) or len(str(value)) > 64):
+                raise EventValidationError(f"{field} must be a string of at most 64 characters")
+
+        return {
+            'tracking_id': str(data['project_id']),
+            'event_name': event_name,
+            'properties': properties,
+            'user_id': str(data['user_id']) if data.get('user_id') is not None else None,
+            'anonymous_id': str(data['anonymous_id']) if data.get('anonymous_id') is not None else None,
+            'timestamp': cls.parse_timestamp(data.get('timestamp'), strict=strict_timestamp),
+            'message_id': str(data['message_id']) if data.get('message_id') is not None else None
+        }
+
+    @staticmethod
+    def resolve_tracking_ids(tracking_ids):
+        """
+        Map tracking IDs to project ids through the tracking ID cache.
+        Unknown tracking IDs are left out of the result.
+        """
+        return tracking_id_cache.resolve(tracking_ids)
+
+    @staticmethod
+    def build_row(event, project_id):
+        """Turn a validated event into a row for the events table"""
+        row = {key: value for key, value in event.items() if key != 'tracking_id'}
+        row['project_id'] = project_id
+        return row
+
+    @staticmethod
+    def encode_rows(rows):
+        """Replace event names by their event type ids for the events table"""
+        type_ids = event_type_cache.get_or_create_ids(row['event_name'] for row in rows)
+        encoded = []
+        for row in rows:
+            row = dict(row)
+            row['event_type_id'] = type_ids[row.pop('event_name')]
+            encoded.append(row)
+        return encoded
+
+    @classmethod
+    def prepare_rows(cls, rows):
+        """Encode event names and resolve identities, just before rows are inserted"""
+        return identity_resolver.assign(cls.encode_rows(rows))
+
+    @staticmethod
+    def find_duplicates(rows):
+        """Indexes of rows whose message_id was already recorded for the project"""
+        return message_deduplicator.find_duplicates(rows)
+
+    @classmethod
+    def store_event(cls, row):
+        """
+        Insert a single event row and return its id.
+        Returns None if a concurrent request stored the same message_id first.
+        """
+        prepared = cls.prepare_rows([row])[0]
+        event = Event(**prepared)
+        db.session.add(event)
+        try:
+            # Flush first so a duplicate is rejected before the rollups are touched
+            db.session.flush()
+            RollupService.increment([(prepared['project_id'], prepared['event_type_id'], prepared['timestamp'])])
+            IdentitySketchService.add([prepared])
+            ProjectStatsService.increment([prepared['project_id']], [prepared])
+            sessionizer.track([prepared])
+            feedback_scorer.track([prepared])
+            cls.bump_data_versions([prepared['project_id']])
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            if row.get('message_id'):
+                return None
+            raise
+        message_deduplicator.remember([row])
+        return event.id
+
+    @staticmethod
+    def bump_data_versions(project_ids):
+        """Invalidate the cached analytics of projects that received events"""
+        db.session.execute(
+            update(Project).where(Project.id.in_(project_ids)).values(data_version=Project.data_version + 1)
+        )
+
+    @staticmethod
+    def _insert_statement():
+        """INSERT for the events table that skips rows with an already stored message_id"""
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'sqlite':
+            return sqlite_insert(Event).on_conflict_do_nothing()
+        if dialect == 'postgresql':
+            return postgresql_insert(Event).on_conflict_do_nothing()
+        return insert(Event)
+
+    @staticmethod
+    def _inserted(rows, returned):
+        """
+        The rows RETURNING reported as inserted. Only rows with a message_id can
+        be skipped, and of rows repeating one within the batch the first is stored.
+        """
+        remaining = Counter((row.project_id, row.message_id) for row in returned if row.message_id is not None)
+        inserted = []
+        for row in rows:
+            key = (row['project_id'], row.get('message_id'))
+            if key[1] is None:
+                inserted.append(row)
+            elif remaining[key]:
+                remaining[key] -= 1
+                inserted.append(row)
+        return inserted
+
+    @staticmethod
+    def _unstored(rows):
+        """Rows whose message_id is neither stored already nor repeated earlier in the batch"""
+        keys = {(row['project_id'], row['message_id']) for row in rows if row.get('message_id')}
+        stored = set()
+        if keys:
+            stored = set(db.session.query(Event.project_id, Event.message_id).filter(
+                Event.project_id.in_({project_id for project_id, _ in keys}),
+                Event.message_id.in_({message_id for _, message_id in keys})
+            ).all())
+        unstored = []
+        for row in rows:
+            key = (row['project_id'], row.get('message_id'))
+            if key[1] is not None:
+                if key in stored:
+                    continue
+                stored.add(key)
+            unstored.append(row)
+        return unstored
+
+    @classmethod
+    def insert_events(cls, rows):
+        """
+        Insert many event rows with one executemany and count the rows actually
+        inserted into the rollups, identity sketches, project totals and
+        sessions, without committing. Returns the number of rows inserted.
+        """
+        if not rows:
+            return 0
+        rows = cls.prepare_rows(rows)
+        statement = cls._insert_statement()
+        if db.session.get_bind().dialect.insert_executemany_returning:
+            # Skipped duplicates are not returned
+            returned = db.session.execute(statement.returning(Event.project_id, Event.message_id), rows).all()
+            rows = cls._inserted(rows, returned)
+        else:
+            # No RETURNING to tell what was skipped: leave out known duplicates up front
+            rows = cls._unstored(rows)
+            if rows:
+                db.session.execute(statement, rows)
+        if not rows:
+            return 0
+        RollupService.increment([(row['project_id'], row['event_type_id'], row['timestamp']) for row in rows])
+        IdentitySketchService.add(rows)
+        ProjectStatsService.increment([row['project_id'] for row in rows], rows)
+        # Sessionized once the transaction commits
+        sessionizer.track(rows)
+        # Feedback is scored in the background once it is committed
+        feedback_scorer.track(rows)
+        cls.bump_data_versions({row['project_id'] for row in rows})
+        return len(rows)
+
+    @classmethod
+    def store_events(cls, rows):
+        """Insert many event rows in a single transaction"""
+        count = cls.insert_events(rows)
+        db.session.commit()
+        return count
+
+    @classmethod
+    def persist(cls, rows):
+        """
+        Write rows synchronously, or hand them to the write-behind buffer when it
+        is enabled. Returns True when the rows were queued rather than written.
+        Raises IngestUnavailable when the buffer has no room (backpressure) or
+        the ingest log cannot write.
+        """
+        if ingest_buffer.enabled:
+            if ingest_log.enabled:
+                # Durable first: the log queues the rows once they are written
+                ingest_log.append(rows, ingest_buffer)
+            else:
+                ingest_buffer.submit(rows)
+            queued = True
+        else:
+            cls.store_events(rows)
+            queued = False
+
+        message_deduplicator.remember(rows)
+        return queued
+
+    @classmethod
+    def process_batch(cls, payloads):
+        """
+        Validate, resolve and store a batch of raw event payloads.
+        Returns a list with one status dict per payload, in request order.
+        Raises IngestUnavailable when the write path is saturated or failing.
+        """
+        results = [None] * len(payloads)
+        validated = []
+
+        for index, data in enumerate(payloads):
+            try:
+                validated.append((index, cls.validate_event(data)))
+            except EventValidationError as e:
+                results[index] = {'index': index, 'status': 'rejected', 'message': str(e)}
+
+        # Per-project rate limits, before any database work
+        counts = Counter(event['tracking_id'] for _, event in validated)
+        limited = {}
+        too_large = {}
+        for tracking_id, count in counts.items():
+            retry_after = admission_control.acquire(tracking_id, count)
+            if not retry_after:
+                continue
+            burst = admission_control.burst_for(tracking_id)
+            if count > burst:
+                # No amount of waiting lets this many events through at once
+                too_large[tracking_id] = burst
+            else:
+                limited[tracking_id] = retry_after
+        refused = limited.keys() | too_large.keys()
+        if refused:
+            for index, event in validated:
+                tracking_id = event['tracking_id']
+                if tracking_id in too_large:
+                    results[index] = {'index': index, 'status': 'too_large',
+                                      'message': f"Batch larger than the project's burst of {int(too_large[tracking_id])} events"}
+                elif tracking_id in limited:
+                    results[index] = {'index': index, 'status': 'rate_limited',
+                                      'retry_after': round(limited[tracking_id], 1)}
+            validated = [(index, event) for index, event in validated if event['tracking_id'] not in refused]
+            for tracking_id in refused:
+                del counts[tracking_id]
+
+        if not validated:
+            return results
+
+        if not admission_control.enter(counts):
+            raise IngestQueueFull("Write path saturated")
+        try:
+            cls._store_validated(validated, results)
+        finally:
+            admission_control.leave()
+        return results
+
+    @classmethod
+    def _store_validated(cls, validated, results):
+        """Resolve, deduplicate and persist admitted events, filling in their results"""
+        # Resolve every distinct tracking ID in the batch at once
+        project_ids = cls.resolve_tracking_ids(event['tracking_id'] for _, event in validated)
+
+        rows = []
+        accepted_indexes = []
+        for index, event in validated:
+            project_id = project_ids.get(event['tracking_id'])
+            if project_id is None:
+                results[index] = {'index': index, 'status': 'rejected', 'message': 'Invalid project ID'}
+                continue
+            rows.append(cls.build_row(event, project_id))
+            accepted_indexes.append(index)
+
+        # Retried messages are acknowledged but not stored again
+        duplicates = cls.find_duplicates(rows)
+        if duplicates:
+            for position in duplicates:
+                index = accepted_indexes[position]
+                results[index] = {'index': index, 'status': 'duplicate'}
+            rows = [row for position, row in enumerate(rows) if position not in duplicates]
+            accepted_indexes = [index for position, index in enumerate(accepted_indexes) if position not in duplicates]
+
+        try:
+            queued = cls.persist(rows)
+        except IngestUnavailable:
+            raise
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Error saving event batch: {str(e)}")
+            for index in accepted_indexes:
+                results[index] = {'index': index, 'status': 'error', 'message': 'Failed to record event'}
+            return
+
+        status = 'queued' if queued else 'accepted'
+        for index in accepted_indexes:
+            results[index] = {'index': index, 'status': status}
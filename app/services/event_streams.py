@@ -0,0 +1,50 @@
+import numpy as np
+from flask import current_app
+from sqlalchemy import select
+from app.models import db
+from app.models.event import Event
+
+class EventStream:
+    """
+    Events of a project in (identity, timestamp) order, read from the
+    (project_id, identity, timestamp) index through a server-side cursor and
+    handed out as NumPy chunks that never split an identity.
+    """
+
+    @staticmethod
+    def identity_chunks(project_id, since, type_ids=None, chunk_size=None):
+        """Yield (identities, timestamps in epoch seconds, event type ids) arrays of whole identities"""
+        chunk_size = chunk_size or current_app.config.get('EVENT_STREAM_CHUNK_SIZE', 100000)
+        statement = select(Event.identity, Event.timestamp, Event.event_type_id).where(
+            Event.project_id == project_id,
+            Event.identity.isnot(None),
+            Event.timestamp >= since
+        )
+        if type_ids is not None:
+            statement = statement.where(Event.event_type_id.in_(type_ids))
+        statement = statement.order_by(Event.identity, Event.timestamp)
+        result = db.session.execute(statement, execution_options={'stream_results': True, 'yield_per': chunk_size})
+
+        carry = None
+        for rows in result.partitions():
+            identities, timestamps, types = zip(*rows)
+            chunk = (
+                np.array(identities, dtype=object),
+                np.array(timestamps, dtype='datetime64[s]').astype(np.int64),
+                np.array(types, dtype=np.int64)
+            )
+            if carry is not None:
+                chunk = tuple(np.concatenate(pair) for pair in zip(carry, chunk))
+            # The last identity may continue in the next partition
+            others = np.flatnonzero(chunk[0] != chunk[0][-1])
+            cut = others[-1] + 1 if len(others) else 0
+            if cut:
+                yield tuple(column[:cut] for column in chunk)
+            carry = tuple(column[cut:] for column in chunk)
+        if carry is not None and len(carry[0]):
+            yield carry
+
+    @staticmethod
+    def run_codes(identities):
+        """Integer codes for the identities of a chunk, which are sorted so equal ones are adjacent"""
+        return np.r_[0, np.cumsum(identities[1:] != identities[:-1])]
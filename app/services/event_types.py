@@ -0,0 +1,82 @@
+import threading
+from sqlalchemy import insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from app.models import db
+from app.models.event import EventType
+
+class EventTypeCache:
+    """
+    In-memory two-way dictionary of event name <-> event type id.
+
+    Events store the integer id; names are only needed at ingest (to encode)
+    and when formatting query results (to decode). Both directions are served
+    from memory after the first lookup, and new names are registered in their
+    own short transaction so a cached id always exists in the database.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def _remember(self, rows):
+        with self._lock:
+            for type_id, name in rows:
+                self._ids[name] = type_id
+                self._names[type_id] = name
+
+    def _insert_statement(self, dialect):
+        if dialect == 'sqlite':
+            return sqlite_insert(EventType).on_conflict_do_nothing()
+        if dialect == 'postgresql':
+            return postgresql_insert(EventType).on_conflict_do_nothing()
+        return insert(EventType)
+
+    def get_or_create_ids(self, names):
+        """Return {name: id} for the given names, registering unknown ones"""
+        names = set(names)
+        missing = names - self._ids.keys()
+        if missing:
+            engine = db.engine
+            with engine.begin() as connection:
+                connection.execute(
+                    self._insert_statement(engine.dialect.name),
+                    [{'name': name} for name in missing]
+                )
+                rows = connection.execute(
+                    select(EventType.id, EventType.name).where(EventType.name.in_(missing))
+                ).all()
+            self._remember(rows)
+        return {name: self._ids[name] for name in names}
+
+    def id_for(self, name):
+        """Id of an existing event name, or None if the name was never ingested"""
+        type_id = self._ids.get(name)
+        if type_id is None:
+            row = db.session.query(EventType.id, EventType.name).filter(EventType.name == name).first()
+            if row is None:
+                return None
+            self._remember([row])
+            type_id = row.id
+        return type_id
+
+    def names_for(self, type_ids):
+        """Return {id: name}, loading ids registered by other processes on demand"""
+        type_ids = set(type_ids)
+        missing = type_ids - self._names.keys()
+        if missing:
+            rows = db.session.query(EventType.id, EventType.name).filter(EventType.id.in_(missing)).all()
+            self._remember(rows)
+        return {type_id: self._names.get(type_id) for type_id in type_ids}
+
+    def name_for(self, type_id):
+        return self.names_for([type_id]).get(type_id)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._names.clear()
+
+# Shared instance
+event_type_cache = EventTypeCache()
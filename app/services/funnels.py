@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+import numpy as np
+from app.services.event_streams import EventStream
+from app.services.event_types import event_type_cache
+
+MAX_FUNNEL_STEPS = 10
+
+# Upper bin edges (seconds) of the time-to-convert histogram
+HISTOGRAM_EDGES = [60, 300, 900, 3600, 6 * 3600, 86400, 3 * 86400, 7 * 86400, 14 * 86400]
+HISTOGRAM_LABELS = ['< 1m', '1-5m', '5-15m', '15-60m', '1-6h', '6-24h', '1-3d', '3-7d', '7-14d', '14d+']
+
+class FunnelEngine:
+    """
+    Ordered funnels evaluated in one pass over events sorted by identity and time.
+
+    Events of the funnel's event types are streamed in identity order, in
+    chunks cut at identity boundaries, so memory is bounded by the chunk
+    size. In a chunk, every occurrence of the first step starts an attempt,
+    and each later step is matched for all attempts at once with
+    searchsorted: the next event of that type of the same identity, within
+    the window of the attempt's start.
+    Each identity counts with its deepest attempt, the fastest among equals.
+    """
+
+    @staticmethod
+    def evaluate(identity, timestamp, event_type, step_types, window):
+        """
+        Match the steps in a chunk sorted by (identity, timestamp).
+        Returns (steps reached, step timestamps with -1 where not reached), one row per identity.
+        """
+        n_steps = len(step_types)
+        starts = np.flatnonzero(event_type == step_types[0])
+        if not len(starts):
+            return np.empty(0, dtype=np.int64), np.empty((0, n_steps), dtype=np.int64)
+
+        positions = np.full((len(starts), n_steps), -1, dtype=np.int64)
+        positions[:, 0] = starts
+        depth = np.ones(len(starts), dtype=np.int64)
+        alive = np.arange(len(starts))
+        for k in range(1, n_steps):
+            candidates = np.flatnonzero(event_type == step_types[k])
+            if not len(candidates) or not len(alive):
+                break
+            # Earliest later event of this step for every attempt still going
+            previous = positions[alive, k - 1]
+            index = np.searchsorted(candidates, previous, side='right')
+            found = index < len(candidates)
+            alive, previous = alive[found], previous[found]
+            following = candidates[index[found]]
+            matched = (identity[following] == identity[previous]) & \
+                      (timestamp[following] - timestamp[positions[alive, 0]] <= window)
+            alive = alive[matched]
+            positions[alive, k] = following[matched]
+            depth[alive] = k + 1
+
+        # Deepest attempt per identity, the fastest among equals
+        duration = timestamp[positions[np.arange(len(starts)), depth - 1]] - timestamp[starts]
+        owner = identity[starts]
+        order = np.lexsort((duration, -depth, owner))
+        best = order[np.r_[True, owner[order][1:] != owner[order][:-1]]]
+        times = np.where(positions[best] >= 0, timestamp[positions[best]], -1)
+        return depth[best], times
+
+    @classmethod
+    def funnel(cls, project_id, steps, window, days=30):
+        """Step counts, conversion rates, drop-off and time-to-convert for an ordered list of event names"""
+        if not 2 <= len(steps) <= MAX_FUNNEL_STEPS:
+            raise ValueError(f"A funnel needs between 2 and {MAX_FUNNEL_STEPS} steps")
+        if window <= 0:
+            raise ValueError("The conversion window must be positive")
+
+        # Names never ingested match nothing (-1 is not an event type id)
+        step_types = np.array([event_type_cache.id_for(name) or -1 for name in steps], dtype=np.int64)
+        type_ids = {int(type_id) for type_id in step_types if type_id != -1}
+        since = datetime.utcnow() - timedelta(days=days)
+
+        reached = np.zeros(len(steps), dtype=np.int64)
+        gaps = [[] for _ in steps]
+        totals = []
+        if step_types[0] != -1:
+            for identities, timestamps, types in EventStream.identity_chunks(project_id, since, type_ids):
+                codes = EventStream.run_codes(identities)
+                depth, times = cls.evaluate(codes, timestamps, types, step_types, window)
+                reached += np.bincount(depth, minlength=len(steps) + 1)[1:][::-1].cumsum()[::-1]
+                for k in range(1, len(steps)):
+                    converted = depth > k
+                    gaps[k].append(times[converted, k] - times[converted, k - 1])
+                totals.append(times[depth == len(steps), -1] - times[depth == len(steps), 0])
+
+        entered = int(reached[0])
+        result_steps = []
+        for k, name in enumerate(steps):
+            count = int(reached[k])
+            previous = int(reached[k - 1]) if k else count
+            step_gaps = np.concatenate(gaps[k]) if k and gaps[k] else np.empty(0, dtype=np.int64)
+            result_steps.append({
+                'name': name,
+                'count': count,
+                'conversion_rate': round(count / entered * 100, 1) if entered else 0,
+                'step_conversion_rate': round(count / previous * 100, 1) if previous else 0,
+                'drop_off': previous - count,
+                'median_seconds': int(np.median(step_gaps)) if len(step_gaps) else None,
+                'p90_seconds': int(np.percentile(step_gaps, 90)) if len(step_gaps) else None
+            })
+
+        totals = np.concatenate(totals) if totals else np.empty(0, dtype=np.int64)
+        histogram = np.bincount(np.searchsorted(HISTOGRAM_EDGES, totals, side='right'),
+                                minlength=len(HISTOGRAM_LABELS))
+        return {
+            'steps': result_steps,
+            'window': window,
+            'days': days,
+            'conversion_rate': result_steps[-1]['conversion_rate'],
+            'time_to_convert': {
+                'labels': HISTOGRAM_LABELS,
+                'counts': histogram.tolist(),
+                'median_seconds': int(np.median(totals)) if len(totals) else None
+            }
+        }
@@ -0,0 +1,138 @@
+from datetime import datetime
+from sqlalchemy import func, insert, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.models import db
+from app.models.event import Event, IdentityAlias
+from app.services.segments import event_segments, DAY_FORMAT
+from app.utils.cache import LRUCache
+
+_UNCACHED = object()
+
+class IdentityResolver:
+    """
+    Fills the canonical identity of event rows at ingest.
+
+    An event carrying both a user_id and an anonymous_id stitches the two:
+    the first such pair seen for an anonymous_id is stored as an alias, the
+    anonymous history already stored is rewritten to the user_id (making the
+    segments of the closed days it touched stale), and later anonymous-only
+    events resolve to the user_id as well. Aliases never
+    change once stored, so they are cached without expiry. Anonymous ids
+    without an alias are cached too, with a short ttl as another worker may
+    alias them, and dropped as soon as this process stores their alias.
+    """
+
+    def __init__(self, maxsize=100000, negative_ttl=30):
+        self._aliases = LRUCache(maxsize=maxsize, ttl=None)
+        self.negative_ttl = negative_ttl
+        self.negative_hits = 0
+        self.stitched = 0
+        self.queries = 0
+
+    def init_app(self, app):
+        """Size the alias cache from the application config"""
+        self._aliases = LRUCache(maxsize=app.config.get('IDENTITY_ALIAS_CACHE_SIZE', 100000), ttl=None)
+        self.negative_ttl = app.config.get('IDENTITY_ALIAS_CACHE_NEGATIVE_TTL', 30)
+
+    @staticmethod
+    def _insert_statement():
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'sqlite':
+            return sqlite_insert(IdentityAlias).on_conflict_do_nothing()
+        if dialect == 'postgresql':
+            return postgresql_insert(IdentityAlias).on_conflict_do_nothing()
+        return insert(IdentityAlias)
+
+    def _lookup(self, keys):
+        """Map (project_id, anonymous_id) keys to user_ids, from the cache or one query"""
+        found = {}
+        missing = set()
+        for key in keys:
+            user_id = self._aliases.get(key, _UNCACHED)
+            if user_id is _UNCACHED:
+                missing.add(key)
+            elif user_id is None:
+                self.negative_hits += 1
+            else:
+                found[key] = user_id
+
+        if missing:
+            self.queries += 1
+            rows = db.session.query(IdentityAlias.project_id, IdentityAlias.anonymous_id, IdentityAlias.user_id).filter(
+                IdentityAlias.project_id.in_({project_id for project_id, _ in missing}),
+                IdentityAlias.anonymous_id.in_({anonymous_id for _, anonymous_id in missing})
+            ).all()
+            for row in rows:
+                key = (row.project_id, row.anonymous_id)
+                if key in missing:
+                    found[key] = row.user_id
+
+            for key in missing:
+                if key in found:
+                    self._aliases.set(key, found[key])
+                else:
+                    self._aliases.set(key, None, ttl=self.negative_ttl)
+        return found
+
+    def _stitch(self, pairs):
+        """Store new anonymous_id -> user_id aliases and rewrite the anonymous history"""
+        now = datetime.utcnow()
+        db.session.execute(self._insert_statement(), [
+            {'project_id': project_id, 'anonymous_id': anonymous_id, 'user_id': user_id, 'created_at': now}
+            for (project_id, anonymous_id), user_id in pairs.items()
+        ])
+        for key in pairs:
+            self._aliases.pop(key)
+        # Read back the winners: another transaction may have aliased the same id first
+        aliases = self._lookup(pairs.keys())
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        for (project_id, anonymous_id), user_id in aliases.items():
+            history = (Event.project_id == project_id, Event.identity == anonymous_id, Event.user_id.is_(None))
+            # SQLite returns 'YYYY-MM-DD' strings, PostgreSQL date objects
+            closed_days = db.session.query(func.date(Event.timestamp)).filter(*history, Event.timestamp < today).distinct()
+            event_segments.invalidate(project_id, sorted(datetime.strptime(str(day), DAY_FORMAT) for day, in closed_days))
+            db.session.execute(update(Event).where(*history).values(identity=user_id))
+        self.stitched += len(aliases)
+        return aliases
+
+    def assign(self, rows):
+        """
+        Set the identity of each row in place and return the rows.
+        Runs inside the caller's transaction so aliases and events commit together.
+        """
+        keys = {(row['project_id'], row['anonymous_id']) for row in rows if row.get('anonymous_id')}
+        aliases = self._lookup(keys) if keys else {}
+
+        # First user_id seen with each not yet aliased anonymous_id
+        new_pairs = {}
+        for row in rows:
+            if row.get('user_id') and row.get('anonymous_id'):
+                key = (row['project_id'], row['anonymous_id'])
+                if key not in aliases:
+                    new_pairs.setdefault(key, row['user_id'])
+        if new_pairs:
+            aliases.update(self._stitch(new_pairs))
+
+        for row in rows:
+            if row.get('user_id'):
+                row['identity'] = row['user_id']
+            elif row.get('anonymous_id'):
+                row['identity'] = aliases.get((row['project_id'], row['anonymous_id']), row['anonymous_id'])
+            else:
+                row['identity'] = None
+        return rows
+
+    def clear(self):
+        self._aliases.clear()
+
+    def stats(self):
+        """Return cache and stitching counters for monitoring"""
+        stats = self._aliases.stats()
+        stats['negative_hits'] = self.negative_hits
+        stats['stitched'] = self.stitched
+        stats['queries'] = self.queries
+        return stats
+
+# Shared instance, configured in create_app
+identity_resolver = IdentityResolver()
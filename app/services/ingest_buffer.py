@@ -0,0 +1,206 @@
+import atexit
+import threading
+import time
+from collections import deque
+from app.utils.background import background_workers_enabled
+
+class IngestUnavailable(Exception):
+    """Raised when events cannot be accepted for writing right now; answered with 503"""
+    pass
+
+class IngestQueueFull(IngestUnavailable):
+    """Raised when the write-behind queue cannot take more events"""
+    pass
+
+class IngestBuffer:
+    """
+    Bounded in-memory write-behind queue for ingested events.
+
+    Request handlers validate events and submit rows here; a background
+    flusher thread drains the queue in batches, triggered either by batch
+    size or by the flush interval, and writes each batch with the flush
+    function passed to init_app (one transaction per batch).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.app = None
+        self.flush_func = None
+        self.max_size = 10000
+        self.batch_size = 500
+        self.flush_interval = 1.0
+        self.max_retries = 3
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._reset_metrics()
+
+    def _reset_metrics(self):
+        self.enqueued = 0
+        self.flushed = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.flush_count = 0
+        self.flush_failures = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def init_app(self, app, flush_func):
+        """
+        Read settings from the app config and start the flusher when enabled.
+        Only processes running background workers buffer; CLI commands and
+        the others write synchronously, as nothing would drain their queue.
+        """
+        self.enabled = app.config.get('INGEST_WRITE_BEHIND', False) and background_workers_enabled(app)
+        if not self.enabled:
+            return
+
+        self.app = app
+        self.flush_func = flush_func
+        self.max_size = app.config.get('INGEST_QUEUE_MAX_SIZE', 10000)
+        self.batch_size = app.config.get('INGEST_FLUSH_BATCH_SIZE', 500)
+        self.flush_interval = app.config.get('INGEST_FLUSH_INTERVAL', 1.0)
+        self.max_retries = app.config.get('INGEST_FLUSH_RETRIES', 3)
+        self.start()
+        atexit.register(self.shutdown)
+
+    def start(self):
+        """Start the background flusher thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='ingest-flusher', daemon=True)
+        self._thread.start()
+
+    def submit(self, rows):
+        """
+        Enqueue event rows for writing. The rows of one call are accepted or
+        rejected together; raises IngestQueueFull when there is no room.
+        """
+        with self._cond:
+            if self._stopping:
+                raise IngestQueueFull("Ingest queue is shutting down")
+            if len(self._queue) + len(rows) > self.max_size:
+                self.rejected += len(rows)
+                raise IngestQueueFull("Ingest queue is full")
+
+            self._queue.extend(rows)
+            self.enqueued += len(rows)
+            self.max_depth = max(self.max_depth, len(self._queue))
+
+            # Wake the flusher early once a full batch is waiting
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def has_room(self, count):
+        """Check whether count more events fit in the queue"""
+        return not self._stopping and len(self._queue) + count <= self.max_size
+
+    def depth(self):
+        """Number of events waiting to be written"""
+        return len(self._queue)
+
+    def _take_batch(self):
+        """Wait for a full batch or the flush interval, then pop up to batch_size rows"""
+        with self._cond:
+            if len(self._queue) < self.batch_size and not self._stopping:
+                self._cond.wait(timeout=self.flush_interval)
+            count = min(len(self._queue), self.batch_size)
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._flush(batch)
+            elif self._stopping:
+                return
+
+    def _write(self, rows):
+        """Write rows with one call of the flush function; returns the error, or None on success"""
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                self.flush_func(rows)
+        except Exception as e:
+            self.flush_failures += 1
+            return e
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.flush_count += 1
+        self.flushed += len(rows)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self._total_flush_ms += elapsed_ms
+        return None
+
+    def _flush(self, batch):
+        """
+        Write one batch, retrying with backoff. A batch that still fails is
+        split in halves, written separately, so only the events that fail on
+        their own are dropped.
+        """
+        for attempt in range(self.max_retries + 1):
+            error = self._write(batch)
+            if error is None:
+                return
+            self.app.logger.error(f"Error flushing {len(batch)} buffered events (attempt {attempt + 1}): {str(error)}")
+            time.sleep(min(0.1 * 2 ** attempt, 5))
+
+        dropped, last_error = self._bisect(batch)
+        self.dropped += dropped
+        if dropped:
+            self.app.logger.error(
+                f"Dropped {dropped} of {len(batch)} buffered events that failed to flush on their own: "
+                f"{str(last_error or error)}"
+            )
+
+    def _bisect(self, rows):
+        """Write the halves of a failing batch, splitting failing halves down to single events; returns (dropped, last error)"""
+        if len(rows) == 1:
+            return 1, None
+        dropped, last_error = 0, None
+        middle = len(rows) // 2
+        for half in (rows[:middle], rows[middle:]):
+            error = self._write(half)
+            if error is not None:
+                count, inner_error = self._bisect(half)
+                dropped += count
+                last_error = inner_error or error
+        return dropped, last_error
+
+    def shutdown(self, timeout=30):
+        """Stop accepting events and drain everything still queued"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            self.app.logger.warning(f"Ingest flusher did not drain within {timeout}s, {self.depth()} events left")
+        self._thread = None
+
+    def stats(self):
+        """Queue depth, throughput and flush latency metrics"""
+        return {
+            'enabled': self.enabled,
+            'queue_depth': self.depth(),
+            'queue_max_size': self.max_size,
+            'max_depth': self.max_depth,
+            'enqueued': self.enqueued,
+            'flushed': self.flushed,
+            'rejected': self.rejected,
+            'dropped': self.dropped,
+            'flush_count': self.flush_count,
+            'flush_failures': self.flush_failures,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'avg_flush_ms': round(self._total_flush_ms / self.flush_count, 2) if self.flush_count else 0,
+            'max_flush_ms': round(self.max_flush_ms, 2)
+        }
+
+# Shared instance, configured in create_app
+ingest_buffer = IngestBuffer()
@@ -0,0 +1,366 @@
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from app.models import db
+from app.models.ingest import IngestLogCheckpoint
+from app.services.ingest_buffer import IngestQueueFull, IngestUnavailable
+from app.utils.background import background_workers_enabled
+
+SEGMENT_SUFFIX = '.log'
+
+class IngestLogFailed(IngestUnavailable):
+    """Raised when the ingest log can no longer make events durable"""
+    pass
+
+class IngestLog:
+    """
+    Append-only, segmented write-ahead log protecting the write-behind buffer.
+
+    Events are appended as JSON lines to the active segment before they are
+    queued in memory, and the request only returns once the line is fsynced.
+    Concurrent appends share one fsync (group commit). The flusher commits a
+    checkpoint (segment, byte offset) in the same transaction as the events
+    it inserts, so replaying a segment from its checkpoint is idempotent.
+    Fully loaded segments are deleted.
+
+    Every segment is held under an exclusive flock by the process that wrote
+    it until it has been truncated, so a replay started by another worker
+    only ever picks up segments left behind by a dead process.
+
+    When a write or fsync fails the log stops accepting events (appends
+    raise IngestLogFailed) until the process is restarted and replays it.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.app = None
+        self.insert_func = None
+        self.directory = None
+        self.segment_bytes = 64 * 1024 * 1024
+        self.sync_interval = 0.005
+        self.replay_batch_size = 1000
+        self._lock = threading.Lock()
+        self._sync_cond = threading.Condition()
+        self._file = None
+        self._segment = None
+        self._offset = 0
+        self._segment_seq = 0
+        self._written_seq = 0
+        self._synced_seq = 0
+        self._sealed = {}
+        self._committed = {}
+        self._syncer = None
+        self._closing = False
+        self._failure = None
+        self.appended = 0
+        self.syncs = 0
+        self.replayed = 0
+        self.truncated = 0
+
+    def init_app(self, app, insert_func):
+        """
+        Replay segments left over from previous runs, then open a fresh
+        segment when the log is enabled. Both only happen where background
+        workers run: never in CLI commands such as `flask db upgrade`, which
+        may run before the tables exist.
+        """
+        self.app = app
+        self.insert_func = insert_func
+        self.directory = app.config.get('INGEST_LOG_DIR') or os.path.join(app.instance_path, 'ingest_log')
+        self.segment_bytes = app.config.get('INGEST_LOG_SEGMENT_BYTES', 64 * 1024 * 1024)
+        self.sync_interval = app.config.get('INGEST_LOG_SYNC_INTERVAL', 0.005)
+        self.replay_batch_size = app.config.get('INGEST_LOG_REPLAY_BATCH_SIZE', 1000)
+
+        # The log only backs the write-behind buffer, which runs with the background workers
+        if not background_workers_enabled(app):
+            return
+
+        # Recover anything a crashed worker did not load, even if the log is now disabled
+        if os.path.isdir(self.directory):
+            self.replay()
+
+        if not app.config.get('INGEST_LOG_ENABLED', False):
+            return
+        if not app.config.get('INGEST_WRITE_BEHIND', False):
+            app.logger.warning("INGEST_LOG_ENABLED has no effect without INGEST_WRITE_BEHIND")
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.enabled = True
+        with self._lock:
+            self._open_segment()
+        self._syncer = threading.Thread(target=self._sync_loop, name='ingest-log-sync', daemon=True)
+        self._syncer.start()
+        atexit.register(self.close)
+
+    # Writing
+
+    def _open_segment(self):
+        """Start a new active segment (caller holds self._lock)"""
+        self._segment_seq += 1
+        self._segment = f"{int(time.time() * 1000):013d}-{os.getpid()}-{self._segment_seq:06d}{SEGMENT_SUFFIX}"
+        self._file = open(os.path.join(self.directory, self._segment), 'ab')
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._offset = 0
+
+    def _seal_segment(self):
+        """Make the active segment durable and keep it locked until it is loaded"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._sealed[self._segment] = (self._file, self._offset)
+        self._open_segment()
+
+    @staticmethod
+    def _encode(row):
+        record = dict(row)
+        record['timestamp'] = record['timestamp'].isoformat()
+        return (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+
+    @staticmethod
+    def _decode(line):
+        row = json.loads(line)
+        row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+        return row
+
+    def append(self, rows, buffer):
+        """
+        Durably log rows and queue them in the write-behind buffer.
+        Logging and queueing happen under one lock so the buffer drains in
+        log order, which keeps checkpoints monotonic. Blocks until the
+        records are fsynced; raises IngestQueueFull without logging anything
+        when the buffer has no room, and IngestLogFailed once the log cannot
+        be written.
+        """
+        with self._lock:
+            if self._failure is not None:
+                raise IngestLogFailed(f"Ingest log unavailable: {self._failure}")
+            # Only appenders add to the buffer and they all hold this lock,
+            # so the room checked here cannot disappear before submit
+            if not buffer.has_room(len(rows)):
+                buffer.rejected += len(rows)
+                raise IngestQueueFull("Ingest queue is full")
+
+            positioned = []
+            chunks = []
+            for row in rows:
+                data = self._encode(row)
+                chunks.append(data)
+                self._offset += len(data)
+                positioned.append(dict(row, _wal=(self._segment, self._offset)))
+
+            try:
+                self._file.write(b''.join(chunks))
+            except OSError as e:
+                raise self._fail(e) from e
+            buffer.submit(positioned)
+            self.appended += len(rows)
+            self._written_seq += 1
+            seq = self._written_seq
+
+            if self._offset >= self.segment_bytes:
+                try:
+                    self._seal_segment()
+                except OSError as e:
+                    raise self._fail(e) from e
+                self._synced_seq = max(self._synced_seq, seq)
+
+        with self._sync_cond:
+            self._sync_cond.notify_all()
+            while self._synced_seq < seq and not self._closing:
+                if self._failure is not None:
+                    raise IngestLogFailed(f"Ingest log unavailable: {self._failure}")
+                self._sync_cond.wait(timeout=1)
+
+    def _sync_loop(self):
+        """Background group commit: one fsync covers every append since the last one"""
+        while True:
+            with self._sync_cond:
+                while self._synced_seq >= self._written_seq and not self._closing:
+                    self._sync_cond.wait()
+                if self._closing and self._synced_seq >= self._written_seq:
+                    return
+
+            # Give concurrent appenders a moment to join this commit group
+            time.sleep(self.sync_interval)
+
+            try:
+                # Appenders only wait for the write; the fsync runs on a duplicate
+                # descriptor, which stays valid if the segment is sealed and closed
+                with self._lock:
+                    target = self._written_seq
+                    self._file.flush()
+                    fd = os.dup(self._file.fileno())
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                self._fail(e)
+                return
+
+            with self._sync_cond:
+                self._synced_seq = max(self._synced_seq, target)
+                self.syncs += 1
+                self._sync_cond.notify_all()
+
+    def _fail(self, error):
+        """Stop accepting events and release every waiting appender; returns the error to raise"""
+        self.app.logger.error(f"Ingest log write failed, refusing new events until restart: {str(error)}")
+        with self._sync_cond:
+            self._failure = error
+            self._sync_cond.notify_all()
+        return IngestLogFailed(f"Ingest log unavailable: {error}")
+
+    # Loading
+
+    def flush_rows(self, rows):
+        """
+        Flush function for the write-behind buffer: insert the rows and
+        advance the segment checkpoints in the same transaction.
+        """
+        positions = {}
+        clean_rows = []
+        for row in rows:
+            row = dict(row)
+            position = row.pop('_wal', None)
+            if position is not None:
+                segment, offset = position
+                positions[segment] = max(positions.get(segment, 0), offset)
+            clean_rows.append(row)
+
+        self.insert_func(clean_rows)
+        for segment, offset in positions.items():
+            db.session.merge(IngestLogCheckpoint(segment=segment, offset=offset))
+        db.session.commit()
+
+        with self._lock:
+            self._committed.update(positions)
+            self._truncate_loaded()
+
+    def _truncate_loaded(self):
+        """Delete sealed segments whose records are all committed (caller holds self._lock)"""
+        for segment, (handle, end_offset) in list(self._sealed.items()):
+            if self._committed.get(segment, 0) < end_offset:
+                continue
+            self._remove_segment(segment, handle)
+            del self._sealed[segment]
+            self._committed.pop(segment, None)
+
+    def _remove_segment(self, segment, handle):
+        # Remove the file before its checkpoint so a crash in between cannot cause a re-load
+        os.remove(os.path.join(self.directory, segment))
+        handle.close()
+        IngestLogCheckpoint.query.filter_by(segment=segment).delete()
+        db.session.commit()
+        self.truncated += 1
+
+    def replay(self):
+        """
+        Load every segment on disk that no live process holds, from its
+        checkpoint onwards, then delete it. Safe to run repeatedly.
+        """
+        for segment in sorted(os.listdir(self.directory)):
+            if not segment.endswith(SEGMENT_SUFFIX) or segment == self._segment or segment in self._sealed:
+                continue
+
+            handle = open(os.path.join(self.directory, segment), 'rb')
+            try:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Still owned by a running worker
+                handle.close()
+                continue
+
+            try:
+                with self.app.app_context():
+                    loaded = self._replay_segment(segment, handle)
+                    self._remove_segment(segment, handle)
+                self.app.logger.info(f"Replayed {loaded} events from ingest log segment {segment}")
+            except Exception as e:
+                handle.close()
+                self.app.logger.error(f"Error replaying ingest log segment {segment}: {str(e)}")
+
+    def _replay_segment(self, segment, handle):
+        checkpoint = db.session.get(IngestLogCheckpoint, segment)
+        offset = checkpoint.offset if checkpoint else 0
+        handle.seek(offset)
+
+        loaded = 0
+        batch = []
+        for line in handle:
+            # A torn last line means the process died mid-write; it was never acknowledged
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            try:
+                batch.append(self._decode(line))
+            except (ValueError, KeyError) as e:
+                self.app.logger.warning(f"Skipping corrupt record in {segment}: {str(e)}")
+                continue
+
+            if len(batch) >= self.replay_batch_size:
+                loaded += self._load_batch(segment, batch, offset)
+                batch = []
+
+        if batch:
+            loaded += self._load_batch(segment, batch, offset)
+        self.replayed += loaded
+        return loaded
+
+    def _load_batch(self, segment, rows, offset):
+        self.insert_func(rows)
+        db.session.merge(IngestLogCheckpoint(segment=segment, offset=offset))
+        db.session.commit()
+        return len(rows)
+
+    def close(self):
+        """Stop the syncer and release segments (after the buffer has drained)"""
+        if not self.enabled:
+            return
+        with self._sync_cond:
+            self._closing = True
+            self._sync_cond.notify_all()
+        if self._syncer is not None:
+            self._syncer.join(5)
+
+        with self._lock:
+            if self._failure is None:
+                try:
+                    self._seal_segment()
+                except OSError as e:
+                    self._fail(e)
+            with self.app.app_context():
+                self._truncate_loaded()
+            # Anything still here was not loaded; it is replayed on next start
+            for handle, _ in self._sealed.values():
+                handle.close()
+            self._sealed.clear()
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            if self._failure is None:
+                # The segment opened by the seal above is empty
+                os.remove(os.path.join(self.directory, self._segment))
+        self.enabled = False
+
+    def stats(self):
+        """Append, group-commit and replay counters"""
+        return {
+            'enabled': self.enabled,
+            'active_segment': self._segment,
+            'sealed_segments': len(self._sealed),
+            'appended': self.appended,
+            'syncs': self.syncs,
+            'appends_per_sync': round(self._written_seq / self.syncs, 2) if self.syncs else 0,
+            'replayed': self.replayed,
+            'truncated_segments': self.truncated,
+            'failure': str(self._failure) if self._failure is not None else None
+        }
+
+# Shared instance, configured in create_app
+ingest_log = IngestLog()
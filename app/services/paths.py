@@ -0,0 +1,192 @@
+from datetime import datetime, timedelta
+import numpy as np
+from flask import current_app
+from app.services.event_streams import EventStream
+from app.services.event_types import event_type_cache
+from app.utils.space_saving import SpaceSaving
+
+# Pseudo event type ids marking where paths begin and end
+PATH_START = -1
+PATH_END = -2
+MARKER_NAMES = {PATH_START: '(start)', PATH_END: '(end)'}
+
+class PathAnalyzer:
+    """
+    Paths and flows between events, counted in one streaming pass.
+
+    Events arrive in (identity, timestamp) order in bounded chunks; a path
+    is an identity's run of events without a gap longer than
+    PATH_SESSION_GAP. Each chunk is reduced with NumPy to exact counts of
+    its transitions or n-grams, which are merged into Space-Saving
+    summaries of PATH_TOP_K keys, so memory stays flat however long the
+    project's history is.
+    """
+
+    @staticmethod
+    def path_starts(codes, timestamps, gap):
+        """True for each event that begins a path"""
+        first = np.ones(len(codes), dtype=bool)
+        first[1:] = (codes[1:] != codes[:-1]) | (timestamps[1:] - timestamps[:-1] > gap)
+        return first
+
+    @staticmethod
+    def count_rows(summary, *columns):
+        """Merge exact counts of the rows formed by the columns into a SpaceSaving summary"""
+        if not len(columns[0]):
+            return
+        rows, counts = np.unique(np.stack(columns, axis=1), axis=0, return_counts=True)
+        summary.update((tuple(int(value) for value in row), int(count)) for row, count in zip(rows, counts))
+
+    @classmethod
+    def _paths(cls, project_id, days):
+        """Yield (event types, path start flags) per chunk of the last days"""
+        since = datetime.utcnow() - timedelta(days=days)
+        gap = current_app.config.get('PATH_SESSION_GAP', 1800)
+        for identities, timestamps, types in EventStream.identity_chunks(project_id, since):
+            yield types, cls.path_starts(EventStream.run_codes(identities), timestamps, gap)
+
+    @staticmethod
+    def _names(type_ids):
+        names = event_type_cache.names_for(type_id for type_id in type_ids if type_id >= 0)
+        names.update(MARKER_NAMES)
+        return names
+
+    @classmethod
+    def summary(cls, project_id, days=30, limit=10):
+        """Most common entry and exit events, transitions and three-event sequences"""
+        capacity = current_app.config.get('PATH_TOP_K', 5000)
+        transitions = SpaceSaving(capacity)
+        sequences = SpaceSaving(capacity)
+        n_paths = 0
+        n_events = 0
+
+        for types, first in cls._paths(project_id, days):
+            last = np.r_[first[1:], True]
+            n_paths += int(first.sum())
+            n_events += len(types)
+            # Every event with its predecessor (or the path start), and every path end
+            previous = np.r_[PATH_START, types[:-1]]
+            previous[first] = PATH_START
+            cls.count_rows(transitions,
+                           np.r_[previous, types[last]],
+                           np.r_[types, np.full(int(last.sum()), PATH_END)])
+            # Windows of three events inside one path
+            inside = ~first[1:-1] & ~first[2:]
+            cls.count_rows(sequences, types[:-2][inside], types[1:-1][inside], types[2:][inside])
+
+        keys = [key for key, _, _ in transitions.top()] + [key for key, _, _ in sequences.top(limit)]
+        names = cls._names({type_id for key in keys for type_id in key})
+        return {
+            'days': days,
+            'paths': n_paths,
+            'events': n_events,
+            'avg_path_length': round(n_events / n_paths, 1) if n_paths else 0,
+            'top_entries': [
+                {'event': names[to], 'count': count}
+                for (source, to), count, _ in transitions.top(limit, lambda key: key[0] == PATH_START)
+            ],
+            'top_exits': [
+                {'event': names[source], 'count': count}
+                for (source, to), count, _ in transitions.top(limit, lambda key: key[1] == PATH_END)
+            ],
+            'top_transitions': [
+                {'from': names[source], 'to': names[to], 'count': count, 'error': error}
+                for (source, to), count, error in transitions.top(
+                    limit, lambda key: key[0] != PATH_START and key[1] != PATH_END)
+            ],
+            'top_sequences': [
+                {'events': [names[type_id] for type_id in key], 'count': count, 'error': error}
+                for key, count, error in sequences.top(limit)
+            ]
+        }
+
+    @classmethod
+    def explore(cls, project_id, anchor=None, direction='next', depth=3, days=30, limit=8):
+        """
+        Flows of up to depth steps after (or before) the first occurrence of the
+        anchor event in each path, or from path starts (ends) without an anchor.
+        Returns Sankey nodes and links plus the most common event of each step.
+        """
+        if direction not in ('next', 'previous'):
+            raise ValueError(f"Unknown direction: {direction}")
+        anchor_type = event_type_cache.id_for(anchor) if anchor else None
+        step = 1 if direction == 'next' else -1
+        marker = PATH_END if step == 1 else PATH_START
+        edges = SpaceSaving(current_app.config.get('PATH_TOP_K', 5000))
+        n_anchored = 0
+
+        if anchor is None or anchor_type is not None:
+            for types, first in cls._paths(project_id, days):
+                path_id = np.cumsum(first) - 1
+                begins = np.flatnonzero(first)
+                ends = np.r_[begins[1:], len(types)] - 1
+                if anchor_type is None:
+                    positions = begins if step == 1 else ends
+                else:
+                    # First occurrence of the anchor in each path
+                    matches = np.flatnonzero(types == anchor_type)
+                    _, index = np.unique(path_id[matches], return_index=True)
+                    positions = matches[index]
+                n_anchored += len(positions)
+
+                current = positions
+                for level in range(1, depth + 1):
+                    if not len(current):
+                        break
+                    following = current + step
+                    limit_positions = ends[path_id[current]] if step == 1 else begins[path_id[current]]
+                    inside = following <= limit_positions if step == 1 else following >= limit_positions
+                    cls.count_rows(edges,
+                                   np.full(len(current), level),
+                                   types[current],
+                                   np.where(inside, types[np.clip(following, 0, len(types) - 1)], marker))
+                    current = following[inside]
+
+        return cls._flow(edges, anchor, direction, depth, days, n_anchored, limit)
+
+    @classmethod
+    def _flow(cls, edges, anchor, direction, depth, days, n_anchored, limit):
+        """Sankey nodes and links from the top edges of each level"""
+        nodes = {}
+        links = []
+        levels = []
+        for level in range(1, depth + 1):
+            top = edges.top(where=lambda key: key[0] == level)
+            # Keep the busiest targets of the level, and only edges from nodes kept so far
+            targets = {}
+            for (_, source, target), count, _ in top:
+                targets[target] = targets.get(target, 0) + count
+            kept = set(sorted(targets, key=targets.get, reverse=True)[:limit])
+            level_links = [
+                (source, target, count) for (_, source, target), count, _ in top
+                if target in kept and (level == 1 or (level - 1, source) in nodes)
+            ]
+            for source, target, count in level_links:
+                for key in ((level - 1, source), (level, target)):
+                    nodes.setdefault(key, len(nodes))
+                links.append({'source': nodes[(level - 1, source)], 'target': nodes[(level, target)], 'value': count})
+            levels.append(sorted(
+                ({'event': target, 'count': count} for target, count in targets.items() if target in kept),
+                key=lambda item: item['count'], reverse=True
+            ))
+            # Path ends (starts) are not followed further
+            nodes_at_level = {key for key in nodes if key[0] == level and key[1] not in MARKER_NAMES}
+            if not nodes_at_level:
+                break
+
+        names = cls._names({type_id for _, type_id in nodes} |
+                           {item['event'] for level_items in levels for item in level_items})
+        for level_items in levels:
+            for item in level_items:
+                item['event'] = names[item['event']]
+                item['share'] = round(item['count'] / n_anchored * 100, 1) if n_anchored else 0
+        return {
+            'anchor': anchor,
+            'direction': direction,
+            'depth': depth,
+            'days': days,
+            'paths': n_anchored,
+            'nodes': [{'level': level, 'event': names[type_id]} for level, type_id in nodes],
+            'links': links,
+            'levels': levels
+        }
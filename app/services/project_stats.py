@@ -0,0 +1,111 @@
+from collections import Counter
+from sqlalchemy import func, select, update, bindparam
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.models import db
+from app.models.event import Event
+from app.models.project import Project, ProjectUser
+
+class ProjectStatsService:
+    """
+    Per-project event and user totals stored on the projects row.
+
+    Ingestion adds the inserted events to Project.event_count and records
+    each user_id in project_users; only ids not seen before raise
+    Project.active_users_count. Pages listing projects read the columns.
+    """
+
+    @staticmethod
+    def _insert_statement():
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'sqlite':
+            return sqlite_insert(ProjectUser).on_conflict_do_nothing()
+        if dialect == 'postgresql':
+            return postgresql_insert(ProjectUser).on_conflict_do_nothing()
+        return None
+
+    @classmethod
+    def _record_users(cls, pairs):
+        """Store (project_id, user_id) pairs; returns a Counter of the new users per project"""
+        if not pairs:
+            return Counter()
+        statement = cls._insert_statement()
+        values = [{'project_id': project_id, 'user_id': user_id} for project_id, user_id in pairs]
+        if statement is not None and db.session.get_bind().dialect.insert_executemany_returning:
+            new = db.session.execute(statement.returning(ProjectUser.project_id), values).scalars()
+            return Counter(new)
+
+        known = set(db.session.query(ProjectUser.project_id, ProjectUser.user_id).filter(
+            ProjectUser.project_id.in_({project_id for project_id, _ in pairs}),
+            ProjectUser.user_id.in_({user_id for _, user_id in pairs})
+        ).all())
+        new = [value for value in values if (value['project_id'], value['user_id']) not in known]
+        if new:
+            db.session.execute(statement if statement is not None else ProjectUser.__table__.insert(), new)
+        return Counter(value['project_id'] for value in new)
+
+    @classmethod
+    def increment(cls, project_ids, rows):
+        """
+        Count inserted events (one project id each) and the users of prepared
+        event rows into the project totals. Runs in the caller's transaction.
+        """
+        events = Counter(project_ids)
+        users = cls._record_users({(row['project_id'], row['user_id']) for row in rows if row.get('user_id')})
+        if not events and not users:
+            return
+        # Core UPDATE: executemany with per-project increments
+        projects = Project.__table__
+        db.session.execute(
+            update(projects).where(projects.c.id == bindparam('pid')).values(
+                event_count=projects.c.event_count + bindparam('events'),
+                active_users_count=projects.c.active_users_count + bindparam('users')
+            ),
+            [{'pid': project_id, 'events': events[project_id], 'users': users[project_id]}
+             for project_id in events.keys() | users.keys()]
+        )
+
+    @staticmethod
+    def load(project_ids=None):
+        """
+        Totals computed from raw events in one grouped query,
+        as {project_id: (event count, distinct user_id count)}
+        """
+        query = db.session.query(
+            Event.project_id,
+            func.count(Event.id),
+            func.count(func.distinct(Event.user_id))
+        )
+        if project_ids is not None:
+            query = query.filter(Event.project_id.in_(project_ids))
+        return {project_id: (events, users) for project_id, events, users in query.group_by(Event.project_id)}
+
+    @classmethod
+    def rebuild(cls, project_id=None):
+        """Recompute project_users and the totals from raw events; returns the number of projects updated"""
+        project_ids = [project_id] if project_id is not None else [row.id for row in Project.query.with_entities(Project.id)]
+        ProjectUser.query.filter(ProjectUser.project_id.in_(project_ids)).delete(synchronize_session=False)
+
+        users = select(
+            Event.project_id,
+            Event.user_id,
+            func.min(Event.timestamp)
+        ).where(
+            Event.project_id.in_(project_ids),
+            Event.user_id.isnot(None)
+        ).group_by(Event.project_id, Event.user_id)
+        db.session.execute(ProjectUser.__table__.insert().from_select(['project_id', 'user_id', 'first_seen_at'], users))
+
+        totals = cls.load(project_ids)
+        if project_ids:
+            projects = Project.__table__
+            db.session.execute(
+                update(projects).where(projects.c.id == bindparam('pid')).values(
+                    event_count=bindparam('events'),
+                    active_users_count=bindparam('users')
+                ),
+                [{'pid': pid, 'events': totals.get(pid, (0, 0))[0], 'users': totals.get(pid, (0, 0))[1]}
+                 for pid in project_ids]
+            )
+        db.session.commit()
+        return len(project_ids)
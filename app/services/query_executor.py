@@ -0,0 +1,109 @@
+import atexit
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from flask import current_app
+from app.models import db
+
+class QueryBatch:
+    """
+    Independent computations for one page, run concurrently.
+
+    Each task runs in its own application context and therefore with its
+    own database session, released when the task ends. Identical calls
+    submitted under different names share one execution.
+    """
+
+    def __init__(self, executor, app, timeout):
+        self.executor = executor
+        self.app = app
+        self.timeout = timeout
+        self.started = time.monotonic()
+        self._calls = {}
+        self._tasks = {}
+
+    def _run(self, func, args, kwargs):
+        with self.app.app_context():
+            try:
+                return func(*args, **kwargs)
+            finally:
+                db.session.remove()
+
+    def submit(self, name, func, *args, timeout=None, **kwargs):
+        """Schedule func(*args, **kwargs) under name; timeout overrides the batch default"""
+        key = (func, args, tuple(sorted(kwargs.items())))
+        future = self._calls.get(key)
+        if future is None:
+            if self.executor is None:
+                # No pool configured: run inline, still in a separate session
+                future = _CompletedCall(self._run, func, args, kwargs)
+            else:
+                future = self.executor.submit(self._run, func, args, kwargs)
+            self._calls[key] = future
+        self._tasks[name] = (future, self.timeout if timeout is None else timeout)
+        return future
+
+    def gather(self):
+        """
+        Wait for every task up to its deadline, measured from the start of the batch.
+        Returns (results, failures): failures maps task names to 'timeout' or 'error'.
+        """
+        results = {}
+        failures = {}
+        for name, (future, timeout) in self._tasks.items():
+            remaining = max(self.started + timeout - time.monotonic(), 0)
+            try:
+                results[name] = future.result(timeout=remaining)
+            except FutureTimeout:
+                # The computation keeps its worker until it finishes; a cached result helps the next request
+                failures[name] = 'timeout'
+                current_app.logger.warning(f"Analytics task {name} timed out after {timeout}s")
+            except Exception:
+                failures[name] = 'error'
+                current_app.logger.exception(f"Analytics task {name} failed")
+        return results, failures
+
+class _CompletedCall:
+    """Future-like wrapper for a call made synchronously"""
+
+    def __init__(self, run, func, args, kwargs):
+        self._result = None
+        self._error = None
+        try:
+            self._result = run(func, args, kwargs)
+        except Exception as e:
+            self._error = e
+
+    def result(self, timeout=None):
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+class QueryExecutor:
+    """Bounded thread pool shared by all requests that fan out analytics queries"""
+
+    def __init__(self):
+        self.max_workers = 4
+        self.timeout = 10.0
+        self._pool = None
+
+    def init_app(self, app):
+        """Size the pool from ANALYTICS_WORKERS; 0 runs the tasks inline"""
+        self.max_workers = app.config.get('ANALYTICS_WORKERS', 4)
+        self.timeout = app.config.get('ANALYTICS_TASK_TIMEOUT', 10.0)
+        self.shutdown()
+        if self.max_workers > 0:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='analytics')
+            atexit.register(self.shutdown)
+
+    def batch(self, timeout=None):
+        """Start a batch bound to the current app"""
+        return QueryBatch(self._pool, current_app._get_current_object(),
+                          self.timeout if timeout is None else timeout)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+# Shared executor, configured in create_app
+query_executor = QueryExecutor()
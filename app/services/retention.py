@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import func
+from app.models import db
+from app.models.event import Event
+from app.services.segments import event_segments, EventSegmentStore
+
+# numpy day numbers count from 1970-01-01, a Thursday; shifting by 3 makes weeks start on Monday
+_MONDAY_SHIFT = 3
+
+class RetentionEngine:
+    """
+    Cohort retention computed from a single range scan.
+
+    Distinct (identity, day) pairs in the window are fetched once, then
+    integer-coded with NumPy: each identity's cohort is its first active
+    period, and one bincount over (cohort, offset) yields the whole
+    cohort x offset matrix. Bounded ("active exactly N periods later") and
+    unbounded ("active N or more periods later") retention both come from it.
+    """
+
+    @staticmethod
+    def period_start(now, weeks, unit):
+        """First day of the analysed window, aligned to the start of a period"""
+        start = (now - timedelta(weeks=weeks)).replace(hour=0, minute=0, second=0, microsecond=0)
+        if unit == 'week':
+            start -= timedelta(days=start.weekday())
+        return start
+
+    @staticmethod
+    def activity_days(project_id, start):
+        """
+        Identity codes and day numbers of every active identity-day since start
+        (pairs may repeat). Closed days come from segments when available.
+        """
+        days = event_segments.fresh_days(project_id, start)
+        query = db.session.query(
+            Event.identity,
+            func.date(Event.timestamp)
+        ).filter(
+            Event.project_id == project_id,
+            Event.timestamp >= start,
+            Event.identity.isnot(None)
+        )
+        skip = EventSegmentStore.excluding(Event.timestamp, days)
+        if skip is not None:
+            query = query.filter(skip)
+        rows = query.distinct().all()
+        scan = event_segments.scan(project_id, days)
+        present = scan.identity >= 0
+        if not rows and not present.any():
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        identities, dates = zip(*rows) if rows else ((), ())
+        # SQLite returns 'YYYY-MM-DD' strings, PostgreSQL date objects; datetime64 takes both
+        day_numbers = np.array(dates, dtype='datetime64[D]').astype(np.int64)
+        # Code segment and SQL identities against one dictionary
+        names = np.concatenate([scan.identities, np.array(identities, dtype=object)])
+        _, codes = np.unique(names, return_inverse=True)
+        n_segment = len(scan.identities)
+        return (
+            np.concatenate([codes[scan.identity[present]], codes[n_segment:]]).astype(np.int64),
+            np.concatenate([scan.timestamp[present] // 86400, day_numbers])
+        )
+
+    @staticmethod
+    def to_periods(day_numbers, unit):
+        if unit == 'week':
+            return (day_numbers + _MONDAY_SHIFT) // 7
+        return day_numbers
+
+    @staticmethod
+    def period_label(period, unit):
+        if unit == 'week':
+            monday = np.datetime64(int(period) * 7 - _MONDAY_SHIFT, 'D').astype(datetime)
+            return monday.strftime('%Y-%W')
+        return np.datetime64(int(period), 'D').astype(datetime).strftime('%Y-%m-%d')
+
+    @classmethod
+    def matrix(cls, codes, periods, width, rolling=False):
+        """
+        Return (cohort periods, cohort sizes, counts) where counts[i, n] is the number of
+        identities of cohort i active n periods after their first one (or n and later
+        when rolling), for n < width.
+        """
+        if len(codes) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.zeros((0, width), dtype=np.int64)
+
+        # One entry per identity and period, sorted by identity then period
+        base = int(periods.min())
+        span = int(periods.max()) - base + 1
+        keys = np.unique(codes * span + (periods - base))
+        codes, periods = keys // span, keys % span + base
+
+        # Every identity occurs, so run starts give each one's first and last period
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        ends = np.r_[starts[1:], len(codes)] - 1
+        first = periods[starts]
+        offsets = periods - first[codes]
+
+        cohort_periods, cohort_index = np.unique(first, return_inverse=True)
+        n_cohorts = len(cohort_periods)
+
+        if rolling:
+            # An identity counts for every offset up to its last active one
+            last = np.minimum(offsets[ends], width - 1)
+            latest = np.bincount(cohort_index * width + last, minlength=n_cohorts * width).reshape(n_cohorts, width)
+            counts = latest[:, ::-1].cumsum(axis=1)[:, ::-1]
+        else:
+            inside = offsets < width
+            entries = cohort_index[codes[inside]] * width + offsets[inside]
+            counts = np.bincount(entries, minlength=n_cohorts * width).reshape(n_cohorts, width)
+
+        sizes = np.bincount(cohort_index, minlength=n_cohorts)
+        return cohort_periods, sizes, counts
+
+    @classmethod
+    def retention(cls, project_id, weeks=8, unit='week', rolling=False):
+        """Retention per cohort, as [{'cohort', 'size', 'retention': {offset: percent}}]"""
+        start = cls.period_start(datetime.utcnow(), weeks, unit)
+        width = weeks if unit == 'week' else weeks * 7
+
+        codes, day_numbers = cls.activity_days(project_id, start)
+        cohort_periods, sizes, counts = cls.matrix(codes, cls.to_periods(day_numbers, unit), width, rolling)
+        percentages = np.round(counts / np.maximum(sizes, 1)[:, None] * 100, 1)
+
+        return [
+            {
+                'cohort': cls.period_label(period, unit),
+                'size': int(size),
+                'retention': {offset: float(percentages[i, offset]) for offset in range(width)}
+            }
+            for i, (period, size) in enumerate(zip(cohort_periods, sizes))
+        ]
@@ -0,0 +1,191 @@
+from collections import Counter
+from datetime import timedelta
+from sqlalchemy import func, desc
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.models import db
+from app.models.event import Event
+from app.models.rollup import EventRollupHourly, EventRollupDaily
+
+# Granularity -> (rollup table, bucket width)
+GRANULARITIES = {
+    'hour': (EventRollupHourly, timedelta(hours=1)),
+    'day': (EventRollupDaily, timedelta(days=1)),
+}
+
+class RollupService:
+    """
+    Hourly and daily event counts per project and event type.
+
+    The rollups are updated in the same transaction as the events they count,
+    so they are always consistent with the events table; late events simply
+    land in their own (older) bucket. Range queries read whole buckets from
+    the rollups and scan raw events only for the partial buckets at the edges.
+    """
+
+    @staticmethod
+    def floor_bucket(timestamp, granularity):
+        """Start of the bucket containing timestamp"""
+        if granularity == 'day':
+            return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+
+    @classmethod
+    def ceil_bucket(cls, timestamp, granularity):
+        """First bucket boundary at or after timestamp"""
+        start = cls.floor_bucket(timestamp, granularity)
+        return start if start == timestamp else start + GRANULARITIES[granularity][1]
+
+    @staticmethod
+    def _upsert(table, counts):
+        """Add counts keyed by (project_id, event_type_id, bucket) to a rollup table"""
+        values = [
+            {'project_id': project_id, 'event_type_id': event_type_id, 'bucket': bucket, 'count': count}
+            for (project_id, event_type_id, bucket), count in counts.items()
+        ]
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            insert = sqlite_insert(table) if dialect == 'sqlite' else postgresql_insert(table)
+            statement = insert.on_conflict_do_update(
+                index_elements=['project_id', 'event_type_id', 'bucket'],
+                set_={'count': table.count + insert.excluded.count}
+            )
+            db.session.execute(statement, values)
+            return
+
+        # Other databases: read-modify-write through the session
+        for value in values:
+            rollup = db.session.get(table, (value['project_id'], value['event_type_id'], value['bucket']))
+            if rollup is None:
+                db.session.add(table(**value))
+            else:
+                rollup.count += value['count']
+
+    @classmethod
+    def increment(cls, events):
+        """
+        Count (project_id, event_type_id, timestamp) tuples into both rollups.
+        Runs in the caller's transaction, without committing.
+        """
+        hourly = Counter()
+        daily = Counter()
+        for project_id, event_type_id, timestamp in events:
+            hourly[(project_id, event_type_id, cls.floor_bucket(timestamp, 'hour'))] += 1
+            daily[(project_id, event_type_id, cls.floor_bucket(timestamp, 'day'))] += 1
+        if hourly:
+            cls._upsert(EventRollupHourly, hourly)
+            cls._upsert(EventRollupDaily, daily)
+
+    @staticmethod
+    def _raw_count(project_id, start, end, event_type_id=None):
+        query = db.session.query(func.count(Event.id)).filter(
+            Event.project_id == project_id,
+            Event.timestamp >= start,
+            Event.timestamp < end
+        )
+        if event_type_id is not None:
+            query = query.filter(Event.event_type_id == event_type_id)
+        return query.scalar() or 0
+
+    @staticmethod
+    def _rollup_counts(granularity, project_id, start, end, event_type_id=None):
+        """Counts per bucket for the whole buckets in [start, end)"""
+        table = GRANULARITIES[granularity][0]
+        query = db.session.query(table.bucket, func.sum(table.count)).filter(
+            table.project_id == project_id,
+            table.bucket >= start,
+            table.bucket < end
+        )
+        if event_type_id is not None:
+            query = query.filter(table.event_type_id == event_type_id)
+        return dict(query.group_by(table.bucket).all())
+
+    @classmethod
+    def split_range(cls, start, end, granularities=('day', 'hour')):
+        """
+        Split [start, end) into (granularity, start, end) pieces: whole buckets of the
+        coarsest granularity that fits, then finer ones, and (None, start, end) remnants
+        that must be read from raw events.
+        """
+        if start >= end:
+            return []
+        if not granularities:
+            return [(None, start, end)]
+        granularity, finer = granularities[0], granularities[1:]
+        first_full = cls.ceil_bucket(start, granularity)
+        last_full = cls.floor_bucket(end, granularity)
+        if first_full >= last_full:
+            return cls.split_range(start, end, finer)
+        return (cls.split_range(start, first_full, finer) + [(granularity, first_full, last_full)] +
+                cls.split_range(last_full, end, finer))
+
+    @classmethod
+    def count_range(cls, project_id, start, end, event_type_id=None):
+        """Number of events in [start, end): whole hours from the rollup, the rest from raw events"""
+        total = 0
+        for granularity, piece_start, piece_end in cls.split_range(start, end, ('hour',)):
+            if granularity is None:
+                total += cls._raw_count(project_id, piece_start, piece_end, event_type_id)
+            else:
+                total += sum(cls._rollup_counts(granularity, project_id, piece_start, piece_end, event_type_id).values())
+        return total
+
+    @staticmethod
+    def top_event_types(project_id, limit=10):
+        """(event_type_id, count) pairs of the most frequent event types over all time"""
+        return db.session.query(
+            EventRollupDaily.event_type_id,
+            func.sum(EventRollupDaily.count).label('count')
+        ).filter(
+            EventRollupDaily.project_id == project_id
+        ).group_by(
+            EventRollupDaily.event_type_id
+        ).order_by(
+            desc('count')
+        ).limit(limit).all()
+
+    @classmethod
+    def rebuild(cls, project_id=None, start=None, end=None, batch_size=10000):
+        """
+        Recompute the rollups from raw events, for one project or all, optionally
+        limited to the days overlapping [start, end). Returns the number of events counted.
+        """
+        filters = []
+        if start is not None:
+            start = cls.floor_bucket(start, 'day')
+        if end is not None:
+            end = cls.ceil_bucket(end, 'day')
+        for table in (EventRollupHourly, EventRollupDaily):
+            query = table.query
+            if project_id is not None:
+                query = query.filter(table.project_id == project_id)
+            if start is not None:
+                query = query.filter(table.bucket >= start)
+            if end is not None:
+                query = query.filter(table.bucket < end)
+            query.delete(synchronize_session=False)
+
+        if project_id is not None:
+            filters.append(Event.project_id == project_id)
+        if start is not None:
+            filters.append(Event.timestamp >= start)
+        if end is not None:
+            filters.append(Event.timestamp < end)
+
+        events = db.session.query(Event.project_id, Event.event_type_id, Event.timestamp).filter(
+            *filters
+        ).execution_options(yield_per=batch_size)
+
+        total = 0
+        batch = []
+        for event in events:
+            batch.append(tuple(event))
+            if len(batch) >= batch_size:
+                cls.increment(batch)
+                total += len(batch)
+                batch = []
+        cls.increment(batch)
+        total += len(batch)
+
+        db.session.commit()
+        return total
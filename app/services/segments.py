@@ -0,0 +1,283 @@
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import func, and_, or_, not_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.models import db
+from app.models.event import Event
+from app.models.rollup import EventRollupDaily, EventDayVersion
+
+ONE_DAY = timedelta(days=1)
+DAY_FORMAT = '%Y-%m-%d'
+COLUMNS = ('timestamp', 'event_type_id', 'identity')
+
+class SegmentScan:
+    """Columns of the events read from segments, identities coded against one shared dictionary"""
+
+    def __init__(self, timestamp, event_type_id, identity, identities):
+        # Seconds since the epoch (UTC), event_types ids, codes into identities (-1 for none)
+        self.timestamp = timestamp
+        self.event_type_id = event_type_id
+        self.identity = identity
+        self.identities = identities
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32),
+                   np.empty(0, dtype=np.int32), np.empty(0, dtype=object))
+
+    def __len__(self):
+        return len(self.timestamp)
+
+class EventSegmentStore:
+    """
+    Immutable columnar copies of closed days of events, one directory per
+    project and UTC day:
+
+        <root>/<project_id>/<YYYY-MM-DD>/timestamp.npy      int64 seconds since the epoch, sorted
+                                         event_type_id.npy  int32 ids from the event_types dictionary
+                                         identity.npy       int32 codes into identities.json, -1 for none
+                                         identities.json    the day's distinct identities
+                                         meta.json          row count and day version
+
+    Arrays are memory-mapped when scanned. A segment is only used while its
+    row count matches the day's total in the daily rollup and its version
+    the day's version in event_day_versions, so days that received late
+    events or had events rewritten (identity stitching) are read from SQL
+    until they are compacted again.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.root = None
+
+    def init_app(self, app):
+        self.enabled = app.config.get('EVENT_SEGMENTS_ENABLED', False)
+        self.root = app.config.get('EVENT_SEGMENTS_DIR') or os.path.join(app.instance_path, 'segments')
+
+    def _path(self, project_id, day=None):
+        path = os.path.join(self.root, str(project_id))
+        return path if day is None else os.path.join(path, day.strftime(DAY_FORMAT))
+
+    def stored_days(self, project_id):
+        try:
+            names = os.listdir(self._path(project_id))
+        except FileNotFoundError:
+            return []
+        days = []
+        for name in names:
+            try:
+                days.append(datetime.strptime(name, DAY_FORMAT))
+            except ValueError:
+                # Temporary directory of a write in progress
+                continue
+        return sorted(days)
+
+    def _meta(self, project_id, day):
+        with open(os.path.join(self._path(project_id, day), 'meta.json')) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _day_totals(project_id, first, last):
+        """Event totals of the days in [first, last] from the daily rollup"""
+        rows = db.session.query(EventRollupDaily.bucket, func.sum(EventRollupDaily.count)).filter(
+            EventRollupDaily.project_id == project_id,
+            EventRollupDaily.bucket >= first,
+            EventRollupDaily.bucket <= last
+        ).group_by(EventRollupDaily.bucket)
+        return {bucket: int(total) for bucket, total in rows}
+
+    @staticmethod
+    def _day_versions(project_id, first, last):
+        """Versions of the days in [first, last] that have one; the others are at 0"""
+        rows = db.session.query(EventDayVersion.bucket, EventDayVersion.version).filter(
+            EventDayVersion.project_id == project_id,
+            EventDayVersion.bucket >= first,
+            EventDayVersion.bucket <= last
+        )
+        return dict(rows.all())
+
+    def _fresh(self, project_id, days):
+        if not days:
+            return []
+        totals = self._day_totals(project_id, days[0], days[-1])
+        versions = self._day_versions(project_id, days[0], days[-1])
+        fresh = []
+        for day in days:
+            meta = self._meta(project_id, day)
+            if meta['rows'] == totals.get(day, 0) and meta.get('version', 0) == versions.get(day, 0):
+                fresh.append(day)
+        return fresh
+
+    @staticmethod
+    def invalidate(project_id, days):
+        """
+        Bump the version of days whose stored events were rewritten, so their
+        segments stop being used. Runs in the caller's transaction, without committing.
+        """
+        values = [{'project_id': project_id, 'bucket': day, 'version': 1} for day in days]
+        if not values:
+            return
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            insert = sqlite_insert(EventDayVersion) if dialect == 'sqlite' else postgresql_insert(EventDayVersion)
+            statement = insert.on_conflict_do_update(
+                index_elements=['project_id', 'bucket'],
+                set_={'version': EventDayVersion.version + 1}
+            )
+            db.session.execute(statement, values)
+            return
+
+        # Other databases: read-modify-write through the session
+        for value in values:
+            version = db.session.get(EventDayVersion, (project_id, value['bucket']))
+            if version is None:
+                db.session.add(EventDayVersion(**value))
+            else:
+                version.version += 1
+
+    def fresh_days(self, project_id, start=None, end=None):
+        """Closed days entirely inside [start, end) that can be read from their segments"""
+        if not self.enabled:
+            return []
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        days = [
+            day for day in self.stored_days(project_id)
+            if day < today and (start is None or day >= start) and (end is None or day + ONE_DAY <= end)
+        ]
+        return self._fresh(project_id, days)
+
+    @staticmethod
+    def excluding(column, days):
+        """SQL condition on a timestamp column leaving out the given (sorted) days, or None"""
+        ranges = []
+        for day in days:
+            if ranges and ranges[-1][1] == day:
+                ranges[-1][1] = day + ONE_DAY
+            else:
+                ranges.append([day, day + ONE_DAY])
+        if not ranges:
+            return None
+        return not_(or_(*[and_(column >= start, column < end) for start, end in ranges]))
+
+    def open(self, project_id, day):
+        """Memory-mapped columns and the identity dictionary of one segment"""
+        path = self._path(project_id, day)
+        columns = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in COLUMNS}
+        with open(os.path.join(path, 'identities.json')) as f:
+            identities = json.load(f)
+        return columns, identities
+
+    def identities(self, project_id, day):
+        """The distinct identities of one segment, without opening its columns"""
+        with open(os.path.join(self._path(project_id, day), 'identities.json')) as f:
+            return json.load(f)
+
+    def scan(self, project_id, days, event_type_ids=None):
+        """SegmentScan of the given days, optionally only of some event types"""
+        parts = []
+        for day in days:
+            columns, identities = self.open(project_id, day)
+            if event_type_ids is not None:
+                mask = np.isin(columns['event_type_id'], list(event_type_ids))
+                columns = {name: column[mask] for name, column in columns.items()}
+            parts.append((columns, identities))
+        if not parts:
+            return SegmentScan.empty()
+
+        # One dictionary for all days; each day's codes are remapped onto it
+        names = np.array([name for _, identities in parts for name in identities], dtype=object)
+        dictionary, inverse = np.unique(names, return_inverse=True)
+        codes = []
+        offset = 0
+        for columns, identities in parts:
+            # A trailing -1 keeps "no identity" (-1) as -1 after the lookup
+            mapping = np.append(inverse[offset:offset + len(identities)], -1).astype(np.int32)
+            codes.append(mapping[columns['identity']])
+            offset += len(identities)
+
+        return SegmentScan(
+            np.concatenate([columns['timestamp'] for columns, _ in parts]),
+            np.concatenate([columns['event_type_id'] for columns, _ in parts]),
+            np.concatenate(codes),
+            dictionary
+        )
+
+    def write(self, project_id, day):
+        """Compact one day of a project's events into its segment; returns the number of rows"""
+        # Read before the rows: a rewrite in between leaves the segment stale rather than wrongly fresh
+        version = self._day_versions(project_id, day, day).get(day, 0)
+        rows = db.session.query(Event.timestamp, Event.event_type_id, Event.identity).filter(
+            Event.project_id == project_id,
+            Event.timestamp >= day,
+            Event.timestamp < day + ONE_DAY
+        ).order_by(Event.timestamp).all()
+        target = self._path(project_id, day)
+        if not rows:
+            shutil.rmtree(target, ignore_errors=True)
+            return 0
+
+        timestamps, event_type_ids, identities = zip(*rows)
+        identities = np.array(identities, dtype=object)
+        present = np.array([identity is not None for identity in identities], dtype=bool)
+        codes = np.full(len(rows), -1, dtype=np.int32)
+        dictionary = np.empty(0, dtype=object)
+        if present.any():
+            dictionary, codes[present] = np.unique(identities[present], return_inverse=True)
+
+        # Write next to the target, then swap it in with renames
+        temporary = f'{target}.tmp{os.getpid()}'
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+        np.save(os.path.join(temporary, 'timestamp.npy'), np.array(timestamps, dtype='datetime64[s]').astype(np.int64))
+        np.save(os.path.join(temporary, 'event_type_id.npy'), np.array(event_type_ids, dtype=np.int32))
+        np.save(os.path.join(temporary, 'identity.npy'), codes)
+        with open(os.path.join(temporary, 'identities.json'), 'w') as f:
+            json.dump(dictionary.tolist(), f)
+        with open(os.path.join(temporary, 'meta.json'), 'w') as f:
+            json.dump({'rows': len(rows), 'version': version, 'compacted_at': datetime.utcnow().isoformat()}, f)
+
+        if os.path.isdir(target):
+            # Open memory maps of the old segment stay valid after the delete
+            retired = f'{target}.old{os.getpid()}'
+            os.rename(target, retired)
+            os.rename(temporary, target)
+            shutil.rmtree(retired)
+        else:
+            os.rename(temporary, target)
+        return len(rows)
+
+    def compact(self, project_id, since=None, until=None, force=False):
+        """
+        Write segments for the project's closed days in [since, until) that
+        have none yet or a stale one. Returns (days written, rows written).
+        """
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        until = min(until, today) if until is not None else today
+        query = db.session.query(EventRollupDaily.bucket).filter(
+            EventRollupDaily.project_id == project_id,
+            EventRollupDaily.bucket < until
+        )
+        if since is not None:
+            query = query.filter(EventRollupDaily.bucket >= since)
+        days = sorted({bucket for bucket, in query.distinct()})
+
+        if not force:
+            stored = set(self.stored_days(project_id))
+            current = set(self._fresh(project_id, [day for day in days if day in stored]))
+            days = [day for day in days if day not in current]
+
+        written = 0
+        for day in days:
+            written += self.write(project_id, day)
+        return len(days), written
+
+    def drop(self, project_id):
+        """Delete all segments of a project"""
+        shutil.rmtree(self._path(project_id), ignore_errors=True)
+
+# Shared store, configured in create_app
+event_segments = EventSegmentStore()
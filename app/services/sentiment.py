@@ -0,0 +1,483 @@
+import atexit
+import json
+import re
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import event, func, or_, cast, update, Text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.models import db
+from app.models.event import Event
+from app.models.insights import FeedbackSentiment, SentimentCheckpoint
+from app.models.project import Project
+from app.services.event_types import event_type_cache
+from app.utils.background import background_workers_enabled
+
+POSITIVE_WORDS = (
+    'good', 'great', 'excellent', 'awesome', 'amazing', 'fantastic', 'wonderful', 'perfect', 'nice',
+    'love', 'loved', 'loves', 'loving', 'like', 'liked', 'likes', 'best', 'better', 'happy', 'glad',
+    'helpful', 'useful', 'easy', 'fast', 'intuitive', 'smooth', 'reliable', 'recommend', 'thanks', 'thank'
+)
+NEGATIVE_WORDS = (
+    'bad', 'terrible', 'awful', 'horrible', 'hate', 'hated', 'hates', 'dislike', 'disliked', 'worst', 'worse',
+    'poor', 'disappointed', 'disappointing', 'unhappy', 'broken', 'buggy', 'bug', 'bugs', 'crash', 'crashes',
+    'crashed', 'slow', 'confusing', 'useless', 'annoying', 'frustrating', 'frustrated', 'difficult', 'fails',
+    'failed', 'expensive'
+)
+NEGATORS = ('not', 'no', 'never', 'none', 'nobody', 'nothing', 'neither', 'nor', 'cannot', 'without', 'hardly', 'barely')
+# Phrases starting with a negator that do not negate ("not only good but great")
+AFFIRMATIVES = ('not only', 'not just', 'no doubt')
+# Words after a negator it still reaches ("don't think it's bad")
+NEGATION_WINDOW = 3
+
+def _alternation(words):
+    # Longest first, so a word is never cut short by one of its prefixes; phrases take any spacing
+    return '|'.join(r'\s+'.join(map(re.escape, word.split())) for word in sorted(words, key=len, reverse=True))
+
+# One pass over a text finds lexicon words, negators ("not", "don't"), the
+# punctuation or "but" that ends a negation's scope, and the other words
+TOKEN_PATTERN = re.compile(
+    rf"(?P<clause>[.,;:!?]|\bbut\b)|\b(?:(?P<affirmative>{_alternation(AFFIRMATIVES)})"
+    rf"|(?P<negator>{_alternation(NEGATORS)}|\w+n't)|(?P<positive>{_alternation(POSITIVE_WORDS)})"
+    rf"|(?P<negative>{_alternation(NEGATIVE_WORDS)})|(?P<word>\w+(?:'\w+)?))\b",
+    re.IGNORECASE
+)
+
+LABELS = ('negative', 'neutral', 'positive')
+# Scores beyond this count as positive or negative
+LABEL_THRESHOLD = 0.3
+
+# Key in Session.info marking a transaction that stored events with feedback
+_PENDING = 'sentiment_pending'
+# SentimentCheckpoint row of the background scan
+_CHECKPOINT = 'events'
+
+def _label(score):
+    if score > LABEL_THRESHOLD:
+        return 'positive'
+    if score < -LABEL_THRESHOLD:
+        return 'negative'
+    return 'neutral'
+
+class SentimentAnalyzer:
+    """
+    Scores feedback texts in batches.
+
+    By default with the lexicon: TOKEN_PATTERN finds whole words only, so
+    "unlikely" is not "like", and a negator flips the first lexicon word
+    within NEGATION_WINDOW words after it, unless punctuation or "but" ends
+    the clause first ("not great, but fast" is one negative and one positive
+    hit; in "never had a problem, love it" nothing is negated). The score is
+    (positive - negative) / hits.
+
+    When SENTIMENT_MODEL_PATH names the weights of a classifier trained with
+    `flask events train-sentiment`, texts are scored with it instead: the
+    score is P(positive) - P(negative) and the confidence the probability
+    of the predicted label.
+    """
+
+    def __init__(self):
+        self.model = None
+
+    def init_app(self, app):
+        """Load the trained model when one is configured"""
+        path = app.config.get('SENTIMENT_MODEL_PATH')
+        if not path:
+            return
+        try:
+            self.model = self.load_model(path)
+        except Exception as e:
+            app.logger.error(f"Error loading sentiment model {path}, using the lexicon: {str(e)}")
+
+    @staticmethod
+    def lexicon_score(text):
+        """(score from -1 to 1, lexicon hits) of a text"""
+        positive = negative = 0
+        # Words the last negator still reaches
+        reach = 0
+        for match in TOKEN_PATTERN.finditer(text.replace('\u2019', "'")):
+            kind = match.lastgroup
+            if kind == 'negator':
+                reach = NEGATION_WINDOW
+            elif kind == 'clause':
+                reach = 0
+            elif kind == 'word':
+                reach = max(reach - 1, 0)
+            elif kind in ('positive', 'negative'):
+                # A negator flips one lexicon word
+                if (kind == 'positive') != (reach > 0):
+                    positive += 1
+                else:
+                    negative += 1
+                reach = 0
+        hits = positive + negative
+        return ((positive - negative) / hits if hits else 0.0), hits
+
+    def score(self, texts):
+        """Sentiment, score and confidence of each text, in order"""
+        texts = [text or '' for text in texts]
+        if not texts:
+            return []
+        if self.model is not None:
+            return self._model_scores(texts)
+
+        results = []
+        for text in texts:
+            score, hits = self.lexicon_score(text)
+            results.append({
+                'sentiment': _label(score),
+                'score': round(score, 2),
+                # More matched words, more confidence; nothing matched is a guess
+                'confidence': round(min(0.5 + 0.1 * hits, 0.9), 2)
+            })
+        return results
+
+    def _model_scores(self, texts):
+        probabilities = self.model.predict_proba(texts)
+        classes = list(self.model.classes_)
+        positive = probabilities[:, classes.index('positive')] if 'positive' in classes else np.zeros(len(texts))
+        negative = probabilities[:, classes.index('negative')] if 'negative' in classes else np.zeros(len(texts))
+        best = probabilities.argmax(axis=1)
+        return [{
+            'sentiment': str(classes[index]),
+            'score': round(float(score), 2),
+            'confidence': round(float(probabilities[row, index]), 2)
+        } for row, (index, score) in enumerate(zip(best.tolist(), (positive - negative).tolist()))]
+
+    @staticmethod
+    def train(texts, labels):
+        """Fit a TF-IDF + logistic regression classifier on labelled texts"""
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.pipeline import make_pipeline
+        unknown = set(labels) - set(LABELS)
+        if unknown:
+            raise ValueError(f"Unknown sentiment labels: {', '.join(sorted(unknown))}")
+        if len(set(labels)) < 2:
+            raise ValueError("Training needs texts of at least two sentiments")
+        model = make_pipeline(
+            TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True, min_df=2),
+            LogisticRegression(max_iter=1000, class_weight='balanced')
+        )
+        return model.fit(texts, labels)
+
+    @staticmethod
+    def save_model(model, path):
+        """Write the weights of a model from train() as JSON"""
+        vectorizer, classifier = model.steps[0][1], model.steps[-1][1]
+        weights = {
+            'vectorizer': {
+                'vocabulary': {term: int(column) for term, column in vectorizer.vocabulary_.items()},
+                'idf': vectorizer.idf_.tolist(),
+                'ngram_range': list(vectorizer.ngram_range),
+                'sublinear_tf': vectorizer.sublinear_tf,
+                'lowercase': vectorizer.lowercase,
+                'token_pattern': vectorizer.token_pattern
+            },
+            'classifier': {
+                'classes': [str(label) for label in classifier.classes_],
+                'coef': classifier.coef_.tolist(),
+                'intercept': classifier.intercept_.tolist()
+            }
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(weights, f)
+
+    @staticmethod
+    def load_model(path):
+        """LinearSentimentModel from weights written by save_model"""
+        with open(path, encoding='utf-8') as f:
+            model = LinearSentimentModel(json.load(f))
+        if not set(model.classes_) <= set(LABELS):
+            raise ValueError(f"Not a sentiment classifier over {', '.join(LABELS)}")
+        return model
+
+class LinearSentimentModel:
+    """
+    The TF-IDF + logistic regression classifier of SentimentAnalyzer.train,
+    rebuilt from its JSON weights. Model files are plain data, so loading
+    one cannot run code the way unpickling can, and scoring needs numpy only.
+    """
+
+    def __init__(self, weights):
+        vectorizer, classifier = weights['vectorizer'], weights['classifier']
+        self.vocabulary = vectorizer['vocabulary']
+        self.idf = np.array(vectorizer['idf'], dtype=np.float64)
+        self.ngram_range = tuple(vectorizer['ngram_range'])
+        self.sublinear_tf = vectorizer['sublinear_tf']
+        self.lowercase = vectorizer['lowercase']
+        self.token_pattern = re.compile(vectorizer['token_pattern'])
+        self.classes_ = np.array(classifier['classes'])
+        self.coef = np.array(classifier['coef'], dtype=np.float64)
+        self.intercept = np.array(classifier['intercept'], dtype=np.float64)
+        if self.coef.shape != (len(self.intercept), len(self.idf)):
+            raise ValueError("Sentiment model weights do not match its vocabulary")
+
+    def _features(self, text):
+        """Columns and l2-normalized TF-IDF values of the text's known n-grams"""
+        tokens = self.token_pattern.findall(text.lower() if self.lowercase else text)
+        counts = {}
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for start in range(len(tokens) - n + 1):
+                column = self.vocabulary.get(' '.join(tokens[start:start + n]))
+                if column is not None:
+                    counts[column] = counts.get(column, 0) + 1
+        columns = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        if self.sublinear_tf:
+            values = 1 + np.log(values)
+        values *= self.idf[columns]
+        norm = np.linalg.norm(values)
+        return columns, (values / norm if norm else values)
+
+    def predict_proba(self, texts):
+        """Probabilities of classes_ for each text"""
+        scores = np.empty((len(texts), len(self.intercept)))
+        for row, text in enumerate(texts):
+            columns, values = self._features(text)
+            scores[row] = self.coef[:, columns] @ values + self.intercept
+        if len(self.classes_) == 2:
+            # Binary logistic regression: one decision function for classes_[1]
+            second = 1 / (1 + np.exp(-scores[:, 0]))
+            return np.column_stack([1 - second, second])
+        scores -= scores.max(axis=1, keepdims=True)
+        exponentials = np.exp(scores)
+        return exponentials / exponentials.sum(axis=1, keepdims=True)
+
+class FeedbackScorer:
+    """
+    Scores the feedback of ingested events in the background.
+
+    An event carries feedback when one of SENTIMENT_PROPERTIES (the first
+    found) is a non-empty string. A thread scans the events table by id
+    from a checkpoint, SENTIMENT_BATCH_SIZE events at a time with a LIKE
+    prefilter on the property names, scores the texts found in one batch
+    and stores them in feedback_sentiments, so analytics aggregate stored
+    scores. Ingest transactions that stored feedback wake the thread when
+    they commit; otherwise it looks every SENTIMENT_INTERVAL seconds, which
+    also picks up backfills and other workers' events.
+
+    On databases whose ids can commit out of order (concurrent writers on
+    PostgreSQL), an event committed after the scan passed its id is missed
+    until `flask events rescore-sentiment`.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.app = None
+        self.properties = ()
+        self.interval = 30.0
+        self.batch_size = 1000
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.scored = 0
+        self.failures = 0
+
+    def init_app(self, app):
+        """Read settings, hook into commits and start the scoring thread when enabled and background workers run here"""
+        self.enabled = app.config.get('SENTIMENT_ENABLED', True)
+        self.properties = tuple(
+            name.strip() for name in app.config.get('SENTIMENT_PROPERTIES', 'feedback').split(',') if name.strip()
+        )
+        self.batch_size = app.config.get('SENTIMENT_BATCH_SIZE', 1000)
+        if not self.enabled or not self.properties or not background_workers_enabled(app):
+            self.enabled = False
+            return
+
+        self.app = app
+        self.interval = app.config.get('SENTIMENT_INTERVAL', 30)
+        if not event.contains(db.session, 'after_commit', _wake_after_feedback):
+            event.listen(db.session, 'after_commit', _wake_after_feedback)
+            event.listen(db.session, 'after_rollback', _discard_feedback_flag)
+        self.start()
+        atexit.register(self.shutdown)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='feedback-scorer', daemon=True)
+        self._thread.start()
+
+    def track(self, rows):
+        """Wake the scorer once the caller's transaction commits if the prepared rows carry feedback"""
+        if self.enabled and any(self.feedback_text(row.get('properties')) for row in rows):
+            db.session.info[_PENDING] = True
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            with self.app.app_context():
+                try:
+                    self.score_new()
+                except Exception as e:
+                    db.session.rollback()
+                    self.failures += 1
+                    self.app.logger.error(f"Error scoring feedback sentiment: {str(e)}")
+                db.session.remove()
+
+    def shutdown(self, timeout=30):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def feedback_text(self, properties):
+        """(property, text) of the first feedback property set, or None"""
+        if not isinstance(properties, dict):
+            return None
+        for name in self.properties:
+            text = properties.get(name)
+            if isinstance(text, str) and text.strip():
+                return name, text
+        return None
+
+    def _events(self, after, upto, project_id=None):
+        """Events in the id range that may carry feedback, in id order"""
+        query = db.session.query(
+            Event.id, Event.project_id, Event.event_type_id, Event.timestamp, Event.properties
+        ).filter(
+            Event.id > after,
+            Event.id <= upto,
+            # Cheap prefilter on the serialized properties; feedback_text() decides
+            or_(*(cast(Event.properties, Text).like(f'%"{name}"%') for name in self.properties))
+        )
+        if project_id is not None:
+            query = query.filter(Event.project_id == project_id)
+        return query.order_by(Event.id).limit(self.batch_size).all()
+
+    def _store(self, rows):
+        """Score the feedback of event rows and store it; returns the number of texts scored"""
+        found = []
+        for row in rows:
+            feedback = self.feedback_text(row.properties)
+            if feedback:
+                found.append((row, feedback[0], feedback[1]))
+        if not found:
+            return 0
+
+        now = datetime.utcnow()
+        scores = sentiment_analyzer.score([text for _, _, text in found])
+        values = [{
+            'event_id': row.id,
+            'project_id': row.project_id,
+            'event_type_id': row.event_type_id,
+            'timestamp': row.timestamp,
+            'property': name,
+            'score': result['score'],
+            'label': result['sentiment'],
+            'confidence': result['confidence'],
+            'scored_at': now
+        } for (row, name, _), result in zip(found, scores)]
+
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'sqlite':
+            statement = sqlite_insert(FeedbackSentiment).on_conflict_do_nothing()
+        elif dialect == 'postgresql':
+            statement = postgresql_insert(FeedbackSentiment).on_conflict_do_nothing()
+        else:
+            statement = FeedbackSentiment.__table__.insert()
+        db.session.execute(statement, values)
+        # Cached sentiment analytics of these projects are stale now
+        db.session.execute(
+            update(Project).where(Project.id.in_({row.project_id for row, _, _ in found}))
+            .values(data_version=Project.data_version + 1)
+        )
+        return len(found)
+
+    def score_new(self):
+        """Score feedback in events stored since the last scan; returns the number of texts scored"""
+        upto = db.session.query(func.max(Event.id)).scalar() or 0
+        checkpoint = db.session.get(SentimentCheckpoint, _CHECKPOINT) or \
+            SentimentCheckpoint(source=_CHECKPOINT, last_event_id=0)
+        scored = 0
+        while checkpoint.last_event_id < upto:
+            rows = self._events(checkpoint.last_event_id, upto)
+            scored += self._store(rows)
+            # A short batch means nothing is left up to upto
+            checkpoint.last_event_id = rows[-1].id if len(rows) == self.batch_size else upto
+            db.session.add(checkpoint)
+            db.session.commit()
+        self.scored += scored
+        return scored
+
+    def rescore(self, project_id):
+        """Score a project's feedback again, e.g. after changing the model; returns the number of texts scored"""
+        FeedbackSentiment.query.filter_by(project_id=project_id).delete()
+        checkpoint = db.session.get(SentimentCheckpoint, _CHECKPOINT)
+        upto = checkpoint.last_event_id if checkpoint else 0
+        after = 0
+        scored = 0
+        while after < upto:
+            rows = self._events(after, upto, project_id)
+            if not rows:
+                break
+            scored += self._store(rows)
+            after = rows[-1].id
+        db.session.commit()
+        return scored
+
+    @staticmethod
+    def summary(project_id, days=30):
+        """Label counts and average score of the feedback of the last days, overall and per event"""
+        rows = db.session.query(
+            FeedbackSentiment.event_type_id,
+            FeedbackSentiment.label,
+            func.count(FeedbackSentiment.event_id),
+            func.sum(FeedbackSentiment.score)
+        ).filter(
+            FeedbackSentiment.project_id == project_id,
+            FeedbackSentiment.timestamp >= datetime.utcnow() - timedelta(days=days)
+        ).group_by(FeedbackSentiment.event_type_id, FeedbackSentiment.label).all()
+
+        label_counts = dict.fromkeys(LABELS, 0)
+        by_event = {}
+        total_score = 0.0
+        for event_type_id, label, count, score_sum in rows:
+            label_counts[label] += count
+            total_score += score_sum or 0
+            item = by_event.setdefault(event_type_id, dict.fromkeys(LABELS, 0) | {'count': 0, 'score_sum': 0.0})
+            item[label] += count
+            item['count'] += count
+            item['score_sum'] += score_sum or 0
+        scored = sum(label_counts.values())
+        names = event_type_cache.names_for(by_event)
+        return {
+            'days': days,
+            'scored': scored,
+            'average_score': round(total_score / scored, 2) if scored else 0,
+            'label_counts': label_counts,
+            'label_percentages': {
+                label: round(count / scored * 100, 1) if scored else 0 for label, count in label_counts.items()
+            },
+            'events': sorted((
+                {
+                    'event_name': names.get(event_type_id),
+                    'count': item['count'],
+                    'average_score': round(item['score_sum'] / item['count'], 2),
+                    **{label: item[label] for label in LABELS}
+                } for event_type_id, item in by_event.items()
+            ), key=lambda item: item['count'], reverse=True)
+        }
+
+def _wake_after_feedback(session):
+    if session.info.pop(_PENDING, False):
+        feedback_scorer.wake()
+
+def _discard_feedback_flag(session):
+    session.info.pop(_PENDING, None)
+
+# Shared instances, configured in create_app
+sentiment_analyzer = SentimentAnalyzer()
+feedback_scorer = FeedbackScorer()
@@ -0,0 +1,357 @@
+import atexit
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import event, select, delete, func, case
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.models import db
+from app.models.session import UserSession, OpenSession
+from app.services.event_streams import EventStream
+from app.utils.background import background_workers_enabled
+
+# Key in Session.info under which a transaction collects its event rows
+_PENDING = 'sessionize_rows'
+
+class Sessionizer:
+    """
+    Assigns events to sessions as they are ingested.
+
+    The open session of every recently active identity is kept in memory as
+    [started_at, last_seen_at, event_count, entry type, exit type]. Rows of
+    an ingest transaction are observed once it commits: an event more than
+    SESSION_TIMEOUT after the identity's last one closes the open session
+    and starts a new one. A background thread writes closed sessions to
+    `sessions`, closes sessions idle for longer than the timeout and saves
+    changed open sessions to `open_sessions`, from which a restarted process
+    continues them.
+
+    The state belongs to one process, like the ingest log; events arriving
+    more than a timeout before their session's start, sessions split across
+    workers and anonymous sessions later stitched to a user are put right by
+    rebuild() (`flask events resessionize`).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.app = None
+        self.timeout = timedelta(seconds=1800)
+        self.persist_interval = 30.0
+        self._state = {}
+        self._dirty = set()
+        self._closed = []
+        self._closed_keys = set()
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.observed = 0
+        self.late = 0
+        self.persisted = 0
+        self.persist_failures = 0
+
+    def init_app(self, app):
+        """
+        Read settings and hook into commits when enabled. The persisting thread
+        only runs where background workers are; elsewhere (e.g. `flask events
+        import`) sessions are written once at exit.
+        """
+        self.enabled = app.config.get('SESSIONIZE_ENABLED', True)
+        self.timeout = timedelta(seconds=app.config.get('SESSION_TIMEOUT', 1800))
+        if not self.enabled:
+            return
+
+        self.app = app
+        self.persist_interval = app.config.get('SESSION_PERSIST_INTERVAL', 30)
+        if not event.contains(db.session, 'after_commit', _observe_committed):
+            event.listen(db.session, 'after_commit', _observe_committed)
+            event.listen(db.session, 'after_rollback', _discard_rolled_back)
+        if background_workers_enabled(app):
+            self.start()
+        atexit.register(self.shutdown)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sessionizer', daemon=True)
+        self._thread.start()
+
+    def track(self, rows):
+        """Queue prepared event rows to be sessionized when the caller's transaction commits"""
+        if not self.enabled:
+            return
+        db.session.info.setdefault(_PENDING, []).extend(
+            (row['project_id'], row['identity'], row['timestamp'], row['event_type_id'])
+            for row in rows if row.get('identity')
+        )
+
+    def _load(self):
+        """Read the saved open sessions (caller holds self._lock)"""
+        # Own connection: this can run in after_commit, where the session cannot query
+        with db.engine.connect() as connection:
+            for row in connection.execute(select(OpenSession.__table__)):
+                self._state.setdefault((row.project_id, row.identity), [
+                    row.started_at, row.last_seen_at, row.event_count,
+                    row.entry_event_type_id, row.exit_event_type_id
+                ])
+        self._loaded = True
+
+    @staticmethod
+    def _session_row(key, session):
+        started_at, last_seen_at, count, entry, exit_type = session
+        return {
+            'project_id': key[0], 'identity': key[1], 'started_at': started_at, 'ended_at': last_seen_at,
+            'duration': int((last_seen_at - started_at).total_seconds()), 'event_count': count,
+            'entry_event_type_id': entry, 'exit_event_type_id': exit_type
+        }
+
+    def _close(self, key, session):
+        """Queue a finished session for writing (caller holds self._lock)"""
+        self._closed.append(self._session_row(key, session))
+        self._closed_keys.add(key)
+
+    def observe(self, events):
+        """Assign committed (project_id, identity, timestamp, event_type_id) tuples to sessions"""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            for project_id, identity, timestamp, event_type_id in sorted(events, key=lambda item: item[2]):
+                key = (project_id, identity)
+                session = self._state.get(key)
+                if session is None or timestamp - session[1] > self.timeout:
+                    if session is not None:
+                        self._close(key, session)
+                    self._state[key] = [timestamp, timestamp, 1, event_type_id, event_type_id]
+                elif timestamp >= session[1]:
+                    session[1] = timestamp
+                    session[2] += 1
+                    session[4] = event_type_id
+                elif timestamp >= session[0] - self.timeout:
+                    # Late, but within reach of the open session
+                    session[2] += 1
+                    if timestamp < session[0]:
+                        session[0] = timestamp
+                        session[3] = event_type_id
+                else:
+                    self.late += 1
+                    continue
+                self._dirty.add(key)
+                self.observed += 1
+
+    def _take(self, now):
+        """Close idle sessions and hand out everything to write (caller holds self._lock)"""
+        cutoff = now - self.timeout
+        for key in [key for key, session in self._state.items() if session[1] < cutoff]:
+            self._close(key, self._state.pop(key))
+            self._dirty.discard(key)
+        closed, self._closed = self._closed, []
+        closed_keys, self._closed_keys = self._closed_keys, set()
+        dirty, self._dirty = self._dirty, set()
+        open_rows = [self._open_row(key, self._state[key]) for key in dirty if key in self._state]
+        return closed, closed_keys, dirty, open_rows
+
+    @staticmethod
+    def _open_row(key, session):
+        started_at, last_seen_at, count, entry, exit_type = session
+        return {
+            'project_id': key[0], 'identity': key[1], 'started_at': started_at, 'last_seen_at': last_seen_at,
+            'event_count': count, 'entry_event_type_id': entry, 'exit_event_type_id': exit_type
+        }
+
+    @staticmethod
+    def _upsert_open(rows):
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            insert = sqlite_insert(OpenSession) if dialect == 'sqlite' else postgresql_insert(OpenSession)
+            statement = insert.on_conflict_do_update(
+                index_elements=['project_id', 'identity'],
+                set_={column: insert.excluded[column] for column in
+                      ('started_at', 'last_seen_at', 'event_count', 'entry_event_type_id', 'exit_event_type_id')}
+            )
+            db.session.execute(statement, rows)
+            return
+
+        # Other databases: read-modify-write through the session
+        for row in rows:
+            db.session.merge(OpenSession(**row))
+
+    @staticmethod
+    def _delete_open(keys):
+        table = OpenSession.__table__
+        for project_id in {project_id for project_id, _ in keys}:
+            db.session.execute(delete(table).where(
+                table.c.project_id == project_id,
+                table.c.identity.in_([identity for key_project, identity in keys if key_project == project_id])
+            ))
+
+    def persist(self, now=None):
+        """Write closed sessions and changed open sessions; returns the number of sessions closed"""
+        with self._lock:
+            if not self._loaded:
+                return 0
+            closed, closed_keys, dirty, open_rows = self._take(now or datetime.utcnow())
+        if not closed and not closed_keys and not open_rows:
+            return 0
+
+        try:
+            if closed:
+                db.session.execute(UserSession.__table__.insert(), closed)
+            if closed_keys:
+                self._delete_open(closed_keys)
+            if open_rows:
+                self._upsert_open(open_rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self.persist_failures += 1
+            # Keep everything for the next attempt
+            with self._lock:
+                self._closed[:0] = closed
+                self._closed_keys |= closed_keys
+                self._dirty |= dirty
+            raise
+        self.persisted += len(closed)
+        return len(closed)
+
+    def _run(self):
+        while not self._stop.wait(self.persist_interval):
+            self._persist_logged()
+
+    def _persist_logged(self):
+        try:
+            with self.app.app_context():
+                self.persist()
+        except Exception as e:
+            self.app.logger.error(f"Error persisting sessions: {str(e)}")
+
+    def shutdown(self, timeout=30):
+        """Stop the thread, if any, and write what is left"""
+        if not self.enabled:
+            return
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout)
+            self._thread = None
+        self._persist_logged()
+
+    def forget(self, project_id):
+        """Drop the in-memory state of a project, e.g. after it was deleted or rebuilt"""
+        with self._lock:
+            for key in [key for key in self._state if key[0] == project_id]:
+                del self._state[key]
+            self._dirty = {key for key in self._dirty if key[0] != project_id}
+            self._closed = [session for session in self._closed if session['project_id'] != project_id]
+            self._closed_keys = {key for key in self._closed_keys if key[0] != project_id}
+
+    def rebuild(self, project_id, since=None, now=None):
+        """
+        Recompute a project's sessions from raw events in one ordered pass,
+        from since (moved back to the start of the session it falls in) or
+        from the first event. Returns the number of sessions written.
+        """
+        now = now or datetime.utcnow()
+        if since is not None:
+            # Never split a session: restart from the first one still going at since
+            earliest = db.session.query(func.min(UserSession.started_at)).filter(
+                UserSession.project_id == project_id,
+                UserSession.ended_at >= since
+            ).scalar()
+            since = min(since, earliest) if earliest else since
+        since = since or datetime(1970, 1, 1)
+
+        self.forget(project_id)
+        db.session.execute(delete(UserSession.__table__).where(
+            UserSession.project_id == project_id,
+            UserSession.started_at >= since
+        ))
+        db.session.execute(delete(OpenSession.__table__).where(OpenSession.project_id == project_id))
+
+        timeout = int(self.timeout.total_seconds())
+        still_open = now - self.timeout
+        written = 0
+        open_rows = []
+        for identities, timestamps, types in EventStream.identity_chunks(project_id, since):
+            codes = EventStream.run_codes(identities)
+            first = np.ones(len(codes), dtype=bool)
+            first[1:] = (codes[1:] != codes[:-1]) | (timestamps[1:] - timestamps[:-1] > timeout)
+            starts = np.flatnonzero(first)
+            ends = np.r_[starts[1:], len(codes)] - 1
+            # The last session of each identity may still be going
+            last = np.r_[codes[1:] != codes[:-1], True][ends]
+            started_at = timestamps[starts].astype('datetime64[s]').astype(object)
+            ended_at = timestamps[ends].astype('datetime64[s]').astype(object)
+            closed = []
+            for index, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+                key = (project_id, identities[start])
+                session = [started_at[index], ended_at[index], end - start + 1, int(types[start]), int(types[end])]
+                if last[index] and ended_at[index] >= still_open:
+                    open_rows.append(self._open_row(key, session))
+                else:
+                    closed.append(self._session_row(key, session))
+            if closed:
+                db.session.execute(UserSession.__table__.insert(), closed)
+                written += len(closed)
+
+        if open_rows:
+            self._upsert_open(open_rows)
+        db.session.commit()
+        with self._lock:
+            if self._loaded:
+                for row in open_rows:
+                    self._state[(project_id, row['identity'])] = [
+                        row['started_at'], row['last_seen_at'], row['event_count'],
+                        row['entry_event_type_id'], row['exit_event_type_id']
+                    ]
+        return written + len(open_rows)
+
+    @staticmethod
+    def metrics(project_id, days=30):
+        """Session count, average length, events per session and bounce rate of sessions started in the last days"""
+        since = datetime.utcnow() - timedelta(days=days)
+        sessions, events, duration, bounces = db.session.query(
+            func.count(UserSession.id),
+            func.coalesce(func.sum(UserSession.event_count), 0),
+            func.coalesce(func.sum(UserSession.duration), 0),
+            func.coalesce(func.sum(case((UserSession.event_count == 1, 1), else_=0)), 0)
+        ).filter(
+            UserSession.project_id == project_id,
+            UserSession.started_at >= since
+        ).one()
+        open_sessions = db.session.query(func.count()).select_from(OpenSession).filter(
+            OpenSession.project_id == project_id
+        ).scalar()
+        return {
+            'days': days,
+            'sessions': sessions,
+            'open_sessions': open_sessions,
+            'avg_duration_seconds': round(duration / sessions) if sessions else 0,
+            'events_per_session': round(events / sessions, 1) if sessions else 0,
+            'bounce_rate': round(bounces / sessions * 100, 1) if sessions else 0
+        }
+
+    def stats(self):
+        """Open sessions in memory and sessionizing counters for monitoring"""
+        return {
+            'enabled': self.enabled,
+            'open_sessions': len(self._state),
+            'pending_sessions': len(self._closed),
+            'observed': self.observed,
+            'late': self.late,
+            'persisted': self.persisted,
+            'persist_failures': self.persist_failures
+        }
+
+# Shared instance, configured in create_app
+sessionizer = Sessionizer()
+
+def _observe_committed(session):
+    events = session.info.pop(_PENDING, None)
+    if events:
+        try:
+            sessionizer.observe(events)
+        except Exception as e:
+            sessionizer.app.logger.error(f"Error sessionizing {len(events)} events: {str(e)}")
+
+def _discard_rolled_back(session):
+    session.info.pop(_PENDING, None)
@@ -0,0 +1,212 @@
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import event, func, tuple_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.models import db
+from app.models.event import Event
+from app.models.rollup import IdentitySketch
+from app.services.rollups import RollupService
+from app.services.segments import event_segments, EventSegmentStore
+from app.utils.cache import LRUCache
+from app.utils.hll import HyperLogLog
+
+# Key in Session.info under which a transaction collects the sketches it stored
+_PENDING = 'identity_sketches'
+
+class IdentitySketchService:
+    """
+    Hourly and daily HyperLogLog sketches of the identities active in a project.
+
+    Sketches are merged into at ingest, in the events' transaction. Distinct
+    counts for any window then come from merging the day and hour sketches
+    that tile it, plus the few raw events in sub-hour remnants at the edges.
+
+    Registers only ever grow, so a sketch this process saw committed is a
+    lower bound of the stored one. Those are cached for a short ttl, and
+    events whose identities change none of their registers (most of them,
+    as buckets fill up) skip the read and rewrite of the stored sketch.
+    Sketches stored at another HLL_PRECISION are folded to the coarser one
+    when merged into.
+    """
+
+    _committed = LRUCache(maxsize=10000, ttl=300)
+    skipped = 0
+
+    @classmethod
+    def init_app(cls, app):
+        """Size the committed sketch cache and hook into commits"""
+        cls._committed = LRUCache(maxsize=app.config.get('HLL_COMMITTED_CACHE_SIZE', 10000),
+                                  ttl=app.config.get('HLL_COMMITTED_CACHE_TTL', 300))
+        cls.skipped = 0
+        if not event.contains(db.session, 'after_commit', _remember_committed):
+            event.listen(db.session, 'after_commit', _remember_committed)
+            event.listen(db.session, 'after_rollback', _discard_rolled_back)
+
+    @staticmethod
+    def precision():
+        return current_app.config.get('HLL_PRECISION', 12)
+
+    @staticmethod
+    def _stored(sketches):
+        """Note sketches as stored by the current transaction, to be cached once it commits"""
+        db.session.info.setdefault(_PENDING, {}).update(sketches)
+
+    @staticmethod
+    def _insert_statement():
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'sqlite':
+            return sqlite_insert(IdentitySketch).on_conflict_do_nothing()
+        if dialect == 'postgresql':
+            return postgresql_insert(IdentitySketch).on_conflict_do_nothing()
+        return None
+
+    @classmethod
+    def _merge_into_stored(cls, sketches):
+        """Merge {(project_id, granularity, bucket): HyperLogLog} into the stored sketches"""
+        keys = list(sketches)
+        stored = db.session.query(IdentitySketch).filter(
+            tuple_(IdentitySketch.project_id, IdentitySketch.granularity, IdentitySketch.bucket).in_(keys)
+        ).with_for_update().all()
+
+        for sketch in stored:
+            key = (sketch.project_id, sketch.granularity, sketch.bucket)
+            merged = HyperLogLog.from_bytes(sketch.registers)
+            # Most events come from identities the bucket has already seen
+            if merged.merge(sketches.pop(key)):
+                sketch.registers = merged.to_bytes()
+            cls._stored({key: merged})
+        return sketches
+
+    @classmethod
+    def add(cls, rows):
+        """
+        Add the identities of prepared event rows to their hour and day sketches.
+        Runs in the caller's transaction, without committing.
+        """
+        identities = defaultdict(set)
+        for row in rows:
+            if row.get('identity'):
+                for granularity in ('hour', 'day'):
+                    bucket = RollupService.floor_bucket(row['timestamp'], granularity)
+                    identities[(row['project_id'], granularity, bucket)].add(row['identity'])
+        if not identities:
+            return
+
+        p = cls.precision()
+        sketches = {}
+        for key, values in identities.items():
+            sketch = HyperLogLog(p)
+            sketch.update(values)
+            committed = cls._committed.get(key)
+            if committed is not None and committed.covers(sketch):
+                cls.skipped += 1
+                continue
+            sketches[key] = sketch
+        if not sketches:
+            return
+
+        new = cls._merge_into_stored(sketches)
+        if not new:
+            return
+        cls._stored(new)
+        statement = cls._insert_statement()
+        if statement is None:
+            for (project_id, granularity, bucket), sketch in new.items():
+                db.session.add(IdentitySketch(project_id=project_id, granularity=granularity,
+                                              bucket=bucket, registers=sketch.to_bytes()))
+            return
+        db.session.execute(statement, [
+            {'project_id': project_id, 'granularity': granularity, 'bucket': bucket, 'registers': sketch.to_bytes()}
+            for (project_id, granularity, bucket), sketch in new.items()
+        ])
+        # A concurrent transaction may have created some of them first
+        cls._merge_into_stored(new)
+
+    @classmethod
+    def window_sketch(cls, project_id, start, end):
+        """Merged sketch of the identities active in [start, end), at the coarsest precision stored"""
+        result = HyperLogLog(cls.precision())
+        for granularity, piece_start, piece_end in RollupService.split_range(start, end):
+            if granularity is None:
+                identities = db.session.query(Event.identity).filter(
+                    Event.project_id == project_id,
+                    Event.timestamp >= piece_start,
+                    Event.timestamp < piece_end,
+                    Event.identity.isnot(None)
+                ).distinct()
+                result.update(identity for identity, in identities)
+                continue
+            stored = db.session.query(IdentitySketch.registers).filter(
+                IdentitySketch.project_id == project_id,
+                IdentitySketch.granularity == granularity,
+                IdentitySketch.bucket >= piece_start,
+                IdentitySketch.bucket < piece_end
+            )
+            for registers, in stored:
+                result.merge(HyperLogLog.from_bytes(registers))
+        return result
+
+    @staticmethod
+    def exact_count(project_id, start, end):
+        """
+        COUNT(DISTINCT identity) over [start, end), served by the covering index.
+        Closed days with a fresh segment contribute their stored identity lists instead.
+        """
+        filters = [Event.project_id == project_id, Event.timestamp >= start, Event.timestamp < end]
+        days = event_segments.fresh_days(project_id, start, end)
+        if not days:
+            return db.session.query(func.count(func.distinct(Event.identity))).filter(*filters).scalar() or 0
+
+        identities = set()
+        for day in days:
+            identities.update(event_segments.identities(project_id, day))
+        rows = db.session.query(Event.identity).filter(
+            *filters, Event.identity.isnot(None), EventSegmentStore.excluding(Event.timestamp, days)
+        ).distinct()
+        identities.update(identity for identity, in rows)
+        return len(identities)
+
+    @classmethod
+    def rebuild(cls, project_id=None, batch_size=10000):
+        """Recompute the sketches from raw events; returns the number of events read"""
+        query = IdentitySketch.query
+        if project_id is not None:
+            query = query.filter(IdentitySketch.project_id == project_id)
+        query.delete(synchronize_session=False)
+        cls._committed.clear()
+
+        events = db.session.query(Event.project_id, Event.identity, Event.timestamp)
+        if project_id is not None:
+            events = events.filter(Event.project_id == project_id)
+        events = events.execution_options(yield_per=batch_size)
+
+        total = 0
+        batch = []
+        for event in events:
+            batch.append(event._asdict())
+            if len(batch) >= batch_size:
+                cls.add(batch)
+                total += len(batch)
+                batch = []
+        cls.add(batch)
+        total += len(batch)
+
+        db.session.commit()
+        return total
+
+    @classmethod
+    def stats(cls):
+        """Return committed sketch cache counters for monitoring"""
+        stats = cls._committed.stats()
+        stats['skipped'] = cls.skipped
+        return stats
+
+def _remember_committed(session):
+    sketches = session.info.pop(_PENDING, None)
+    if sketches:
+        for key, sketch in sketches.items():
+            IdentitySketchService._committed.set(key, sketch)
+
+def _discard_rolled_back(session):
+    session.info.pop(_PENDING, None)
@@ -0,0 +1,171 @@
+from datetime import timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import numpy as np
+from sqlalchemy import func, cast, extract, or_, and_, union_all, select, BigInteger, Integer
+from app.models import db
+from app.models.event import Event
+from app.models.rollup import EventRollupHourly
+from app.services.segments import event_segments, EventSegmentStore
+
+GRANULARITY_STEPS = {
+    'minute': timedelta(minutes=1),
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+}
+
+LABEL_FORMATS = {
+    'minute': '%Y-%m-%d %H:%M',
+    'hour': '%Y-%m-%d %H:00',
+    'day': '%Y-%m-%d',
+    'week': '%Y-%m-%d',
+}
+
+class TimeBucketer:
+    """
+    Dense time series of event counts in any IANA timezone.
+
+    Bucket boundaries are computed in Python (local midnight, Monday weeks,
+    DST-length days) and converted to the naive UTC stored in the database.
+    Counts are fetched with a single query that filters on plain timestamp
+    ranges and groups by integer epoch slots; whole UTC hours are read from
+    the hourly rollup, and when the buckets are not hour-aligned (minutes,
+    or zones with sub-hour offsets) closed days are read from their event
+    segments. Slots are then mapped onto the buckets with searchsorted, so
+    empty buckets come back as zeros.
+    """
+
+    @staticmethod
+    def get_timezone(name):
+        """ZoneInfo for an IANA name; raises ValueError for unknown zones"""
+        try:
+            return ZoneInfo(name or 'UTC')
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown timezone: {name}")
+
+    @staticmethod
+    def to_local(utc_naive, tz):
+        return utc_naive.replace(tzinfo=timezone.utc).astimezone(tz).replace(tzinfo=None)
+
+    @staticmethod
+    def to_utc(local_naive, tz):
+        return local_naive.replace(tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+
+    @staticmethod
+    def floor_local(local, granularity):
+        """Start of the local (wall clock) bucket containing local"""
+        if granularity == 'minute':
+            return local.replace(second=0, microsecond=0)
+        if granularity == 'hour':
+            return local.replace(minute=0, second=0, microsecond=0)
+        day = local.replace(hour=0, minute=0, second=0, microsecond=0)
+        if granularity == 'week':
+            day -= timedelta(days=day.weekday())
+        return day
+
+    @classmethod
+    def boundaries(cls, start, end, granularity, tz):
+        """
+        Naive UTC start times of the buckets overlapping [start, end), the first one
+        aligned to a local bucket boundary at or before start
+        """
+        if granularity not in GRANULARITY_STEPS:
+            raise ValueError(f"Unknown granularity: {granularity}")
+        step = GRANULARITY_STEPS[granularity]
+        first = cls.floor_local(cls.to_local(start, tz), granularity)
+
+        bounds = []
+        if granularity in ('minute', 'hour'):
+            # Fixed width in absolute time, so DST changes neither skip nor repeat a bucket
+            current = cls.to_utc(first, tz)
+            while current < end:
+                bounds.append(current)
+                current += step
+        else:
+            # Days and weeks follow the wall clock and can be 23 or 25 hours long
+            local = first
+            while True:
+                current = cls.to_utc(local, tz)
+                if current >= end:
+                    break
+                bounds.append(current)
+                local += step
+        return bounds
+
+    @staticmethod
+    def labels(bounds, granularity, tz):
+        return [TimeBucketer.to_local(bound, tz).strftime(LABEL_FORMATS[granularity]) for bound in bounds]
+
+    @staticmethod
+    def _epoch(column):
+        """Integer seconds since 1970-01-01 of a naive UTC datetime column"""
+        if db.session.get_bind().dialect.name == 'sqlite':
+            return cast(func.strftime('%s', column), Integer)
+        return cast(extract('epoch', column), BigInteger)
+
+    @classmethod
+    def counts(cls, project_id, bounds, end, event_type_id=None):
+        """Event counts for each bucket starting at bounds, the last one ending at end"""
+        if not bounds:
+            return []
+        start = bounds[0]
+        hour_aligned = all(bound.minute == 0 and bound.second == 0 and bound.microsecond == 0 for bound in bounds)
+        slot_width = 3600 if hour_aligned else 60
+
+        raw_filters = [Event.project_id == project_id]
+        if event_type_id is not None:
+            raw_filters.append(Event.event_type_id == event_type_id)
+        raw_slot = cls._epoch(Event.timestamp) // slot_width * slot_width
+
+        queries = []
+        days = []
+        if hour_aligned:
+            # Whole hours from the rollup, the unfinished hour (and any sub-hour remnant) from raw events
+            first_hour = start.replace(minute=0, second=0, microsecond=0)
+            last_hour = end.replace(minute=0, second=0, microsecond=0)
+            rollup_filters = [
+                EventRollupHourly.project_id == project_id,
+                EventRollupHourly.bucket >= first_hour,
+                EventRollupHourly.bucket < last_hour
+            ]
+            if event_type_id is not None:
+                rollup_filters.append(EventRollupHourly.event_type_id == event_type_id)
+            queries.append(
+                select(cls._epoch(EventRollupHourly.bucket).label('slot'), func.sum(EventRollupHourly.count).label('count'))
+                .where(*rollup_filters)
+                .group_by(EventRollupHourly.bucket)
+            )
+            raw_filters.append(or_(
+                and_(Event.timestamp >= start, Event.timestamp < min(first_hour, end)),
+                and_(Event.timestamp >= max(last_hour, start), Event.timestamp < end)
+            ))
+        else:
+            raw_filters.extend([Event.timestamp >= start, Event.timestamp < end])
+            # The rollup cannot split hours, so closed days come from their columnar segments
+            days = event_segments.fresh_days(project_id, start, end)
+            skip = EventSegmentStore.excluding(Event.timestamp, days)
+            if skip is not None:
+                raw_filters.append(skip)
+        queries.append(
+            select(raw_slot.label('slot'), func.count(Event.id).label('count'))
+            .where(*raw_filters)
+            .group_by(raw_slot)
+        )
+
+        statement = union_all(*queries) if len(queries) > 1 else queries[0]
+        rows = db.session.execute(statement).all()
+
+        slots = np.array([row.slot for row in rows], dtype=np.int64)
+        slot_counts = np.array([row.count for row in rows], dtype=np.int64)
+        if days:
+            scan = event_segments.scan(project_id, days, None if event_type_id is None else [event_type_id])
+            slots = np.concatenate([slots, scan.timestamp])
+            slot_counts = np.concatenate([slot_counts, np.ones(len(scan), dtype=np.int64)])
+
+        dense = np.zeros(len(bounds), dtype=np.int64)
+        if len(slots):
+            bound_epochs = np.array(bounds, dtype='datetime64[s]').astype(np.int64)
+            index = np.searchsorted(bound_epochs, slots, side='right') - 1
+            inside = index >= 0
+            dense += np.bincount(index[inside], weights=slot_counts[inside], minlength=len(bounds)).astype(np.int64)
+        return dense.tolist()
@@ -229,6 +229,7 @@
                 timestamp: new Date().toISOString(),
                 url: window.location.href,
                 visitor: this.visitor,
+                message_id: this.generateId(), // Lets the server drop retried duplicates
                 data
             };
             
@@ -0,0 +1,12 @@
+import click
+
+def background_workers_enabled(app):
+    """
+    Whether this process should run background threads: BACKGROUND_WORKERS_ENABLED
+    is set and the app is not being loaded for a `flask` CLI command other than
+    `flask run` (db upgrade, events import, ...)
+    """
+    if not app.config.get('BACKGROUND_WORKERS_ENABLED', True):
+        return False
+    context = click.get_current_context(silent=True)
+    return context is None or context.command.name == 'run'
@@ -0,0 +1,74 @@
+import hashlib
+import math
+import threading
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings.
+    might_contain() never returns a false negative; the false positive rate
+    stays near error_rate until more than `capacity` keys have been added.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def _positions(self, key):
+        # Kirsch-Mitzenmacher double hashing: k positions from one 128-bit digest
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        positions = self._positions(key)
+        with self._lock:
+            for position in positions:
+                self._bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def might_contain(self, key):
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def is_full(self):
+        return self.count >= self.capacity
+
+class RotatingBloomFilter:
+    """
+    Two-generation Bloom filter: when the current filter reaches capacity it
+    becomes the previous one and a fresh filter takes over, so memory and the
+    false positive rate stay bounded while recent keys are always remembered.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous = None
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        with self._lock:
+            if self._current.is_full():
+                self._previous = self._current
+                self._current = BloomFilter(self.capacity, self.error_rate)
+            current = self._current
+        current.add(key)
+
+    def might_contain(self, key):
+        if self._current.might_contain(key):
+            return True
+        previous = self._previous
+        return previous is not None and previous.might_contain(key)
+
+    def memory_bytes(self):
+        total = len(self._current._bits)
+        if self._previous is not None:
+            total += len(self._previous._bits)
+        return total
@@ -0,0 +1,180 @@
+import functools
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from app.utils.cache import LRUCache
+
+class MemoryCacheBackend:
+    """Per-process backend on top of LRUCache"""
+
+    def __init__(self, maxsize=1000):
+        self._cache = LRUCache(maxsize=maxsize)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value, ttl):
+        self._cache.set(key, value, ttl=ttl)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+class SQLiteCacheBackend:
+    """
+    Backend in a local SQLite file, shared by all worker processes on the host.
+    When full, the oldest written entries are evicted first.
+    """
+
+    def __init__(self, path, maxsize=1000):
+        self.path = path
+        self.maxsize = maxsize
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS query_cache '
+                '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL, stored_at REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_query_cache_stored_at ON query_cache (stored_at)')
+
+    def _connect(self):
+        # One connection per thread; sqlite3 connections cannot be shared across threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT value FROM query_cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (key, time.time())
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO query_cache (key, value, expires_at, stored_at) VALUES (?, ?, ?, ?)',
+                (key, value, now + ttl if ttl is not None else None, now)
+            )
+            excess = connection.execute('SELECT COUNT(*) FROM query_cache').fetchone()[0] - self.maxsize
+            if excess > 0:
+                connection.execute(
+                    'DELETE FROM query_cache WHERE key IN '
+                    '(SELECT key FROM query_cache ORDER BY stored_at LIMIT ?)',
+                    (excess,)
+                )
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM query_cache')
+
+    def stats(self):
+        size = self._connect().execute('SELECT COUNT(*) FROM query_cache').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'size': size,
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0
+        }
+
+class QueryCache:
+    """
+    Result cache for per-project query functions.
+
+    Entries are keyed by function, arguments and the project's current data
+    version, so new data makes old entries unreachable at once; the ttl only
+    bounds how stale results over "the last N hours" windows may get.
+    Concurrent misses for the same key in one process compute it once.
+    """
+
+    def __init__(self, version_func, backend=None, ttl=60):
+        self.version_func = version_func
+        self.backend = backend
+        self.ttl = ttl
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Pick the backend from ANALYTICS_CACHE_BACKEND ('memory', 'sqlite' or 'none')"""
+        backend = app.config.get('ANALYTICS_CACHE_BACKEND', 'memory')
+        maxsize = app.config.get('ANALYTICS_CACHE_SIZE', 1000)
+        self.ttl = app.config.get('ANALYTICS_CACHE_TTL', 60)
+        if backend == 'sqlite':
+            self.backend = SQLiteCacheBackend(app.config['ANALYTICS_CACHE_PATH'], maxsize)
+        elif backend == 'memory':
+            self.backend = MemoryCacheBackend(maxsize)
+        else:
+            self.backend = None
+
+    @staticmethod
+    def make_key(name, project_id, version, args, kwargs):
+        raw = repr((name, project_id, version, args, sorted(kwargs.items())))
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def cached(self, func):
+        """Decorator for functions taking the project id as first argument"""
+        name = f'{func.__module__}.{func.__qualname__}'
+
+        @functools.wraps(func)
+        def wrapper(project_id, *args, **kwargs):
+            backend = self.backend
+            if backend is None:
+                return func(project_id, *args, **kwargs)
+
+            key = self.make_key(name, project_id, self.version_func(project_id), args, kwargs)
+            value = backend.get(key)
+            if value is not None:
+                return pickle.loads(value)
+
+            # Single flight: one thread computes, the others wait and read its result
+            with self._lock:
+                lock = self._inflight.setdefault(key, threading.Lock())
+            waited = not lock.acquire(blocking=False)
+            if waited:
+                lock.acquire()
+            try:
+                value = backend.get(key) if waited else None
+                if value is None:
+                    result = func(project_id, *args, **kwargs)
+                    value = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+                    backend.set(key, value, self.ttl)
+            finally:
+                lock.release()
+                with self._lock:
+                    if self._inflight.get(key) is lock:
+                        del self._inflight[key]
+            # Every caller gets its own copy
+            return pickle.loads(value)
+
+        return wrapper
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        if self.backend is None:
+            return {'enabled': False}
+        stats = self.backend.stats()
+        stats['enabled'] = True
+        stats['backend'] = type(self.backend).__name__
+        return stats
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds a key whose rate is 0 (blocked) is told to wait before trying again
+BLOCKED_RETRY_AFTER = 60.0
+
+class TokenBucket:
+    """Classic token bucket: refills at `rate` tokens per second up to `burst`"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def consume(self, count=1):
+        """
+        Take count tokens if available; returns seconds to wait otherwise (0 on
+        success, BLOCKED_RETRY_AFTER when the bucket never refills), or inf when
+        count is larger than the bucket can ever hold
+        """
+        if count > self.burst:
+            return float('inf')
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= count:
+            self.tokens -= count
+            return 0
+        if self.rate <= 0:
+            return BLOCKED_RETRY_AFTER
+        return (count - self.tokens) / self.rate
+
+class RateLimiter:
+    """
+    Per-key token buckets kept in a bounded LRU, with per-key overrides of the
+    default rate and burst, plus accepted/limited counters per key.
+    """
+
+    def __init__(self, rate=100.0, burst=500, overrides=None, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.overrides = overrides or {}
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            limits = self.overrides.get(key, {})
+            bucket = TokenBucket(float(limits.get('rate', self.rate)), float(limits.get('burst', self.burst)))
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _counter(self, key):
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters[key] = {'accepted': 0, 'rate_limited': 0, 'shed': 0}
+            if len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+        return counter
+
+    def burst_for(self, key):
+        """Most tokens key can take at once"""
+        return float(self.overrides.get(key, {}).get('burst', self.burst))
+
+    def acquire(self, key, count=1):
+        """Consume count tokens for key; returns the retry delay in seconds, 0 when allowed"""
+        with self._lock:
+            wait = self._bucket(key).consume(count)
+            counter = self._counter(key)
+            if wait:
+                counter['rate_limited'] += count
+            else:
+                counter['accepted'] += count
+            return wait
+
+    def record_shed(self, key, count=1):
+        """Count events for key that were dropped by load shedding"""
+        with self._lock:
+            counter = self._counter(key)
+            counter['shed'] += count
+            # They were counted as accepted by the bucket already
+            counter['accepted'] -= count
+
+    def counters(self, keys=None):
+        """Return per-key counters, optionally only for the given keys"""
+        with self._lock:
+            if keys is None:
+                return {key: dict(counter) for key, counter in self._counters.items()}
+            return {key: dict(self._counters[key]) for key in keys if key in self._counters}
@@ -0,0 +1,61 @@
+import heapq
+
+class SpaceSaving:
+    """
+    Approximate top-K counter for weighted keys (Space-Saving), in memory
+    bounded by capacity.
+
+    While fewer than capacity keys were seen the counts are exact. After
+    that, a new key replaces the smallest monitored one and inherits its
+    count, which is recorded as the new key's maximum overestimate. Any key
+    whose true count exceeds total / capacity is always monitored.
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}
+        self.errors = {}
+        # (count, key) entries; entries whose count is outdated are skipped when popped
+        self._heap = []
+
+    def add(self, key, count=1):
+        self.total += count
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = 0
+        else:
+            floor, evicted = self._pop_min()
+            del self.counts[evicted]
+            del self.errors[evicted]
+            self.counts[key] = floor + count
+            self.errors[key] = floor
+        heapq.heappush(self._heap, (self.counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(value, monitored) for monitored, value in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def update(self, items):
+        """Add (key, count) pairs"""
+        for key, count in items:
+            self.add(key, count)
+
+    def _pop_min(self):
+        while True:
+            count, key = heapq.heappop(self._heap)
+            if self.counts.get(key) == count:
+                return count, key
+
+    def top(self, n=None, where=None):
+        """[(key, count, error)] by descending count, optionally only keys matching where(key)"""
+        items = [
+            (key, count, self.errors[key]) for key, count in self.counts.items()
+            if where is None or where(key)
+        ]
+        items.sort(key=lambda item: item[1], reverse=True)
+        return items if n is None else items[:n]
+
+    def __len__(self):
+        return len(self.counts)
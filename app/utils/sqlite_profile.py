@@ -0,0 +1,94 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# Config key -> PRAGMA name, in the order they are applied
+PRAGMA_SETTINGS = [
+    ('SQLITE_BUSY_TIMEOUT', 'busy_timeout'),
+    ('SQLITE_JOURNAL_MODE', 'journal_mode'),
+    ('SQLITE_SYNCHRONOUS', 'synchronous'),
+    ('SQLITE_CACHE_SIZE', 'cache_size'),
+    ('SQLITE_MMAP_SIZE', 'mmap_size'),
+    ('SQLITE_TEMP_STORE', 'temp_store'),
+]
+
+# PRAGMA synchronous / temp_store report numbers, map them back for readable logs
+_SYNCHRONOUS_NAMES = {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'}
+_TEMP_STORE_NAMES = {0: 'DEFAULT', 1: 'FILE', 2: 'MEMORY'}
+
+def sqlite_pragmas(config):
+    """Return the (pragma, value) pairs configured for SQLite connections"""
+    pragmas = []
+    for key, pragma in PRAGMA_SETTINGS:
+        value = config.get(key)
+        if value is not None and value != '':
+            pragmas.append((pragma, value))
+    return pragmas
+
+def pool_options(config):
+    """
+    Engine pool_size / max_overflow / pool_timeout from the config, or nothing
+    for in-memory SQLite, whose single shared connection takes no pool options
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite' and (
+            url.database in (None, '', ':memory:') or url.database.startswith('file::memory:')
+            or url.query.get('mode') == 'memory'):
+        return {}
+    return {
+        'pool_size': config.get('SQLALCHEMY_POOL_SIZE', 10),
+        'max_overflow': config.get('SQLALCHEMY_MAX_OVERFLOW', 20),
+        'pool_timeout': config.get('SQLALCHEMY_POOL_TIMEOUT', 30)
+    }
+
+def configure_sqlite(app, engine):
+    """
+    Apply the SQLite performance profile to every new DBAPI connection of the
+    engine and log the pragmas that are actually in effect.
+    Does nothing for other databases.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = sqlite_pragmas(app.config)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas:
+            cursor.execute(f'PRAGMA {pragma}={value}')
+        cursor.close()
+
+    log_effective_pragmas(app, engine)
+
+def read_pragmas(engine):
+    """Read back the current value of every profile pragma from a pooled connection"""
+    effective = {}
+    with engine.connect() as connection:
+        cursor = connection.connection.cursor()
+        for _, pragma in PRAGMA_SETTINGS:
+            cursor.execute(f'PRAGMA {pragma}')
+            row = cursor.fetchone()
+            effective[pragma] = row[0] if row else None
+        cursor.close()
+
+    if effective.get('synchronous') in _SYNCHRONOUS_NAMES:
+        effective['synchronous'] = _SYNCHRONOUS_NAMES[effective['synchronous']]
+    if effective.get('temp_store') in _TEMP_STORE_NAMES:
+        effective['temp_store'] = _TEMP_STORE_NAMES[effective['temp_store']]
+    return effective
+
+def log_effective_pragmas(app, engine):
+    """Startup check: log the effective pragmas and warn about any that did not take"""
+    try:
+        effective = read_pragmas(engine)
+    except Exception as e:
+        app.logger.warning(f"Could not read SQLite pragmas: {str(e)}")
+        return
+
+    app.logger.info("SQLite pragmas: " + ', '.join(f"{name}={value}" for name, value in effective.items()))
+
+    for pragma, wanted in sqlite_pragmas(app.config):
+        actual = effective.get(pragma)
+        if str(actual).lower() != str(wanted).lower():
+            # e.g. WAL is refused for in-memory databases and some network filesystems
+            app.logger.warning(f"SQLite PRAGMA {pragma} is {actual}, expected {wanted}")
@@ -0,0 +1,28 @@
+"""add event message_id
+
+Revision ID: 1a51a28a8bf9
+Revises: d58f081e7033
+Create Date: 2026-10-18 10:03:27.540118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a51a28a8bf9'
+down_revision = 'd58f081e7033'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('message_id', sa.String(length=64), nullable=True))
+        batch_op.create_index('ix_events_project_message_id', ['project_id', 'message_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.drop_index('ix_events_project_message_id')
+        batch_op.drop_column('message_id')
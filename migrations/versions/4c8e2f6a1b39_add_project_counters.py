@@ -0,0 +1,48 @@
+"""add project event and user counters
+
+Revision ID: 4c8e2f6a1b39
+Revises: e1a9c7b3d256
+Create Date: 2026-10-18 14:02:37.481205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c8e2f6a1b39'
+down_revision = 'e1a9c7b3d256'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('project_users',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.String(length=64), nullable=False),
+    sa.Column('first_seen_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.PrimaryKeyConstraint('project_id', 'user_id')
+    )
+    with op.batch_alter_table('projects', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('event_count', sa.BigInteger(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('active_users_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill from existing events
+    op.execute(
+        'INSERT INTO project_users (project_id, user_id, first_seen_at) '
+        'SELECT project_id, user_id, MIN(timestamp) FROM events '
+        'WHERE user_id IS NOT NULL GROUP BY project_id, user_id'
+    )
+    op.execute(
+        'UPDATE projects SET '
+        'event_count = (SELECT COUNT(*) FROM events WHERE events.project_id = projects.id), '
+        'active_users_count = (SELECT COUNT(*) FROM project_users WHERE project_users.project_id = projects.id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('projects', schema=None) as batch_op:
+        batch_op.drop_column('active_users_count')
+        batch_op.drop_column('event_count')
+    op.drop_table('project_users')
@@ -0,0 +1,58 @@
+"""add canonical event identity and identity aliases
+
+Revision ID: 5e2b7a9c41d0
+Revises: c0d43d1e64c4
+Create Date: 2026-10-18 11:32:15.208411
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2b7a9c41d0'
+down_revision = 'c0d43d1e64c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('identity_aliases',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('anonymous_id', sa.String(length=64), nullable=False),
+    sa.Column('user_id', sa.String(length=64), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.PrimaryKeyConstraint('project_id', 'anonymous_id')
+    )
+
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('identity', sa.String(length=64), nullable=True))
+
+    # Stitch existing data: each anonymous_id goes to the first user_id it was seen with
+    op.execute(
+        'INSERT INTO identity_aliases (project_id, anonymous_id, user_id, created_at) '
+        'SELECT e.project_id, e.anonymous_id, '
+        '(SELECT f.user_id FROM events f WHERE f.project_id = e.project_id AND f.anonymous_id = e.anonymous_id '
+        'AND f.user_id IS NOT NULL ORDER BY f.timestamp, f.id LIMIT 1), MIN(e.timestamp) '
+        'FROM events e WHERE e.user_id IS NOT NULL AND e.anonymous_id IS NOT NULL '
+        'GROUP BY e.project_id, e.anonymous_id'
+    )
+    op.execute(
+        'UPDATE events SET identity = COALESCE(user_id, '
+        '(SELECT a.user_id FROM identity_aliases a WHERE a.project_id = events.project_id '
+        'AND a.anonymous_id = events.anonymous_id), anonymous_id)'
+    )
+
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.create_index('ix_events_project_identity_timestamp', ['project_id', 'identity', 'timestamp'], unique=False)
+        batch_op.create_index('ix_events_project_timestamp_identity', ['project_id', 'timestamp', 'identity'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.drop_index('ix_events_project_timestamp_identity')
+        batch_op.drop_index('ix_events_project_identity_timestamp')
+        batch_op.drop_column('identity')
+
+    op.drop_table('identity_aliases')
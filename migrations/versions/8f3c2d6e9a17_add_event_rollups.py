@@ -0,0 +1,48 @@
+"""add hourly and daily event rollups
+
+Revision ID: 8f3c2d6e9a17
+Revises: 5e2b7a9c41d0
+Create Date: 2026-10-18 12:06:41.733902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f3c2d6e9a17'
+down_revision = '5e2b7a9c41d0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table_name in ('event_rollups_hourly', 'event_rollups_daily'):
+        op.create_table(table_name,
+        sa.Column('project_id', sa.Integer(), nullable=False),
+        sa.Column('event_type_id', sa.Integer(), nullable=False),
+        sa.Column('bucket', sa.DateTime(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['event_type_id'], ['event_types.id'], ),
+        sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+        sa.PrimaryKeyConstraint('project_id', 'event_type_id', 'bucket')
+        )
+
+    # Count existing events; buckets must match the DateTime format SQLAlchemy stores
+    if op.get_bind().dialect.name == 'sqlite':
+        hour = "strftime('%Y-%m-%d %H:00:00.000000', timestamp)"
+        day = "strftime('%Y-%m-%d 00:00:00.000000', timestamp)"
+    else:
+        hour = "date_trunc('hour', timestamp)"
+        day = "date_trunc('day', timestamp)"
+    for table_name, bucket in (('event_rollups_hourly', hour), ('event_rollups_daily', day)):
+        op.execute(
+            f'INSERT INTO {table_name} (project_id, event_type_id, bucket, count) '
+            f'SELECT project_id, event_type_id, {bucket}, COUNT(*) FROM events '
+            f'GROUP BY project_id, event_type_id, {bucket}'
+        )
+
+
+def downgrade():
+    op.drop_table('event_rollups_daily')
+    op.drop_table('event_rollups_hourly')
@@ -0,0 +1,61 @@
+"""add sessions and open sessions
+
+Revision ID: 9d2f4b8e6c17
+Revises: 4c8e2f6a1b39
+Create Date: 2026-10-18 16:45:12.306418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2f4b8e6c17'
+down_revision = '4c8e2f6a1b39'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sessions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('identity', sa.String(length=64), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('ended_at', sa.DateTime(), nullable=False),
+    sa.Column('duration', sa.Integer(), nullable=False),
+    sa.Column('event_count', sa.Integer(), nullable=False),
+    sa.Column('entry_event_type_id', sa.Integer(), nullable=False),
+    sa.Column('exit_event_type_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['entry_event_type_id'], ['event_types.id'], ),
+    sa.ForeignKeyConstraint(['exit_event_type_id'], ['event_types.id'], ),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('sessions', schema=None) as batch_op:
+        batch_op.create_index('ix_sessions_project_started_at', ['project_id', 'started_at'], unique=False)
+        batch_op.create_index('ix_sessions_project_identity_started_at', ['project_id', 'identity', 'started_at'], unique=False)
+
+    op.create_table('open_sessions',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('identity', sa.String(length=64), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('last_seen_at', sa.DateTime(), nullable=False),
+    sa.Column('event_count', sa.Integer(), nullable=False),
+    sa.Column('entry_event_type_id', sa.Integer(), nullable=False),
+    sa.Column('exit_event_type_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['entry_event_type_id'], ['event_types.id'], ),
+    sa.ForeignKeyConstraint(['exit_event_type_id'], ['event_types.id'], ),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.PrimaryKeyConstraint('project_id', 'identity')
+    )
+    # Existing events are sessionized with `flask events resessionize`
+
+
+def downgrade():
+    op.drop_table('open_sessions')
+    with op.batch_alter_table('sessions', schema=None) as batch_op:
+        batch_op.drop_index('ix_sessions_project_identity_started_at')
+        batch_op.drop_index('ix_sessions_project_started_at')
+
+    op.drop_table('sessions')
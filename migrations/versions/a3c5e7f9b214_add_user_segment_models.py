@@ -0,0 +1,32 @@
+"""add user segment models
+
+Revision ID: a3c5e7f9b214
+Revises: 9d2f4b8e6c17
+Create Date: 2026-10-18 18:20:53.114072
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c5e7f9b214'
+down_revision = '9d2f4b8e6c17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_segment_models',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('fitted_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('n_users', sa.Integer(), nullable=False),
+    sa.Column('model', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.PrimaryKeyConstraint('project_id')
+    )
+
+
+def downgrade():
+    op.drop_table('user_segment_models')
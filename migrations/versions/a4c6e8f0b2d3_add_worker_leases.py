@@ -0,0 +1,29 @@
+"""add worker leases
+
+Revision ID: a4c6e8f0b2d3
+Revises: f2b4d6e8a0c1
+Create Date: 2026-10-19 01:12:45.208731
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c6e8f0b2d3'
+down_revision = 'f2b4d6e8a0c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('worker_leases',
+    sa.Column('name', sa.String(length=32), nullable=False),
+    sa.Column('holder', sa.String(length=32), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('worker_leases')
@@ -0,0 +1,53 @@
+"""add anomaly detector state and detected anomalies
+
+Revision ID: b6d8f0a2c4e1
+Revises: a3c5e7f9b214
+Create Date: 2026-10-18 20:11:38.652930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d8f0a2c4e1'
+down_revision = 'a3c5e7f9b214'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('anomaly_states',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('last_hour', sa.DateTime(), nullable=False),
+    sa.Column('hours_observed', sa.Integer(), nullable=False),
+    sa.Column('state', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.PrimaryKeyConstraint('project_id')
+    )
+    op.create_table('event_anomalies',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('event_type_id', sa.Integer(), nullable=False),
+    sa.Column('bucket', sa.DateTime(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('expected', sa.Float(), nullable=False),
+    sa.Column('z_score', sa.Float(), nullable=False),
+    sa.Column('severity', sa.String(length=8), nullable=False),
+    sa.Column('detected_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['event_type_id'], ['event_types.id'], ),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('event_anomalies', schema=None) as batch_op:
+        batch_op.create_index('ix_event_anomalies_project_type_bucket', ['project_id', 'event_type_id', 'bucket'], unique=True)
+        batch_op.create_index('ix_event_anomalies_project_bucket', ['project_id', 'bucket'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('event_anomalies', schema=None) as batch_op:
+        batch_op.drop_index('ix_event_anomalies_project_bucket')
+        batch_op.drop_index('ix_event_anomalies_project_type_bucket')
+
+    op.drop_table('event_anomalies')
+    op.drop_table('anomaly_states')
@@ -0,0 +1,72 @@
+"""add hourly and daily identity sketches
+
+Revision ID: b7e4a1f05c93
+Revises: 8f3c2d6e9a17
+Create Date: 2026-10-18 12:48:19.560237
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.utils.hll import HyperLogLog
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4a1f05c93'
+down_revision = '8f3c2d6e9a17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('identity_sketches',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('granularity', sa.String(length=8), nullable=False),
+    sa.Column('bucket', sa.DateTime(), nullable=False),
+    sa.Column('registers', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.PrimaryKeyConstraint('project_id', 'granularity', 'bucket')
+    )
+
+    # Sketch existing events one project-day at a time to bound memory
+    events = sa.table('events',
+        sa.column('project_id', sa.Integer()),
+        sa.column('identity', sa.String()),
+        sa.column('timestamp', sa.DateTime())
+    )
+    sketches = sa.table('identity_sketches',
+        sa.column('project_id', sa.Integer()),
+        sa.column('granularity', sa.String()),
+        sa.column('bucket', sa.DateTime()),
+        sa.column('registers', sa.LargeBinary())
+    )
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select(events.c.project_id, events.c.identity, events.c.timestamp)
+        .where(events.c.identity.isnot(None))
+        .order_by(events.c.project_id, events.c.timestamp)
+    )
+
+    pending = {}
+    current_day = None
+    for project_id, identity, timestamp in rows:
+        day = (project_id, timestamp.replace(hour=0, minute=0, second=0, microsecond=0))
+        if day != current_day:
+            _write(connection, sketches, pending)
+            current_day = day
+        hour = timestamp.replace(minute=0, second=0, microsecond=0)
+        for key in ((project_id, 'day', day[1]), (project_id, 'hour', hour)):
+            pending.setdefault(key, HyperLogLog()).add(identity)
+    _write(connection, sketches, pending)
+
+
+def _write(connection, sketches, pending):
+    if pending:
+        connection.execute(sketches.insert(), [
+            {'project_id': project_id, 'granularity': granularity, 'bucket': bucket, 'registers': sketch.to_bytes()}
+            for (project_id, granularity, bucket), sketch in pending.items()
+        ])
+        pending.clear()
+
+
+def downgrade():
+    op.drop_table('identity_sketches')
@@ -0,0 +1,59 @@
+"""dictionary-encode event names into event_types
+
+Revision ID: c0d43d1e64c4
+Revises: 1a51a28a8bf9
+Create Date: 2026-10-18 10:48:02.663190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c0d43d1e64c4'
+down_revision = '1a51a28a8bf9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('event_types',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+
+    # Convert existing data: one dictionary entry per distinct name, then point events at it
+    op.execute('INSERT INTO event_types (name) SELECT DISTINCT event_name FROM events ORDER BY event_name')
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('event_type_id', sa.Integer(), nullable=True))
+    op.execute(
+        'UPDATE events SET event_type_id = '
+        '(SELECT event_types.id FROM event_types WHERE event_types.name = events.event_name)'
+    )
+
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.alter_column('event_type_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('fk_events_event_type_id', 'event_types', ['event_type_id'], ['id'])
+        batch_op.drop_index('ix_events_event_name')
+        batch_op.drop_column('event_name')
+        batch_op.create_index('ix_events_project_type_timestamp', ['project_id', 'event_type_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('event_name', sa.String(length=64), nullable=True))
+    op.execute(
+        'UPDATE events SET event_name = '
+        '(SELECT event_types.name FROM event_types WHERE event_types.id = events.event_type_id)'
+    )
+
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.alter_column('event_name', existing_type=sa.String(length=64), nullable=False)
+        batch_op.create_index('ix_events_event_name', ['event_name'], unique=False)
+        batch_op.drop_index('ix_events_project_type_timestamp')
+        batch_op.drop_constraint('fk_events_event_type_id', type_='foreignkey')
+        batch_op.drop_column('event_type_id')
+
+    op.drop_table('event_types')
@@ -0,0 +1,51 @@
+"""add feedback sentiment scores and scoring checkpoints
+
+Revision ID: c8e0a2b4d6f3
+Revises: b6d8f0a2c4e1
+Create Date: 2026-10-18 22:04:17.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8e0a2b4d6f3'
+down_revision = 'b6d8f0a2c4e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('feedback_sentiments',
+    sa.Column('event_id', sa.Integer(), nullable=False),
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('event_type_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.Column('property', sa.String(length=64), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('label', sa.String(length=8), nullable=False),
+    sa.Column('confidence', sa.Float(), nullable=False),
+    sa.Column('scored_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['event_id'], ['events.id'], ),
+    sa.ForeignKeyConstraint(['event_type_id'], ['event_types.id'], ),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.PrimaryKeyConstraint('event_id')
+    )
+    with op.batch_alter_table('feedback_sentiments', schema=None) as batch_op:
+        batch_op.create_index('ix_feedback_sentiments_project_timestamp', ['project_id', 'timestamp'], unique=False)
+
+    op.create_table('sentiment_checkpoints',
+    sa.Column('source', sa.String(length=32), nullable=False),
+    sa.Column('last_event_id', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('source')
+    )
+
+
+def downgrade():
+    op.drop_table('sentiment_checkpoints')
+    with op.batch_alter_table('feedback_sentiments', schema=None) as batch_op:
+        batch_op.drop_index('ix_feedback_sentiments_project_timestamp')
+
+    op.drop_table('feedback_sentiments')
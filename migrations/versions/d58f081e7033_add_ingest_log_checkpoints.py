@@ -0,0 +1,29 @@
+"""add ingest log checkpoints
+
+Revision ID: d58f081e7033
+Revises:
+Create Date: 2026-10-18 09:12:41.117342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd58f081e7033'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ingest_log_checkpoints',
+    sa.Column('segment', sa.String(length=128), nullable=False),
+    sa.Column('offset', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('segment')
+    )
+
+
+def downgrade():
+    op.drop_table('ingest_log_checkpoints')
@@ -0,0 +1,26 @@
+"""add project data_version
+
+Revision ID: e1a9c7b3d256
+Revises: b7e4a1f05c93
+Create Date: 2026-10-18 13:27:50.114862
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a9c7b3d256'
+down_revision = 'b7e4a1f05c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('projects', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('data_version', sa.BigInteger(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('projects', schema=None) as batch_op:
+        batch_op.drop_column('data_version')
@@ -0,0 +1,30 @@
+"""add event day versions
+
+Revision ID: f2b4d6e8a0c1
+Revises: c8e0a2b4d6f3
+Create Date: 2026-10-18 23:41:09.527384
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b4d6e8a0c1'
+down_revision = 'c8e0a2b4d6f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('event_day_versions',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('bucket', sa.DateTime(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.PrimaryKeyConstraint('project_id', 'bucket')
+    )
+
+
+def downgrade():
+    op.drop_table('event_day_versions')
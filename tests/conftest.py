@@ -0,0 +1,65 @@
+import pytest
+from app import create_app, db
+from app.config import Config
+from app.models.user import User
+from app.models.project import Project
+from app.services.event_processing import EventProcessingService
+from app.services.event_types import event_type_cache
+from app.services.identity import identity_resolver
+
+@pytest.fixture
+def app(tmp_path):
+    """Application on a fresh in-memory database, without background threads"""
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+        INGEST_LOG_DIR = str(tmp_path / 'ingest_log')
+        ANALYTICS_CACHE_BACKEND = 'none'
+        BACKGROUND_WORKERS_ENABLED = False
+        SESSIONIZE_ENABLED = False
+        ANOMALY_DETECTION_ENABLED = False
+        SENTIMENT_ENABLED = False
+
+    # The name and alias caches are shared instances; ids restart with every database
+    event_type_cache.clear()
+    identity_resolver.clear()
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def project(app):
+    user = User(username='owner', email='owner@example.com')
+    user.set_password('password1')
+    db.session.add(user)
+    db.session.commit()
+
+    project = Project(name='Test project', user_id=user.id)
+    db.session.add(project)
+    db.session.commit()
+    return project
+
+@pytest.fixture
+def store_events(project):
+    """Store (event name, user_id, anonymous_id, timestamp) tuples in the test project"""
+    def store(events):
+        EventProcessingService.store_events([
+            {
+                'project_id': project.id,
+                'event_name': event_name,
+                'properties': {},
+                'user_id': user_id,
+                'anonymous_id': anonymous_id,
+                'timestamp': timestamp
+            }
+            for event_name, user_id, anonymous_id, timestamp in events
+        ])
+    return store
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,49 @@
+import gzip
+import json
+import pytest
+from app.models import db
+from app.models.user import User
+
+@pytest.fixture
+def logged_in(client, project):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(project.user_id)
+        session['_fresh'] = True
+    return client
+
+def test_unauthenticated_requests_get_json_401(client, project):
+    get = client.get(f'/api/projects/{project.id}/analytics/top-events')
+    post = client.post(f'/api/projects/{project.id}/sentiment', json={'texts': ['great']})
+
+    assert get.status_code == post.status_code == 401
+    assert 'Location' not in get.headers
+    assert get.get_json() == {'status': 'error', 'message': 'Authentication required'}
+
+def test_other_users_projects_are_forbidden(logged_in, project):
+    other = User(username='other', email='other@example.com')
+    other.set_password('password1')
+    db.session.add(other)
+    db.session.commit()
+    with logged_in.session_transaction() as session:
+        session['_user_id'] = str(other.id)
+
+    response = logged_in.get(f'/api/projects/{project.id}/analytics/top-events')
+
+    assert response.status_code == 403
+    assert response.get_json()['status'] == 'error'
+
+@pytest.mark.parametrize('accept_encoding, compressed', [
+    ('gzip', True),
+    ('gzip, deflate;q=0.5', True),
+    ('gzip;q=0', False),
+    ('identity', False),
+])
+def test_gzip_follows_accept_encoding_quality(app, logged_in, project, accept_encoding, compressed):
+    app.config['ANALYTICS_API_GZIP_MIN_SIZE'] = 0
+
+    response = logged_in.get(f'/api/projects/{project.id}/analytics/top-events', headers={'Accept-Encoding': accept_encoding})
+    body = gzip.decompress(response.get_data()) if compressed else response.get_data()
+
+    assert response.status_code == 200
+    assert (response.headers.get('Content-Encoding') == 'gzip') == compressed
+    assert json.loads(body)['status'] == 'success'
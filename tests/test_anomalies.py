@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+from app.models import db
+from app.models.insights import AnomalyState, EventAnomaly
+from app.models.rollup import EventRollupHourly
+from app.services.anomalies import (HOURS_PER_WEEK, SEASON_ALPHA, SEASON_MIN_WEEKS, WARMUP_HOURS,
+                                    AnomalyDetector)
+from app.services.event_types import event_type_cache
+
+THRESHOLD = 3.5
+MONDAY = datetime(2024, 1, 1)
+
+def test_hour_of_week_starts_on_monday_midnight():
+    hours = [int((moment - datetime(1970, 1, 1)).total_seconds() // 3600)
+             for moment in (MONDAY, MONDAY + timedelta(hours=9), MONDAY + timedelta(days=6, hours=23), MONDAY + timedelta(days=7))]
+
+    assert AnomalyDetector.hour_of_week(hours).tolist() == [0, 9, 167, 0]
+
+def weekly_pattern(slots):
+    """100 events in working hours on weekdays, 10 otherwise"""
+    slots = np.asarray(slots)
+    working = (slots // 24 < 5) & (slots % 24 >= 9) & (slots % 24 < 18)
+    return np.where(working, 100.0, 10.0)
+
+def run(state, counts, slots):
+    AnomalyDetector.add_types(state, [1])
+    return AnomalyDetector.evaluate(np.asarray(counts, dtype=float).reshape(-1, 1), np.asarray(slots), state, THRESHOLD, 5)
+
+def test_hour_of_week_baselines_take_over_after_enough_weeks():
+    state = AnomalyDetector.empty_state()
+    slots = np.arange(3 * HOURS_PER_WEEK) % HOURS_PER_WEEK
+    counts = weekly_pattern(slots)
+
+    expected, z_scores, flagged = run(state, counts, slots)
+
+    # Weeks before SEASON_MIN_WEEKS expect the level, which cannot follow the rhythm...
+    first_weeks = slice(0, SEASON_MIN_WEEKS * HOURS_PER_WEEK)
+    assert np.abs(expected[first_weeks, 0] - counts[first_weeks]).max() > 50
+    # ...and flags the first Monday morning it sees after a quiet weekend
+    assert flagged[first_weeks, 0].any()
+    # Afterwards each hour is expected at its hour-of-week mean and the rhythm is never anomalous. The
+    # Monday mornings flagged were folded in clipped, so their means are still catching up
+    assert np.allclose(expected[first_weeks.stop:, 0], counts[first_weeks.stop:], rtol=0.15)
+    assert not flagged[first_weeks.stop:].any()
+    assert np.allclose(state['season_mean'][0], weekly_pattern(np.arange(HOURS_PER_WEEK)), rtol=0.15)
+    assert (state['season_n'][0] == 3).all()
+
+def test_spikes_are_flagged_against_their_hour_of_week():
+    state = AnomalyDetector.empty_state()
+    slots = np.arange(2 * HOURS_PER_WEEK) % HOURS_PER_WEEK
+    run(state, weekly_pattern(slots), slots)
+
+    # Monday 03:00 and Monday 12:00 of the third week, both at the working-hours count
+    expected, z_scores, flagged = run(state, [100, 100], [3, 12])
+
+    assert flagged[:, 0].tolist() == [True, False]
+    assert expected[:, 0].tolist() == [10, 100]
+    # The spike is folded in clipped to the normal band: 10 + 3.5 * sqrt(10) at most
+    assert state['season_mean'][0, 3] == pytest.approx(10 + SEASON_ALPHA * THRESHOLD * np.sqrt(10))
+    assert state['season_mean'][0, 12] == 100
+
+def test_nothing_is_flagged_while_warming_up():
+    state = AnomalyDetector.empty_state()
+    counts = [10.0] * (WARMUP_HOURS + 1)
+    counts[WARMUP_HOURS - 1] = counts[WARMUP_HOURS] = 1000
+
+    expected, z_scores, flagged = run(state, counts, np.arange(len(counts)) % HOURS_PER_WEEK)
+
+    assert abs(z_scores[WARMUP_HOURS - 1, 0]) > THRESHOLD and not flagged[WARMUP_HOURS - 1, 0]
+    assert flagged[WARMUP_HOURS, 0]
+
+@pytest.fixture
+def hourly_rollups(app, project, store_events):
+    """Store 20 'view' events an hour over the history window before MONDAY"""
+    store_events([('view', 'user-1', None, MONDAY - timedelta(days=60))])
+    type_id = event_type_cache.id_for('view')
+
+    def store(start, end, count=20):
+        hours = int((end - start).total_seconds() // 3600)
+        db.session.add_all([EventRollupHourly(project_id=project.id, event_type_id=type_id,
+                                              bucket=start + timedelta(hours=hour), count=count) for hour in range(hours)])
+        db.session.commit()
+    store(MONDAY - timedelta(days=app.config['ANOMALY_HISTORY_DAYS']), MONDAY)
+    return store
+
+def test_update_flags_each_hour_once(project, hourly_rollups):
+    hourly_rollups(MONDAY, MONDAY + timedelta(hours=1), count=200)
+
+    assert AnomalyDetector.update(project.id, now=MONDAY + timedelta(hours=1, minutes=5)) == 1
+    assert AnomalyDetector.update(project.id, now=MONDAY + timedelta(hours=1, minutes=10)) == 0
+
+    anomaly = EventAnomaly.query.one()
+    assert (anomaly.bucket, anomaly.count, anomaly.expected, anomaly.severity) == (MONDAY, 200, 20, 'high')
+    assert db.session.get(AnomalyState, project.id).last_hour == MONDAY
+
+def test_update_gives_way_to_a_concurrent_check(project, hourly_rollups, monkeypatch):
+    AnomalyDetector.update(project.id, now=MONDAY)
+    hourly_rollups(MONDAY, MONDAY + timedelta(hours=1), count=200)
+    evaluate = AnomalyDetector.evaluate
+
+    def checked_elsewhere_meanwhile(*args):
+        db.session.execute(AnomalyState.__table__.update().values(last_hour=MONDAY))
+        return evaluate(*args)
+    monkeypatch.setattr(AnomalyDetector, 'evaluate', staticmethod(checked_elsewhere_meanwhile))
+
+    assert AnomalyDetector.update(project.id, now=MONDAY + timedelta(hours=1)) == 0
+    assert EventAnomaly.query.count() == 0
+    assert db.session.get(AnomalyState, project.id).last_hour == MONDAY - timedelta(hours=1)
+
+def test_one_worker_holds_the_lease_until_it_expires(app):
+    first, second = AnomalyDetector(), AnomalyDetector()
+    first.lease_ttl = second.lease_ttl = 60
+    now = datetime.utcnow()
+
+    assert first.acquire_lease(now)
+    assert not second.acquire_lease(now)
+    # Renewed by its holder...
+    assert first.acquire_lease(now + timedelta(seconds=30))
+    assert not second.acquire_lease(now + timedelta(seconds=61))
+    # ...and taken over once it was not
+    assert second.acquire_lease(now + timedelta(seconds=91))
+    assert not first.acquire_lease(now + timedelta(seconds=92))
+
+def test_released_lease_is_taken_over_at_once(app):
+    first, second = AnomalyDetector(), AnomalyDetector()
+    assert first.acquire_lease()
+
+    first.release_lease()
+
+    assert second.acquire_lease(datetime.utcnow() + timedelta(seconds=1))
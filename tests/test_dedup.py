@@ -0,0 +1,85 @@
+from datetime import datetime
+from app.models.event import Event
+from app.services.event_processing import EventProcessingService, MessageDeduplicator
+from app.utils.bloom import BloomFilter, RotatingBloomFilter
+
+def test_bloom_filter_is_sized_from_capacity_and_error_rate():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+
+    # m = -n ln p / ln(2)^2, k = m / n ln 2
+    assert bloom.num_bits == 9585
+    assert bloom.num_hashes == 7
+    assert len(bloom._bits) == 1199
+
+def test_bloom_filter_false_positive_rate_at_capacity():
+    bloom = BloomFilter(capacity=10000, error_rate=0.01)
+    for i in range(10000):
+        bloom.add(f'stored-{i}')
+
+    assert bloom.is_full()
+    assert all(bloom.might_contain(f'stored-{i}') for i in range(10000))
+    false_positives = sum(bloom.might_contain(f'new-{i}') for i in range(20000))
+    assert false_positives / 20000 < 0.02
+
+def test_rotation_keeps_the_previous_generation():
+    bloom = RotatingBloomFilter(capacity=100, error_rate=0.001)
+    for i in range(100):
+        bloom.add(f'first-{i}')
+    assert bloom._previous is None
+
+    # The 101st key starts a new generation; the full one is still consulted
+    bloom.add('second-0')
+    assert bloom._previous is not None
+    assert all(bloom.might_contain(f'first-{i}') for i in range(100))
+    assert bloom.memory_bytes() == 2 * len(bloom._current._bits)
+
+    for i in range(1, 101):
+        bloom.add(f'second-{i}')
+    # Two rotations later the first generation is gone
+    assert all(bloom.might_contain(f'second-{i}') for i in range(101))
+    assert sum(bloom.might_contain(f'first-{i}') for i in range(100)) < 5
+
+def test_deduplicator_is_sized_from_config(app):
+    app.config.update(DEDUP_FILTER_CAPACITY=5000, DEDUP_FILTER_ERROR_RATE=0.01)
+    deduplicator = MessageDeduplicator()
+    deduplicator.init_app(app)
+
+    assert (deduplicator._filter.capacity, deduplicator._filter.error_rate) == (5000, 0.01)
+    assert deduplicator.stats()['filter_bytes'] == len(BloomFilter(5000, 0.01)._bits)
+
+def rows(project, *message_ids):
+    return [{'project_id': project.id, 'message_id': message_id} for message_id in message_ids]
+
+def test_filter_hits_are_confirmed_in_the_database(project, monkeypatch):
+    EventProcessingService.store_events([{'project_id': project.id, 'event_name': 'view', 'properties': {}, 'user_id': 'user-1',
+                                          'anonymous_id': None, 'timestamp': datetime.utcnow(), 'message_id': 'stored'}])
+    deduplicator = MessageDeduplicator(capacity=1000)
+
+    # Every key looks possibly seen: only the database can tell
+    monkeypatch.setattr(deduplicator._filter, 'might_contain', lambda key: True)
+    duplicates = deduplicator.find_duplicates(rows(project, 'stored', 'new', None, 'new'))
+
+    assert duplicates == {0, 3}
+    assert deduplicator.stats()['false_positives'] == 1
+    assert deduplicator.stats()['duplicates'] == 2
+
+def test_unseen_messages_skip_the_database(project, monkeypatch):
+    deduplicator = MessageDeduplicator(capacity=1000)
+
+    def no_queries(*args):
+        raise AssertionError('queried the database')
+    monkeypatch.setattr('app.services.event_processing.db.session.query', no_queries)
+
+    assert deduplicator.find_duplicates(rows(project, 'a', 'b', 'a')) == {2}
+    assert deduplicator.stats()['filter_hits'] == 0
+
+def test_retried_message_is_acknowledged_once(client, project):
+    event = {'project_id': project.tracking_id, 'event_name': 'click', 'message_id': 'retry-1'}
+
+    first = client.post('/api/events', json=event)
+    second = client.post('/api/events', json=event)
+
+    assert first.status_code == second.status_code == 200
+    assert 'duplicate' not in first.get_json()
+    assert second.get_json()['duplicate'] is True
+    assert Event.query.filter_by(message_id='retry-1').count() == 1
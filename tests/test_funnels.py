@@ -0,0 +1,98 @@
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+from app.services.funnels import FunnelEngine
+
+def brute_force(identity, timestamp, event_type, step_types, window):
+    """
+    Walk every attempt (each occurrence of the first step) of every identity,
+    taking the next event of each step within the window of the attempt's start.
+    Keeps the deepest attempt per identity, the fastest (then earliest) among equals.
+    """
+    depths, times = [], []
+    for owner in sorted(set(identity.tolist())):
+        events = [i for i in range(len(identity)) if identity[i] == owner]
+        best = None
+        for start in events:
+            if event_type[start] != step_types[0]:
+                continue
+            reached = [start]
+            for step_type in step_types[1:]:
+                later = [i for i in events if i > reached[-1] and event_type[i] == step_type]
+                if not later or timestamp[later[0]] - timestamp[start] > window:
+                    break
+                reached.append(later[0])
+            key = (-len(reached), timestamp[reached[-1]] - timestamp[start])
+            if best is None or key < best[0]:
+                best = (key, reached)
+        if best is not None:
+            reached = best[1]
+            depths.append(len(reached))
+            times.append([timestamp[i] for i in reached] + [-1] * (len(step_types) - len(reached)))
+    return depths, times
+
+def random_chunk(rng, identities=30, types=4):
+    """Events sorted by (identity, timestamp), with repeated timestamps"""
+    rows = sorted(
+        (identity, rng.randrange(0, 5000, 10), rng.randrange(types))
+        for identity in range(identities)
+        for _ in range(rng.randint(0, 15))
+    )
+    identity, timestamp, event_type = (np.array(column, dtype=np.int64) for column in zip(*rows))
+    return identity, timestamp, event_type
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('step_types', [[0, 1], [0, 1, 2], [2, 0, 2, 1], [1, 1, 1], [0, 3, -1]])
+def test_evaluate_matches_brute_force(seed, step_types):
+    identity, timestamp, event_type = random_chunk(random.Random(seed))
+    step_types = np.array(step_types, dtype=np.int64)
+    window = random.Random(seed).choice([50, 500, 5000])
+
+    depth, times = FunnelEngine.evaluate(identity, timestamp, event_type, step_types, window)
+    expected_depth, expected_times = brute_force(identity, timestamp, event_type, step_types, window)
+
+    assert depth.tolist() == expected_depth
+    assert times.tolist() == expected_times
+
+def test_evaluate_without_first_step():
+    identity = np.array([0, 0, 1], dtype=np.int64)
+    depth, times = FunnelEngine.evaluate(identity, np.array([1, 2, 3]), np.array([1, 2, 1]), np.array([0, 1]), 10)
+    assert depth.tolist() == []
+    assert times.shape == (0, 2)
+
+def test_funnel_counts_match_brute_force(store_events, project):
+    rng = random.Random(7)
+    now = datetime.utcnow().replace(microsecond=0)
+    steps = ['visit', 'signup', 'purchase']
+    events = []
+    for person in range(40):
+        # Distinct offsets so the stored order by timestamp is unambiguous
+        offsets = rng.sample(range(1, 10 * 86400), rng.randint(1, 8))
+        for offset in offsets:
+            events.append((rng.choice(steps + ['other']), f'user-{person}', None, now - timedelta(seconds=offset)))
+    store_events(events)
+
+    window = 86400
+    result = FunnelEngine.funnel(project.id, steps, window, days=30)
+
+    # Brute force over the stored events, sorted by identity and time
+    by_user = defaultdict(list)
+    for event_name, user_id, _, timestamp in events:
+        by_user[user_id].append((timestamp, event_name))
+    rows = [(user_id, timestamp, event_name) for user_id in sorted(by_user) for timestamp, event_name in sorted(by_user[user_id])]
+    codes = {user_id: code for code, user_id in enumerate(sorted(by_user))}
+    identity = np.array([codes[user_id] for user_id, _, _ in rows], dtype=np.int64)
+    timestamp = np.array([int(ts.timestamp()) for _, ts, _ in rows], dtype=np.int64)
+    names = steps + ['other']
+    event_type = np.array([names.index(name) for _, _, name in rows], dtype=np.int64)
+    depths, _ = brute_force(identity, timestamp, event_type, np.arange(len(steps)), window)
+
+    assert [step['count'] for step in result['steps']] == [sum(1 for d in depths if d > k) for k in range(len(steps))]
+
+def test_funnel_rejects_bad_definitions(project):
+    with pytest.raises(ValueError):
+        FunnelEngine.funnel(project.id, ['visit'], 3600)
+    with pytest.raises(ValueError):
+        FunnelEngine.funnel(project.id, ['visit', 'signup'], 0)
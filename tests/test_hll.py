@@ -0,0 +1,58 @@
+import pytest
+from app.utils.hll import HyperLogLog
+
+def sketch(values, p=12):
+    result = HyperLogLog(p)
+    result.update(values)
+    return result
+
+@pytest.mark.parametrize('p', [10, 12, 14])
+@pytest.mark.parametrize('n', [100, 5000, 60000])
+def test_count_within_error_bound(p, n):
+    result = sketch((f'identity-{i}' for i in range(n)), p)
+    # Four standard errors, so the fixed inputs leave no flaky margin
+    assert abs(result.count() - n) <= 4 * result.relative_error * n
+
+def test_merge_equals_sketch_of_union():
+    a = sketch(f'a-{i}' for i in range(3000))
+    b = sketch([f'b-{i}' for i in range(3000)] + [f'a-{i}' for i in range(1000)])
+
+    assert a.merge(b)
+    assert (a.registers == sketch([f'a-{i}' for i in range(3000)] + [f'b-{i}' for i in range(3000)]).registers).all()
+    # Merging again changes nothing
+    assert not a.merge(b)
+
+@pytest.mark.parametrize('fine, coarse', [(14, 12), (12, 4), (8, 7)])
+def test_fold_matches_sketch_built_at_lower_precision(fine, coarse):
+    values = [f'identity-{i}' for i in range(20000)]
+    assert (sketch(values, fine).fold(coarse).registers == sketch(values, coarse).registers).all()
+
+def test_fold_cannot_raise_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(10).fold(12)
+
+@pytest.mark.parametrize('first, second', [(12, 14), (14, 12)])
+def test_merge_across_precisions_keeps_the_coarser(first, second):
+    a = sketch((f'a-{i}' for i in range(4000)), first)
+    b = sketch((f'b-{i}' for i in range(4000)), second)
+
+    assert a.merge(b)
+    assert a.p == a.registers.size.bit_length() - 1 == 12
+    expected = sketch([f'a-{i}' for i in range(4000)] + [f'b-{i}' for i in range(4000)], 12)
+    assert (a.registers == expected.registers).all()
+
+def test_covers():
+    seen = sketch(f'identity-{i}' for i in range(2000))
+
+    assert seen.covers(sketch(f'identity-{i}' for i in range(500)))
+    assert seen.covers(sketch((f'identity-{i}' for i in range(500)), 14))
+    assert not seen.covers(sketch(f'other-{i}' for i in range(500)))
+    # A coarser sketch would fold the stored one down
+    assert not seen.covers(HyperLogLog(10))
+
+def test_bytes_round_trip_keeps_precision():
+    original = sketch((f'identity-{i}' for i in range(300)), 10)
+    restored = HyperLogLog.from_bytes(original.to_bytes())
+
+    assert restored.p == 10
+    assert (restored.registers == original.registers).all()
@@ -0,0 +1,62 @@
+import pytest
+from app.services import ingest_buffer as ingest_buffer_module
+from app.services.ingest_buffer import IngestBuffer, IngestQueueFull
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(ingest_buffer_module.time, 'sleep', lambda seconds: None)
+
+def test_flusher_only_starts_with_background_workers(app):
+    app.config['INGEST_WRITE_BEHIND'] = True
+    buffer = IngestBuffer()
+    buffer.init_app(app, lambda rows: None)
+    # Writes stay synchronous where nothing would drain the queue
+    assert not buffer.enabled
+    assert buffer._thread is None
+
+    app.config['BACKGROUND_WORKERS_ENABLED'] = True
+    buffer.init_app(app, lambda rows: None)
+    assert buffer.enabled
+    assert buffer._thread.is_alive()
+    buffer.shutdown()
+
+def test_flush_drops_only_rows_that_fail_on_their_own(app, no_backoff):
+    written = []
+
+    def flush(rows):
+        if any(row['bad'] for row in rows):
+            raise ValueError('bad row')
+        written.extend(row['index'] for row in rows)
+
+    buffer = IngestBuffer()
+    buffer.app, buffer.flush_func, buffer.max_retries = app, flush, 2
+    buffer._flush([{'index': index, 'bad': index in (3, 17, 18)} for index in range(40)])
+
+    assert sorted(written) == [index for index in range(40) if index not in (3, 17, 18)]
+    assert buffer.dropped == 3
+    assert buffer.flushed == 37
+
+def test_flush_retries_before_splitting(app, no_backoff):
+    attempts = []
+
+    def flaky(rows):
+        attempts.append(len(rows))
+        if len(attempts) < 3:
+            raise ValueError('database is locked')
+
+    buffer = IngestBuffer()
+    buffer.app, buffer.flush_func, buffer.max_retries = app, flaky, 3
+    buffer._flush([{'index': index} for index in range(10)])
+
+    assert attempts == [10, 10, 10]
+    assert buffer.dropped == 0
+
+def test_submit_rejects_batches_that_do_not_fit():
+    buffer = IngestBuffer()
+    buffer.max_size = 3
+    buffer.submit([1, 2])
+
+    with pytest.raises(IngestQueueFull):
+        buffer.submit([3, 4])
+    assert buffer.depth() == 2
+    assert buffer.rejected == 2
@@ -0,0 +1,196 @@
+import errno
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import pytest
+from app.models import db
+from app.models.event import Event
+from app.models.ingest import IngestLogCheckpoint
+from app.services import ingest_log as ingest_log_module
+from app.services.event_types import event_type_cache
+from app.services.ingest_buffer import IngestBuffer, ingest_buffer
+from app.services.ingest_log import IngestLog, IngestLogFailed, ingest_log
+
+@pytest.fixture
+def rows(project):
+    start = datetime(2024, 3, 1, 12, 0, 0, 250000)
+    return [
+        {
+            'project_id': project.id,
+            'event_name': ['page_view', 'signup', 'purchase'][i % 3],
+            'properties': {'index': i, 'path': f'/page/{i}', 'tags': ['a', 'b']},
+            'user_id': f'user-{i % 4}',
+            'anonymous_id': None,
+            'timestamp': start + timedelta(minutes=i),
+            'message_id': f'message-{i}'
+        }
+        for i in range(10)
+    ]
+
+def write_segment(name, records, tail=b''):
+    """Leave a segment on disk as a dead process would have"""
+    os.makedirs(ingest_log.directory, exist_ok=True)
+    path = os.path.join(ingest_log.directory, name)
+    with open(path, 'wb') as segment:
+        segment.write(b''.join(IngestLog._encode(row) for row in records) + tail)
+    return path
+
+def stored_rows(project_id):
+    events = Event.query.filter_by(project_id=project_id).order_by(Event.timestamp).all()
+    return [
+        {
+            'project_id': event.project_id,
+            'event_name': event_type_cache.name_for(event.event_type_id),
+            'properties': event.properties,
+            'user_id': event.user_id,
+            'anonymous_id': event.anonymous_id,
+            'timestamp': event.timestamp,
+            'message_id': event.message_id
+        }
+        for event in events
+    ]
+
+def test_replay_round_trips_events(project, rows):
+    path = write_segment('0000000000001-1-000001.log', rows)
+
+    ingest_log.replay()
+
+    assert stored_rows(project.id) == rows
+    assert not os.path.exists(path)
+    assert IngestLogCheckpoint.query.count() == 0
+
+def test_replay_skips_torn_and_corrupt_records(project, rows):
+    os.makedirs(ingest_log.directory, exist_ok=True)
+    path = os.path.join(ingest_log.directory, '0000000000001-1-000001.log')
+    with open(path, 'wb') as segment:
+        segment.write(IngestLog._encode(rows[0]) + b'not json\n' + IngestLog._encode(rows[1]) + b'{"torn')
+
+    ingest_log.replay()
+
+    assert stored_rows(project.id) == rows[:2]
+    assert not os.path.exists(path)
+
+def test_replay_resumes_from_checkpoint(project, rows):
+    write_segment('0000000000001-1-000001.log', rows)
+    offset = sum(len(IngestLog._encode(row)) for row in rows[:4])
+    db.session.add(IngestLogCheckpoint(segment='0000000000001-1-000001.log', offset=offset))
+    db.session.commit()
+
+    ingest_log.replay()
+
+    assert stored_rows(project.id) == rows[4:]
+
+def test_replay_is_idempotent(project, rows):
+    # A crash between loading a segment and deleting it leaves the same records behind again
+    write_segment('0000000000001-1-000001.log', rows)
+    ingest_log.replay()
+    write_segment('0000000000002-1-000001.log', rows)
+    ingest_log.replay()
+    ingest_log.replay()
+
+    assert stored_rows(project.id) == rows
+
+def test_replay_loads_segments_in_batches(project, rows):
+    ingest_log.replay_batch_size = 3
+    write_segment('0000000000001-1-000001.log', rows[:5])
+    write_segment('0000000000002-1-000001.log', rows[5:])
+
+    ingest_log.replay()
+
+    assert stored_rows(project.id) == rows
+    assert os.listdir(ingest_log.directory) == []
+
+@pytest.fixture
+def live_log(app, tmp_path):
+    """An enabled log of its own, appending to a buffer nothing drains"""
+    app.config.update(INGEST_LOG_ENABLED=True, INGEST_WRITE_BEHIND=True, BACKGROUND_WORKERS_ENABLED=True,
+                      INGEST_LOG_DIR=str(tmp_path / 'live_log'))
+    log = IngestLog()
+    log.init_app(app, lambda rows: None)
+    buffer = IngestBuffer()
+    yield log, buffer
+    log.close()
+
+def append_in_thread(log, buffer, rows):
+    """Run append in a thread; returns the thread and a list receiving its exception"""
+    errors = []
+
+    def run():
+        try:
+            log.append(rows, buffer)
+        except Exception as e:
+            errors.append(e)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, errors
+
+def test_failed_fsync_releases_appenders(live_log, rows, monkeypatch):
+    log, buffer = live_log
+
+    def failing_fsync(fd):
+        raise OSError(errno.EIO, 'Input/output error')
+    monkeypatch.setattr(ingest_log_module.os, 'fsync', failing_fsync)
+
+    thread, errors = append_in_thread(log, buffer, rows[:2])
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert isinstance(errors[0], IngestLogFailed)
+    # Later appends fail at once without writing
+    with pytest.raises(IngestLogFailed):
+        log.append(rows[2:4], buffer)
+    assert log.appended == 2
+    assert log.stats()['failure']
+
+def test_fsync_runs_outside_the_append_lock(live_log, rows, monkeypatch):
+    log, buffer = live_log
+    syncing = threading.Event()
+    release = threading.Event()
+    fsync = os.fsync
+
+    def slow_fsync(fd):
+        syncing.set()
+        release.wait(5)
+        fsync(fd)
+    monkeypatch.setattr(ingest_log_module.os, 'fsync', slow_fsync)
+
+    first, _ = append_in_thread(log, buffer, rows[:1])
+    assert syncing.wait(5)
+    # A second appender gets its records written while the first group is being synced
+    second, _ = append_in_thread(log, buffer, rows[1:2])
+    for _ in range(100):
+        if log.appended == 2:
+            break
+        time.sleep(0.01)
+    assert log.appended == 2
+
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert not first.is_alive() and not second.is_alive()
+    assert buffer.depth() == 2
+
+def test_failed_log_answers_503(client, project, monkeypatch):
+    monkeypatch.setattr(ingest_buffer, 'enabled', True)
+    monkeypatch.setattr(ingest_log, 'enabled', True)
+    monkeypatch.setattr(ingest_log, '_failure', OSError(errno.ENOSPC, 'No space left on device'))
+
+    single = client.post('/api/events', json={'project_id': project.tracking_id, 'event_name': 'click'})
+    batch = client.post('/api/events/batch', json=[{'project_id': project.tracking_id, 'event_name': 'click'}])
+
+    assert single.status_code == batch.status_code == 503
+    assert Event.query.count() == 0
+
+def test_startup_replay_only_runs_with_background_workers(app, project, rows):
+    path = write_segment('0000000000001-1-000001.log', rows)
+
+    # e.g. `flask db upgrade`, which may run before the tables exist
+    IngestLog().init_app(app, ingest_log.insert_func)
+    assert os.path.exists(path)
+    assert stored_rows(project.id) == []
+
+    app.config['BACKGROUND_WORKERS_ENABLED'] = True
+    IngestLog().init_app(app, ingest_log.insert_func)
+    assert not os.path.exists(path)
+    assert stored_rows(project.id) == rows
@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from app.models import db
+from app.models.event import Event
+from app.models.project import Project
+from app.routes.project import PROJECT_TABLES
+from app.services.event_processing import EventProcessingService
+
+def rows_per_table(project_id):
+    return {table.__tablename__: table.query.filter(table.project_id == project_id).count() for table in PROJECT_TABLES}
+
+def test_delete_removes_project_rows_without_loading_them(client, project, store_events):
+    other = Project(name='Other project', user_id=project.user_id)
+    db.session.add(other)
+    db.session.commit()
+    now = datetime.utcnow()
+    store_events([('view', None, 'anon-1', now - timedelta(days=2)), ('signup', 'user-1', 'anon-1', now)])
+    EventProcessingService.store_events([{'project_id': other.id, 'event_name': 'view', 'properties': {},
+                                          'user_id': 'user-2', 'anonymous_id': None, 'timestamp': now}])
+    other_rows = rows_per_table(other.id)
+    assert rows_per_table(project.id)['events'] == 2
+
+    loaded = []
+
+    def on_load(target, context):
+        loaded.append(target)
+    event.listen(Event, 'load', on_load)
+    with client.session_transaction() as session:
+        session['_user_id'] = str(project.user_id)
+    response = client.post(f'/projects/{project.id}/delete')
+    event.remove(Event, 'load', on_load)
+
+    assert response.status_code == 302
+    assert loaded == []
+    assert db.session.get(Project, project.id) is None
+    assert set(rows_per_table(project.id).values()) == {0}
+    assert rows_per_table(other.id) == other_rows
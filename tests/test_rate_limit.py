@@ -0,0 +1,140 @@
+import math
+import pytest
+from app.services.event_processing import admission_control
+from app.utils import rate_limit
+from app.utils.rate_limit import TokenBucket, RateLimiter, BLOCKED_RETRY_AFTER
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Manually advanced replacement for time.monotonic"""
+    class Clock:
+        now = 1000.0
+
+        def __call__(self):
+            return self.now
+
+        def advance(self, seconds):
+            self.now += seconds
+
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, 'monotonic', clock)
+    return clock
+
+@pytest.fixture
+def limits(app):
+    """Replace the ingest limiter; returns a function taking rate, burst and overrides"""
+    def configure(rate=100.0, burst=500, overrides=None):
+        admission_control.enabled = True
+        admission_control.limiter = RateLimiter(rate=rate, burst=burst, overrides=overrides)
+    return configure
+
+def test_bucket_allows_burst_then_waits_for_refill(clock):
+    bucket = TokenBucket(rate=10, burst=5)
+
+    assert bucket.consume(5) == 0
+    assert bucket.consume(1) == pytest.approx(0.1)
+    clock.advance(0.5)
+    assert bucket.consume(5) == 0
+    assert bucket.consume(2) == pytest.approx(0.2)
+
+def test_bucket_never_refills_past_burst(clock):
+    bucket = TokenBucket(rate=10, burst=5)
+    clock.advance(3600)
+
+    assert bucket.consume(5) == 0
+    assert bucket.consume(1) > 0
+
+def test_bucket_larger_count_than_burst_is_infinite(clock):
+    bucket = TokenBucket(rate=10, burst=5)
+
+    assert bucket.consume(6) == math.inf
+    # Nothing was taken by the refused request
+    assert bucket.consume(5) == 0
+
+def test_zero_rate_bucket_is_blocked_with_finite_wait(clock):
+    bucket = TokenBucket(rate=0, burst=2)
+
+    assert bucket.consume(2) == 0
+    assert bucket.consume(1) == BLOCKED_RETRY_AFTER
+    clock.advance(3600)
+    assert bucket.consume(1) == BLOCKED_RETRY_AFTER
+
+def test_limiter_overrides_and_counters(clock):
+    limiter = RateLimiter(rate=10, burst=5, overrides={'vip': {'rate': 100, 'burst': 50}})
+
+    assert limiter.burst_for('vip') == 50
+    assert limiter.burst_for('other') == 5
+    assert limiter.acquire('vip', 50) == 0
+    assert limiter.acquire('other', 5) == 0
+    assert limiter.acquire('other', 2) > 0
+    limiter.record_shed('vip', 10)
+
+    assert limiter.counters() == {
+        'vip': {'accepted': 40, 'rate_limited': 0, 'shed': 10},
+        'other': {'accepted': 5, 'rate_limited': 2, 'shed': 0}
+    }
+    assert limiter.counters(['other', 'unknown']) == {'other': {'accepted': 5, 'rate_limited': 2, 'shed': 0}}
+
+def test_limiter_forgets_least_recent_keys(clock):
+    limiter = RateLimiter(rate=1, burst=1, max_keys=2)
+    for key in ('a', 'b', 'c'):
+        limiter.acquire(key)
+
+    # 'a' was evicted, so it starts again with a full bucket, and 'b' goes instead
+    assert limiter.acquire('a') == 0
+    assert set(limiter.counters()) == {'c', 'a'}
+
+def events(project, count):
+    return [{'project_id': project.tracking_id, 'event_name': 'click', 'user_id': 'user-1'} for _ in range(count)]
+
+def test_single_event_over_rate_gets_429(client, project, limits, clock):
+    limits(rate=1, burst=1)
+
+    assert client.post('/api/events', json=events(project, 1)[0]).status_code == 200
+    response = client.post('/api/events', json=events(project, 1)[0])
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+
+def test_single_event_with_zero_burst_gets_413(client, project, limits, clock):
+    limits(overrides={project.tracking_id: {'burst': 0}})
+
+    response = client.post('/api/events', json=events(project, 1)[0])
+
+    assert response.status_code == 413
+    assert response.get_json()['status'] == 'error'
+
+def test_zero_rate_override_blocks_with_finite_retry_after(client, project, limits, clock):
+    limits(overrides={project.tracking_id: {'rate': 0, 'burst': 2}})
+
+    assert client.post('/api/events/batch', json=events(project, 2)).status_code == 200
+    single = client.post('/api/events', json=events(project, 1)[0])
+    batch = client.post('/api/events/batch', json=events(project, 2))
+
+    assert single.status_code == batch.status_code == 429
+    assert single.headers['Retry-After'] == batch.headers['Retry-After'] == str(int(BLOCKED_RETRY_AFTER))
+    assert b'Infinity' not in batch.get_data()
+    assert {result['retry_after'] for result in batch.get_json()['results']} == {BLOCKED_RETRY_AFTER}
+
+def test_batch_larger_than_burst_gets_413(client, project, limits, clock):
+    limits(rate=10, burst=5)
+
+    response = client.post('/api/events/batch', json=events(project, 6))
+    body = response.get_json()
+
+    assert response.status_code == 413
+    assert b'Infinity' not in response.get_data()
+    assert {result['status'] for result in body['results']} == {'too_large'}
+    assert body['accepted'] == 0
+    # The refused batch used none of the burst
+    assert client.post('/api/events/batch', json=events(project, 5)).status_code == 200
+
+def test_batch_over_rate_gets_429(client, project, limits, clock):
+    limits(rate=10, burst=5)
+
+    assert client.post('/api/events/batch', json=events(project, 5)).status_code == 200
+    response = client.post('/api/events/batch', json=events(project, 3))
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+    assert {result['status'] for result in response.get_json()['results']} == {'rate_limited'}
@@ -0,0 +1,90 @@
+import random
+from datetime import datetime, timedelta
+import pytest
+from app.models import db
+from app.services.event_types import event_type_cache
+from app.services.segments import event_segments
+from app.services.sketches import IdentitySketchService
+from app.services.time_buckets import TimeBucketer
+
+@pytest.fixture
+def segments(app, tmp_path):
+    event_segments.enabled = True
+    event_segments.root = str(tmp_path / 'segments')
+    yield event_segments
+    event_segments.enabled = False
+
+def scanned_identities(project_id, days):
+    scan = event_segments.scan(project_id, days)
+    return sorted(scan.identities[code] if code >= 0 else '' for code in scan.identity)
+
+def test_compacted_days_are_fresh_until_late_events(segments, project, store_events):
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    day = today - timedelta(days=3)
+    store_events([('view', 'user-1', None, day + timedelta(hours=1)), ('view', None, None, day + timedelta(hours=2))])
+
+    assert segments.compact(project.id) == (1, 2)
+    assert segments.fresh_days(project.id) == [day]
+    assert scanned_identities(project.id, [day]) == ['', 'user-1']
+
+    store_events([('view', 'user-2', None, day + timedelta(hours=3))])
+    db.session.commit()
+    assert segments.fresh_days(project.id) == []
+
+def test_stitching_history_makes_its_days_stale(segments, project, store_events):
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    stitched, untouched = today - timedelta(days=5), today - timedelta(days=4)
+    store_events([
+        ('view', None, 'anon-1', stitched + timedelta(hours=1)),
+        ('view', None, 'anon-2', untouched + timedelta(hours=1))
+    ])
+    segments.compact(project.id)
+    assert segments.fresh_days(project.id) == [stitched, untouched]
+
+    # anon-1 signs up today; its history of five days ago now belongs to user-1
+    store_events([('signup', 'user-1', 'anon-1', datetime.utcnow())])
+    db.session.commit()
+
+    assert segments.fresh_days(project.id) == [untouched]
+    assert segments.compact(project.id) == (1, 1)
+    assert segments.fresh_days(project.id) == [stitched, untouched]
+    assert scanned_identities(project.id, [stitched]) == ['user-1']
+
+def random_history(store_events, seed=3, days=20):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    store_events([
+        (rng.choice(['view', 'click']), rng.choice([f'user-{i}' for i in range(15)] + [None]), None,
+         now - timedelta(seconds=rng.randrange(days * 86400)))
+        for _ in range(400)
+    ])
+    db.session.commit()
+
+@pytest.mark.parametrize('granularity, timezone', [('day', 'Asia/Kolkata'), ('minute', 'UTC'), ('hour', 'Asia/Kathmandu')])
+def test_unaligned_counts_read_closed_days_from_segments(segments, project, store_events, granularity, timezone):
+    random_history(store_events)
+    now = datetime.utcnow()
+    tz = TimeBucketer.get_timezone(timezone)
+    start = now - (timedelta(hours=50) if granularity == 'minute' else timedelta(days=20))
+    bounds = TimeBucketer.boundaries(start, now, granularity, tz)
+    click = event_type_cache.id_for('click')
+
+    segments.enabled = False
+    expected = [TimeBucketer.counts(project.id, bounds, now), TimeBucketer.counts(project.id, bounds, now, click)]
+    segments.enabled = True
+    segments.compact(project.id)
+    assert segments.fresh_days(project.id, bounds[0], now)
+
+    assert [TimeBucketer.counts(project.id, bounds, now), TimeBucketer.counts(project.id, bounds, now, click)] == expected
+
+def test_exact_count_reads_closed_days_from_segments(segments, project, store_events):
+    random_history(store_events)
+    now = datetime.utcnow()
+    windows = [(now - timedelta(days=days), now - timedelta(days=days - width)) for days, width in [(20, 20), (15, 7), (3, 1)]]
+
+    segments.enabled = False
+    expected = [IdentitySketchService.exact_count(project.id, start, end) for start, end in windows]
+    segments.enabled = True
+    segments.compact(project.id)
+
+    assert [IdentitySketchService.exact_count(project.id, start, end) for start, end in windows] == expected
@@ -0,0 +1,138 @@
+import json
+import pickle
+import random
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+from app.models import db
+from app.models.insights import FeedbackSentiment, SentimentCheckpoint
+from app.services.event_processing import EventProcessingService
+from app.services.sentiment import SentimentAnalyzer, feedback_scorer
+
+@pytest.mark.parametrize('text, positive, negative', [
+    ('great, fast and reliable', 3, 0),
+    ('not great', 0, 1),
+    ('not very good', 0, 1),
+    # A negator flips one lexicon word...
+    ('not good, great', 1, 1),
+    ('never slow and always fast', 2, 0),
+    # ...within a few words...
+    ("I don't think it's bad", 1, 0),
+    ('never had a problem, love it', 1, 0),
+    ('never had any real problem here love it', 1, 0),
+    # ...and in its own clause
+    ('not great, but fast', 1, 1),
+    ('not great but fast', 1, 1),
+    ('not only good but great', 2, 0),
+    ('not just useful, it is fast', 2, 0),
+    ('no doubt the best', 1, 0),
+    # Whole words only
+    ('unlikely to butter nicely', 0, 0),
+])
+def test_negation_scope(text, positive, negative):
+    score, hits = SentimentAnalyzer.lexicon_score(text)
+
+    assert hits == positive + negative
+    assert score == pytest.approx((positive - negative) / hits if hits else 0.0)
+
+@pytest.mark.parametrize('text, expected', [
+    ("don't like it", 'negative'),
+    ('don’t like it', 'negative'),
+    ("it isn't bad", 'positive'),
+    ("wouldn't recommend", 'negative'),
+    ("can't complain, works great", 'positive'),
+    ('cannot recommend it', 'negative'),
+    ("didn't crash once", 'positive'),
+])
+def test_contracted_negators(text, expected):
+    assert SentimentAnalyzer().score([text])[0]['sentiment'] == expected
+
+def training_texts(labels, seed=1):
+    words = {
+        'positive': 'great love fast smooth helpful recommend easy amazing works support',
+        'negative': 'crash slow buggy terrible hate broken update support works design',
+        'neutral': 'app settings page menu button opened used today items clicked',
+    }
+    rng = random.Random(seed)
+    texts, targets = [], []
+    for _ in range(40):
+        for label in labels:
+            texts.append(' '.join(rng.sample(words[label].split(), 4)))
+            targets.append(label)
+    return texts, targets
+
+@pytest.mark.parametrize('labels', [('positive', 'negative', 'neutral'), ('positive', 'negative')])
+def test_saved_model_is_json_and_scores_like_the_trained_one(tmp_path, labels):
+    pytest.importorskip('sklearn')
+    model = SentimentAnalyzer.train(*training_texts(labels))
+    path = tmp_path / 'sentiment.json'
+
+    SentimentAnalyzer.save_model(model, path)
+    restored = SentimentAnalyzer.load_model(path)
+
+    assert set(json.loads(path.read_text())) == {'vectorizer', 'classifier'}
+    assert list(restored.classes_) == list(model.classes_)
+    probes = ['love it, really fast', 'slow crash after the update', 'unknown words only', 'GREAT great Great', '']
+    assert np.allclose(restored.predict_proba(probes), model.predict_proba(probes))
+
+def test_pickled_models_are_not_loaded(app, tmp_path):
+    path = tmp_path / 'sentiment.pkl'
+    path.write_bytes(pickle.dumps({'classes_': ['positive']}))
+    app.config['SENTIMENT_MODEL_PATH'] = str(path)
+    analyzer = SentimentAnalyzer()
+
+    analyzer.init_app(app)
+
+    # Falls back to the lexicon
+    assert analyzer.model is None
+    assert analyzer.score(['great'])[0]['sentiment'] == 'positive'
+
+@pytest.fixture
+def scorer(app, monkeypatch):
+    monkeypatch.setattr(feedback_scorer, 'properties', ('feedback', 'review'))
+    monkeypatch.setattr(feedback_scorer, 'batch_size', 2)
+    return feedback_scorer
+
+def store_feedback(project, texts):
+    now = datetime.utcnow()
+    EventProcessingService.store_events([{
+        'project_id': project.id, 'event_name': 'survey', 'user_id': 'user-1', 'anonymous_id': None,
+        'properties': properties, 'timestamp': now - timedelta(minutes=index)
+    } for index, properties in enumerate(texts)])
+
+def test_score_new_resumes_from_its_checkpoint(project, scorer):
+    store_feedback(project, [{'feedback': 'love it'}, {'page': '/home'}, {'review': 'too slow'},
+                             {'feedback': ''}, {'feedback': 'great support'}])
+
+    assert scorer.score_new() == 3
+    checkpoint = db.session.get(SentimentCheckpoint, 'events')
+    assert checkpoint.last_event_id == 5
+    assert scorer.score_new() == 0
+
+    store_feedback(project, [{'review': 'buggy'}, {'feedback': 'thanks'}])
+    assert scorer.score_new() == 2
+    assert db.session.get(SentimentCheckpoint, 'events').last_event_id == 7
+    labels = {row.event_id: (row.property, row.label) for row in FeedbackSentiment.query}
+    assert labels == {1: ('feedback', 'positive'), 3: ('review', 'negative'), 5: ('feedback', 'positive'),
+                      6: ('review', 'negative'), 7: ('feedback', 'positive')}
+
+def test_score_new_does_not_score_twice_after_a_crash(project, scorer, monkeypatch):
+    store_feedback(project, [{'feedback': 'love it'}, {'feedback': 'hate it'}, {'feedback': 'nice'}])
+    store = scorer._store
+    calls = []
+
+    def crash_on_second_batch(rows):
+        calls.append(len(rows))
+        if len(calls) == 2:
+            raise RuntimeError('worker died')
+        return store(rows)
+    monkeypatch.setattr(scorer, '_store', crash_on_second_batch)
+
+    with pytest.raises(RuntimeError):
+        scorer.score_new()
+    db.session.rollback()
+    monkeypatch.setattr(scorer, '_store', store)
+
+    # The first batch was committed with its checkpoint; only the rest is scored again
+    assert scorer.score_new() == 1
+    assert FeedbackSentiment.query.count() == 3
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+import pytest
+from app.models import db
+from app.models.rollup import IdentitySketch
+from app.services.analytics import AnalyticsService
+from app.services.event_processing import EventProcessingService
+from app.services.sketches import IdentitySketchService
+from app.utils.hll import HyperLogLog
+
+@pytest.fixture
+def hours_ago():
+    now = datetime.utcnow()
+    return lambda hours: now - timedelta(hours=hours)
+
+def test_active_users_switch_from_exact_to_estimate(app, project, store_events, hours_ago):
+    store_events([('view', f'user-{i}', None, hours_ago(i % 20 + 1)) for i in range(3000)])
+    store_events([('view', f'user-{i}', None, hours_ago(30)) for i in range(500)])
+
+    app.config['ACTIVE_USERS_EXACT_THRESHOLD'] = 5000
+    exact = AnalyticsService.get_active_users(project.id, 'day')
+    app.config['ACTIVE_USERS_EXACT_THRESHOLD'] = 1000
+    estimate = AnalyticsService.get_active_users(project.id, 'day')
+
+    assert exact['exact'] and exact['error_bound'] == 0
+    assert (exact['count'], exact['change']) == (3000, 2500)
+    assert not estimate['exact']
+    assert estimate['error_bound'] == round(HyperLogLog(12).relative_error, 4)
+    assert abs(estimate['count'] - 3000) <= 3 * estimate['error_bound'] * 3000
+    # Pinned either way regardless of the threshold
+    assert AnalyticsService.get_active_users(project.id, 'day', exact=True)['count'] == 3000
+
+def test_window_sketch_merges_across_a_precision_change(app, project, store_events, hours_ago):
+    store_events([('view', f'user-{i}', None, hours_ago(2)) for i in range(2000)])
+    app.config['HLL_PRECISION'] = 14
+    store_events([('view', f'user-{i}', None, hours_ago(2)) for i in range(1000, 4000)])
+    app.config['HLL_PRECISION'] = 10
+    store_events([('view', f'user-{i}', None, hours_ago(3)) for i in range(3000, 5000)])
+
+    sketch = IdentitySketchService.window_sketch(project.id, hours_ago(5), hours_ago(1))
+
+    assert sketch.p == 10
+    assert abs(sketch.count() - 5000) <= 3 * sketch.relative_error * 5000
+    stored = {HyperLogLog.from_bytes(registers).p for registers, in db.session.query(IdentitySketch.registers)}
+    # Written at 12, folded to 12 when merged at 14; the later hour was created at 10
+    assert stored == {12, 10}
+
+def stored_sketches():
+    return {(row.granularity, row.bucket): row.registers for row in IdentitySketch.query}
+
+def test_covered_identities_skip_the_stored_sketch(project, store_events, hours_ago, monkeypatch):
+    store_events([('view', f'user-{i}', None, hours_ago(2)) for i in range(200)])
+    before = stored_sketches()
+    skipped = IdentitySketchService.skipped
+
+    def fail(sketches):
+        raise AssertionError('stored sketches were read')
+    monkeypatch.setattr(IdentitySketchService, '_merge_into_stored', fail)
+    store_events([('click', f'user-{i}', None, hours_ago(2)) for i in range(0, 200, 7)])
+
+    assert IdentitySketchService.skipped == skipped + 2
+    assert stored_sketches() == before
+
+def test_rolled_back_sketches_are_not_trusted(project, store_events, hours_ago):
+    EventProcessingService.insert_events([{
+        'project_id': project.id, 'event_name': 'view', 'properties': {},
+        'user_id': 'user-1', 'anonymous_id': None, 'timestamp': hours_ago(2)
+    }])
+    db.session.rollback()
+
+    store_events([('view', 'user-1', None, hours_ago(2))])
+
+    assert IdentitySketchService.window_sketch(project.id, hours_ago(3), hours_ago(1)).count() == 1
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+import pytest
+from app.services.time_buckets import TimeBucketer
+
+NEW_YORK = TimeBucketer.get_timezone('America/New_York')
+KOLKATA = TimeBucketer.get_timezone('Asia/Kolkata')
+
+def test_days_follow_the_wall_clock_across_dst():
+    # New York springs forward on 2024-03-10 and falls back on 2024-11-03
+    spring = TimeBucketer.boundaries(datetime(2024, 3, 9, 12), datetime(2024, 3, 11, 12), 'day', NEW_YORK)
+    autumn = TimeBucketer.boundaries(datetime(2024, 11, 2, 12), datetime(2024, 11, 4, 12), 'day', NEW_YORK)
+
+    assert spring == [datetime(2024, 3, 9, 5), datetime(2024, 3, 10, 5), datetime(2024, 3, 11, 4)]
+    assert [b - a for a, b in zip(spring, spring[1:])] == [timedelta(hours=24), timedelta(hours=23)]
+    assert autumn == [datetime(2024, 11, 2, 4), datetime(2024, 11, 3, 4), datetime(2024, 11, 4, 5)]
+    assert [b - a for a, b in zip(autumn, autumn[1:])] == [timedelta(hours=24), timedelta(hours=25)]
+    assert TimeBucketer.labels(autumn, 'day', NEW_YORK) == ['2024-11-02', '2024-11-03', '2024-11-04']
+
+def test_hours_neither_skip_nor_repeat_across_dst():
+    spring = TimeBucketer.boundaries(datetime(2024, 3, 10, 5), datetime(2024, 3, 10, 9), 'hour', NEW_YORK)
+    autumn = TimeBucketer.boundaries(datetime(2024, 11, 3, 4), datetime(2024, 11, 3, 8), 'hour', NEW_YORK)
+
+    assert spring == [datetime(2024, 3, 10, hour) for hour in range(5, 9)]
+    # 02:00 does not exist in spring...
+    assert TimeBucketer.labels(spring, 'hour', NEW_YORK) == ['2024-03-10 00:00', '2024-03-10 01:00',
+                                                            '2024-03-10 03:00', '2024-03-10 04:00']
+    # ...and 01:00 happens twice in autumn
+    assert TimeBucketer.labels(autumn, 'hour', NEW_YORK) == ['2024-11-03 00:00', '2024-11-03 01:00',
+                                                            '2024-11-03 01:00', '2024-11-03 02:00']
+
+@pytest.mark.parametrize('granularity, expected', [
+    ('hour', [datetime(2024, 5, 1, 2, 30), datetime(2024, 5, 1, 3, 30), datetime(2024, 5, 1, 4, 30)]),
+    ('day', [datetime(2024, 4, 30, 18, 30), datetime(2024, 5, 1, 18, 30)]),
+])
+def test_half_hour_offset_zones_align_to_local_boundaries(granularity, expected):
+    # 08:10 in Kolkata (UTC+05:30) is 02:40 UTC
+    bounds = TimeBucketer.boundaries(datetime(2024, 5, 1, 2, 40), expected[-1] + timedelta(minutes=1), granularity, KOLKATA)
+
+    assert bounds == expected
+    local_starts = [TimeBucketer.to_local(bound, KOLKATA) for bound in bounds]
+    assert all(start.minute == 0 for start in local_starts)
+
+def test_weeks_start_on_local_monday_midnight():
+    # Wednesday 2024-03-06 to Wednesday 2024-03-20, across New York's spring change
+    bounds = TimeBucketer.boundaries(datetime(2024, 3, 6, 15), datetime(2024, 3, 20, 15), 'week', NEW_YORK)
+
+    assert bounds == [datetime(2024, 3, 4, 5), datetime(2024, 3, 11, 4), datetime(2024, 3, 18, 4)]
+    assert [TimeBucketer.to_local(bound, NEW_YORK) for bound in bounds] == [
+        datetime(2024, 3, 4), datetime(2024, 3, 11), datetime(2024, 3, 18)
+    ]
+
+def test_unknown_inputs_are_rejected():
+    with pytest.raises(ValueError):
+        TimeBucketer.get_timezone('Mars/Olympus_Mons')
+    with pytest.raises(ValueError):
+        TimeBucketer.boundaries(datetime(2024, 1, 1), datetime(2024, 1, 2), 'fortnight', NEW_YORK)
+
+def test_counts_are_zero_filled_across_dst(project, store_events):
+    start, end = datetime(2024, 11, 2, 4), datetime(2024, 11, 5, 5)
+    # Local times 00:30 on the 2nd, 01:00 and 01:30 EDT, 01:10 EST, 23:30 EST on the 3rd
+    times = [datetime(2024, 11, 2, 4, 30), datetime(2024, 11, 3, 5, 0), datetime(2024, 11, 3, 5, 30),
+             datetime(2024, 11, 3, 6, 10), datetime(2024, 11, 4, 4, 30)]
+    store_events([('view', 'user-1', None, timestamp) for timestamp in times])
+
+    days = TimeBucketer.boundaries(start, end, 'day', NEW_YORK)
+    hours = TimeBucketer.boundaries(start, end, 'hour', NEW_YORK)
+    hourly = TimeBucketer.counts(project.id, hours, end)
+
+    # The 25-hour day of the change holds everything from its midnight to the next
+    assert TimeBucketer.counts(project.id, days, end) == [1, 4, 0]
+    # 24 + 25 + 24 hours; both 01:00 hours of the 3rd are buckets of their own
+    assert len(hours) == 73
+    assert {index: count for index, count in enumerate(hourly) if count} == {0: 1, 25: 2, 26: 1, 48: 1}
+    assert TimeBucketer.labels(hours[25:27], 'hour', NEW_YORK) == ['2024-11-03 01:00', '2024-11-03 01:00']
+
+def test_half_hour_offset_counts_split_at_local_midnight(project, store_events):
+    start, end = datetime(2024, 4, 29, 18, 30), datetime(2024, 5, 2, 18, 30)
+    # One minute either side of Kolkata midnight (18:30 UTC) on the 1st
+    times = [datetime(2024, 4, 30, 18, 29), datetime(2024, 4, 30, 18, 31), datetime(2024, 5, 1, 2, 40)]
+    store_events([('view', 'user-1', None, timestamp) for timestamp in times])
+
+    days = TimeBucketer.boundaries(start, end, 'day', KOLKATA)
+
+    assert TimeBucketer.labels(days, 'day', KOLKATA) == ['2024-04-30', '2024-05-01', '2024-05-02']
+    assert TimeBucketer.counts(project.id, days, end) == [1, 2, 0]